@@ -0,0 +1,210 @@
+from collections import Counter
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from derived_state import DerivedState
+from schema import apply_types
+
+# Breakdown duration classes and 5M root-cause categories, as labelled on the CAPA form
+DURATION_CLASSES = {"A": "≥ 4 Hrs", "B": "2 - 4 Hrs", "C": "1 - 2 Hrs", "D": "≤ 1 Hrs"}
+ROOT_CAUSES = {"M1": "Material", "M2": "Man", "M3": "Machine", "M4": "Measure", "M5": "Method"}
+# Target / completion date pairs of the corrective and preventive actions
+ACTION_DATES = {"corrective": ("T1", "D1"), "preventive": ("T2", "D2")}
+
+# Columns read from storage to maintain the counters
+ANALYTICS_COLUMNS = (["CAPA_NO", "DEPARTMENT", "AREA_SECTION", "DATE_OF_INCIDENT"]
+                     + list(DURATION_CLASSES) + list(ROOT_CAUSES) + ["T1", "D1", "T2", "D2"])
+
+
+def _labels(series: pd.Series) -> pd.Series:
+    labels = series.astype(str).str.strip()
+    return labels.mask(labels.isin(["", "nan"]), "(blank)")
+
+
+def _values_of(rows: List[Dict[str, str]]) -> List[List[str]]:
+    return [[row.get(c) or "" for c in ANALYTICS_COLUMNS] for row in rows]
+
+
+def _contributions(values: List[List[str]]) -> List[List]:
+    """
+    What each row adds to the counters: [department, area, incident month, duration
+    class, ticked root causes, CAPA_NO, then the target date of each open action or
+    None]. Rows with the same contribution count the same, so it is their fingerprint.
+    """
+    if not values:
+        return []
+    df = apply_types(pd.DataFrame(values, columns=ANALYTICS_COLUMNS))
+    dept, area = _labels(df["DEPARTMENT"]), _labels(df["AREA_SECTION"])
+    month = [m or "(undated)" for m in _format_dates(df["DATE_OF_INCIDENT"], "%Y-%m")]
+    # the first ticked class wins if a row has several
+    ticked = df[list(DURATION_CLASSES)]
+    duration = ticked.idxmax(axis=1).where(ticked.any(axis=1), "(none)")
+    causes = [[k for k, on in zip(ROOT_CAUSES, flags) if on] for flags in df[list(ROOT_CAUSES)].to_numpy().tolist()]
+    targets = []
+    for target_col, done_col in ACTION_DATES.values():
+        # "None", "TBD" and other non-dates in D1/D2 leave the action open
+        is_open = df[done_col].isna().tolist()
+        dates = _format_dates(df[target_col], "%Y-%m-%d")
+        targets.append([d if o else None for d, o in zip(dates, is_open)])
+    capa = df["CAPA_NO"].astype(str).tolist()
+    return [list(c) for c in zip(dept.tolist(), area.tolist(), month, duration.tolist(), causes, capa, *targets)]
+
+
+def _format_dates(dates: pd.Series, fmt: str) -> List[Optional[str]]:
+    # a register has few distinct dates, so format each once (None for NaT)
+    codes, uniques = pd.factorize(dates)
+    labels = [ts.strftime(fmt) for ts in uniques]
+    return [labels[c] if c >= 0 else None for c in codes.tolist()]
+
+
+def _decrement(counter: Counter, key: str):
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+
+class CapaStats(DerivedState):
+    """
+    Pre-aggregated CAPA counters, built incrementally like text_index.TextIndex:
+    rows are added in storage order per segment and 'row_counts' is the watermark
+    of rows already counted; rows edited since are re-counted with update_rows().
+    Actions with a target date and no completion date are kept individually, so
+    which ones are overdue is decided at render time.
+    """
+
+    def __init__(self, source: str = ""):
+        super().__init__(source)
+        self.total = 0
+        self.by_department: Counter = Counter()
+        self.by_area: Counter = Counter()
+        self.by_month_department: Dict[str, Counter] = {}
+        self.duration: Counter = Counter()
+        self.root_causes: Counter = Counter()
+        self.root_causes_by_area: Dict[str, Counter] = {}
+        # kind -> "segment:position" -> [capa_no, department, target date]
+        self.open_actions: Dict[str, Dict[str, List[str]]] = {kind: {} for kind in ACTION_DATES}
+
+    def add_rows(self, start: int, rows: List[Dict[str, str]], segment: str = ""):
+        """Count rows of 'segment' starting at position 'start' (must equal indexed(segment))."""
+        self._record({"segment": segment, "start": start, "rows": _values_of(rows)})
+
+    def update_rows(self, start: int, rows: List[Dict[str, str]], segment: str = "") -> int:
+        """Re-count the already counted rows from 'start' whose counted values changed; returns how many."""
+        values = _values_of(rows)
+        changed = self._changed(segment, start, _contributions(values))
+        if changed:
+            self._record({"op": "replace", "segment": segment, "positions": changed,
+                          "rows": [values[p - start] for p in changed]})
+        return len(changed)
+
+    def _apply(self, entry: Dict):
+        segment, rows = entry["segment"], entry["rows"]
+        contributions = _contributions(rows)
+        fingerprints = self.fingerprints.setdefault(segment, [])
+        if entry.get("op") == "replace":
+            positions = entry["positions"]
+            if any(p >= self.indexed(segment) for p in positions):
+                raise ValueError(f"Stats hold {self.indexed(segment)} rows of '{segment}', cannot replace {max(positions)}")
+            for p in positions:
+                self._uncount(f"{segment}:{p}", fingerprints[p])
+        else:
+            start = entry["start"]
+            if start != self.indexed(segment):
+                raise ValueError(f"Stats hold {self.indexed(segment)} rows of '{segment}', cannot add at {start}")
+            positions = range(start, start + len(rows))
+            fingerprints.extend([None] * len(rows))
+            self.row_counts[segment] = start + len(rows)
+        for p, contribution in zip(positions, contributions):
+            fingerprints[p] = contribution
+        self._count([f"{segment}:{p}" for p in positions], contributions)
+
+    def _count(self, docs: List[str], contributions: List[List]):
+        """Add rows' contributions (see _contributions) to the counters."""
+        self.total += len(contributions)
+        self.by_department.update(c[0] for c in contributions)
+        self.by_area.update(c[1] for c in contributions)
+        for (month, dept), n in Counter((c[2], c[0]) for c in contributions).items():
+            self.by_month_department.setdefault(month, Counter())[dept] += n
+        self.duration.update(c[3] for c in contributions)
+        for doc, (dept, area, _, _, causes, capa, *targets) in zip(docs, contributions):
+            area_causes = self.root_causes_by_area.setdefault(area, Counter())
+            for k in causes:
+                self.root_causes[k] += 1
+                area_causes[k] += 1
+            for kind, target in zip(ACTION_DATES, targets):
+                if target:
+                    self.open_actions[kind][doc] = [capa, dept, target]
+
+    def _uncount(self, doc: str, contribution: List):
+        """Take one row's contribution back out of the counters."""
+        dept, area, month, duration, causes = contribution[:5]
+        self.total -= 1
+        _decrement(self.by_department, dept)
+        _decrement(self.by_area, area)
+        _decrement(self.by_month_department[month], dept)
+        if not self.by_month_department[month]:
+            del self.by_month_department[month]
+        _decrement(self.duration, duration)
+        for k in causes:
+            _decrement(self.root_causes, k)
+            _decrement(self.root_causes_by_area[area], k)
+        if area not in self.by_area:
+            del self.root_causes_by_area[area]
+        for actions in self.open_actions.values():
+            actions.pop(doc, None)
+
+    def overdue(self, today: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+        """Open corrective/preventive actions whose target date is before 'today'."""
+        today = (pd.Timestamp.today() if today is None else today).normalize()
+        with self.lock:
+            rows = [{"CAPA_NO": capa, "DEPARTMENT": dept, "ACTION": kind, "TARGET_DATE": target}
+                    for kind, actions in self.open_actions.items() for capa, dept, target in actions.values()]
+        df = pd.DataFrame(rows, columns=["CAPA_NO", "DEPARTMENT", "ACTION", "TARGET_DATE"])
+        df["TARGET_DATE"] = pd.to_datetime(df["TARGET_DATE"])
+        df = df[df["TARGET_DATE"] < today].copy()
+        df["DAYS_OVERDUE"] = (today - df["TARGET_DATE"]).dt.days
+        return df.sort_values("DAYS_OVERDUE", ascending=False, kind="stable")
+
+    def summary(self) -> Dict[str, pd.DataFrame]:
+        """Counter tables for the dashboard; each is small regardless of the number of records."""
+        with self.lock:
+            months = sorted(self.by_month_department)
+            return {
+                "by_department": _counts(self.by_department, "DEPARTMENT"),
+                "by_area": _counts(self.by_area, "AREA_SECTION"),
+                "by_month": pd.DataFrame({m: dict(self.by_month_department[m]) for m in months}).T.fillna(0).astype(int),
+                "duration": pd.DataFrame(
+                    [{"CLASS": DURATION_CLASSES.get(k, k), "CAPAs": self.duration.get(k, 0)}
+                     for k in list(DURATION_CLASSES) + ["(none)"]]),
+                "root_causes": pd.DataFrame(
+                    [{"ROOT_CAUSE": f"{label} ({k})", "CAPAs": self.root_causes.get(k, 0)}
+                     for k, label in ROOT_CAUSES.items()]),
+                "root_causes_by_area": pd.DataFrame(
+                    {area: {f"{ROOT_CAUSES[k]} ({k})": n for k, n in c.items()}
+                     for area, c in self.root_causes_by_area.items()}).T.fillna(0).astype(int),
+            }
+
+    def _state(self) -> Dict:
+        return {
+            "total": self.total,
+            "by_department": self.by_department,
+            "by_area": self.by_area,
+            "by_month_department": self.by_month_department,
+            "duration": self.duration,
+            "root_causes": self.root_causes,
+            "root_causes_by_area": self.root_causes_by_area,
+            "open_actions": self.open_actions,
+        }
+
+    def _restore(self, data: Dict):
+        self.total = data["total"]
+        for name in ("by_department", "by_area", "duration", "root_causes"):
+            setattr(self, name, Counter(data[name]))
+        self.by_month_department = {k: Counter(v) for k, v in data["by_month_department"].items()}
+        self.root_causes_by_area = {k: Counter(v) for k, v in data["root_causes_by_area"].items()}
+        self.open_actions = data["open_actions"]
+
+
+def _counts(counter: Counter, column: str) -> pd.DataFrame:
+    return pd.DataFrame(counter.most_common(), columns=[column, "CAPAs"])
@@ -1,16 +1,41 @@
+import os
 import streamlit as st
 import pandas as pd
 import datetime as dt
+from io import BytesIO
 
-from drive_helper import append_row, query_records, find_by_capa_no
-from pdf_generator import generate_capa_pdf   # <-- use your new generator
+import metrics
+from bulk_export import export_zip
+from bulk_import import import_file
+from export import export_to_file
+from drive_helper import analytics_summary, query_records, find_by_capa_no, capa_exists, refresh_records
+from pdf_cache import get_cached_pdf, cache_stats
+from pdf_generator import PDF_BACKEND, template_drift, template_pool_stats
+from write_queue import enqueue_row, is_queued, queue_counts, retry_failed, start_flusher
 
 st.set_page_config(page_title="CAPA Portal (New)", layout="wide")
+# Record the Google API calls made by this rerun for the performance panel
+metrics.start_trace()
+metrics.start_exporter()
 st.title("CAPA Portal")
 st.write("Please fill the CAPA form")
 
 # Simple sidebar navigation
-mode = st.sidebar.radio("Mode", ["New CAPA", "Search & Download"])
+mode = st.sidebar.radio("Mode", ["New CAPA", "Search & Download", "Analytics"])
+
+if st.sidebar.button("🔄 Refresh data"):
+    try:
+        refresh_records(full=True)
+        st.sidebar.success("Reloaded CAPA records from Google Sheet")
+    except Exception as e:
+        st.sidebar.error(f"Refresh failed: {e}")
+
+# Submissions are journaled locally and written to the sheet in the background
+start_flusher()
+counts = queue_counts()
+st.sidebar.caption(f"Sheet sync: {counts['pending']} pending, {counts['failed']} failed")
+if counts["failed"] and st.sidebar.button("Retry failed saves"):
+    st.sidebar.info(f"Requeued {retry_failed()} submission(s)")
 
 
 def now_iso():
@@ -171,7 +196,7 @@ if mode == "New CAPA":
             row = {
                 "DEPARTMENT": department,
                 "AREA_SECTION": area_section,
-                "DATE_OF_INCIDENT": str(date_of_incident),
+                "DATE_OF_INCIDENT": date_of_incident,
                 "CAPA_NO": capa_no.strip(),
                 "WHAT": problem_what,
                 "WHERE": problem_where,
@@ -215,12 +240,12 @@ if mode == "New CAPA":
                 "CONCLUSION": conclusion,
                 "C_ACTIONS": corrective_actions,
                 "RES1": corrective_resp,
-                "T1": str(corrective_target_date),
-                "D1": str(corrective_impl_date),
+                "T1": corrective_target_date,
+                "D1": corrective_impl_date,
                 "P_ACTIONS": preventive_actions,
                 "RES2": preventive_resp,
-                "T2": str(preventive_target_date),
-                "D2": str(preventive_impl_date),
+                "T2": preventive_target_date,
+                "D2": preventive_impl_date,
                 "PLAN": implementation_plan,
                 "O1": "YES" if d1 else "",
                 "O2": "YES" if d2 else "",
@@ -229,21 +254,45 @@ if mode == "New CAPA":
                 "O5": "YES" if d5 else "",
                 "OTHERS": others_text,
                 "TRAINING_DETAILS": training_details,
-                "DATE_IMPLE": str(date_of_implementation),
+                "DATE_IMPLE": date_of_implementation,
                 "EFFECTIVENESS_EVAL": effectiveness_evaluation,
                 "INITIATOR": prepared_by,
                 "REVIEWER": reviewed_by,
                 "HOD": approved_by,
             }
             try:
-                append_row(row)
-                st.success(f"Saved CAPA {capa_no} to Google Sheet ✅")
+                if is_queued(row["CAPA_NO"]) or capa_exists(row["CAPA_NO"]):
+                    st.error(f"CAPA {row['CAPA_NO']} already exists.")
+                else:
+                    enqueue_row(row)
+                    st.success(f"Saved CAPA {capa_no} ✅ — syncing to Google Sheet in the background")
+            except Exception as e:
+                st.error(f"Failed to save CAPA: {e}")
+
+    # --- Bulk import of legacy records ---
+    with st.expander("📤 Import legacy CAPAs (CSV / Excel)"):
+        st.caption("Columns are matched to the CAPA fields by name. Rows already saved are skipped, "
+                   "so an interrupted import can be resumed by uploading the same file again.")
+        upload = st.file_uploader("CAPA export", type=["csv", "xlsx"])
+        dayfirst = st.checkbox("Dates are day first (03/04/2021 = 3 April)")
+        if upload is not None and st.button("Import"):
+            bar = st.progress(0.0, text="Importing...")
+            try:
+                result = import_file(
+                    upload, name=upload.name, dayfirst=dayfirst,
+                    progress=lambda done, total: bar.progress(min(1.0, done / max(total, 1)),
+                                                              text=f"{done}/{total} rows"),
+                )
+                st.success(f"Imported {result['imported']} CAPA(s); skipped {result['duplicates']} duplicate(s) "
+                           f"and {result['invalid']} invalid row(s).")
+                if result["rejects"]:
+                    st.dataframe(pd.DataFrame(result["rejects"]), hide_index=True)
             except Exception as e:
-                st.error(f"Failed to save to Google Sheet: {e}")
+                st.error(f"Import stopped: {e}. Upload the same file again to resume.")
 
 
 # -------------------- Search & Download --------------------
-else:
+elif mode == "Search & Download":
     st.header("Search & Download CAPA PDF")
 
     col1, col2, col3 = st.columns(3)
@@ -260,6 +309,10 @@ else:
     with col5:
         end_date = st.date_input("End Date", value=None)
 
+    search_keywords = st.text_input(
+        "Keywords", placeholder="e.g. seal leakage — searches why-why analysis, conclusion and actions"
+    )
+
     if st.button("Search"):
         try:
             df = query_records(
@@ -267,39 +320,191 @@ else:
                 area=search_area,
                 start_date=(str(start_date) if start_date else None),
                 end_date=(str(end_date) if end_date else None),
+                text=search_keywords,
             )
             if search_capa:
                 df = df[df["CAPA_NO"].astype(str).str.contains(search_capa, case=False, na=False)]
-            if df.empty:
-                st.info("No results.")
-            else:
-                st.write(f"Found {len(df)} records")
-                df_display = df[["CAPA_NO", "DEPARTMENT", "AREA_SECTION", "DATE_OF_INCIDENT"]].copy()
-                df_display["DATE_OF_INCIDENT"] = pd.to_datetime(
-                    df_display["DATE_OF_INCIDENT"], errors="coerce"
-                ).dt.date
-                st.dataframe(df_display)
-
-                for _, r in df.iterrows():
-                    st.markdown("---")
-                    st.write(
-                        f"**CAPA:** {r['CAPA_NO']} — Department: {r['DEPARTMENT']} — Area: {r['AREA_SECTION']} — Incident: {r['DATE_OF_INCIDENT']}"
-                    )
+            # Keep results across reruns so per-row actions don't clear the page
+            st.session_state["search_results"] = df
+            st.session_state["prepared_pdfs"] = {}
+            st.session_state.pop("zip_export", None)
+        except Exception as e:
+            st.session_state.pop("search_results", None)
+            st.error(f"Search failed: {e}")
 
-                    record = find_by_capa_no(r["CAPA_NO"])
-                    if not record:
-                        st.error("Could not read this CAPA row.")
+    df = st.session_state.get("search_results")
+    if df is not None:
+        if df.empty:
+            st.info("No results.")
+        else:
+            st.write(f"Found {len(df)} records")
+            shown = ["CAPA_NO", "DEPARTMENT", "AREA_SECTION", "DATE_OF_INCIDENT"]
+            if "SCORE" in df.columns:
+                shown.append("SCORE")
+            df_display = df[shown].copy()
+            df_display["DATE_OF_INCIDENT"] = pd.to_datetime(
+                df_display["DATE_OF_INCIDENT"], errors="coerce"
+            ).dt.date
+            st.dataframe(df_display)
+
+            if st.button("📦 Download all as ZIP", key="zip_all"):
+                bar = st.progress(0.0, text="Generating PDFs...")
+
+                def _on_progress(done, total):
+                    bar.progress(done / total if total else 1.0, text=f"Generated {done}/{total} PDFs")
+
+                try:
+                    buf = BytesIO()
+                    summary = export_zip(df, buf, progress=_on_progress)
+                    st.session_state["zip_export"] = buf.getvalue()
+                    if summary["failed"]:
+                        st.warning(f"{len(summary['failed'])} PDF(s) could not be generated; see ERRORS.txt in the archive.")
+                except Exception as e:
+                    st.error(f"Bulk export failed: {e}")
+
+            if st.session_state.get("zip_export"):
+                st.download_button(
+                    label="📥 Download ZIP",
+                    data=st.session_state["zip_export"],
+                    file_name="capa_export.zip",
+                    mime="application/zip",
+                    key="download_zip"
+                )
+
+            # PDFs are only generated for the rows someone asks for
+            prepared = st.session_state.setdefault("prepared_pdfs", {})
+            for _, r in df.iterrows():
+                capa = str(r["CAPA_NO"])
+                st.markdown("---")
+                st.write(
+                    f"**CAPA:** {capa} — Department: {r['DEPARTMENT']} — Area: {r['AREA_SECTION']} — Incident: {r['DATE_OF_INCIDENT']}"
+                )
+
+                if capa not in prepared:
+                    if st.button(f"Prepare PDF — {capa}", key=f"prepare_{capa}"):
+                        try:
+                            record = find_by_capa_no(capa)
+                            if not record:
+                                st.error("Could not read this CAPA row.")
+                                continue
+                            with st.spinner(f"Generating PDF for {capa}..."):
+                                prepared[capa] = get_cached_pdf(record)
+                        except Exception as e:
+                            st.error(f"PDF generation failed: {e}")
+                            continue
+                    else:
                         continue
 
-                    pdf_bytes = generate_capa_pdf(record)
-
+                st.download_button(
+                    label=f"📥 Download PDF — {capa}",
+                    data=prepared[capa],
+                    file_name=f"{capa}.pdf",
+                    mime="application/pdf",
+                    key=f"download_{capa}"
+                )
+
+            stats = cache_stats()
+            st.caption(f"PDF cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+
+    # --- Full register dump (every record, every column) ---
+    with st.expander("🗄 Export full CAPA register"):
+        export_format = st.radio("Format", ["csv", "parquet"], horizontal=True,
+                                 help="Parquet keeps typed columns (ticks as booleans, dates as dates)")
+        if st.button("Prepare export"):
+            previous = st.session_state.pop("register_export", None)
+            if previous and os.path.exists(previous[0]):
+                os.remove(previous[0])
+            status = st.empty()
+            try:
+                # written page by page to a file instead of being built in memory
+                path, rows = export_to_file(export_format, progress=lambda n: status.caption(f"{n} rows written"))
+                st.session_state["register_export"] = (path, export_format, rows)
+            except Exception as e:
+                st.error(f"Export failed: {e}")
+        if st.session_state.get("register_export"):
+            path, fmt, rows = st.session_state["register_export"]
+            if os.path.exists(path):
+                with open(path, "rb") as f:
                     st.download_button(
-                        label=f"📥 Download PDF — {r['CAPA_NO']}",
-                        data=pdf_bytes,
-                        file_name=f"{r['CAPA_NO']}.pdf",
-                        mime="application/pdf",
-                        key=f"download_{r['CAPA_NO']}"
+                        label=f"📥 Download {rows} records ({fmt.upper()})",
+                        data=f,
+                        file_name=f"capa_register_{dt.date.today().isoformat()}.{fmt}",
+                        mime="text/csv" if fmt == "csv" else "application/vnd.apache.parquet",
+                        key="download_register"
                     )
 
-        except Exception as e:
-            st.error(f"Search failed: {e}")
+
+# -------------------- Analytics --------------------
+else:
+    st.header("CAPA Analytics")
+    try:
+        summary = analytics_summary()
+    except Exception as e:
+        st.error(f"Failed to load analytics: {e}")
+        summary = None
+
+    if summary is not None:
+        overdue = summary["overdue"]
+        m1, m2, m3 = st.columns(3)
+        m1.metric("CAPAs", summary["total"])
+        m2.metric("Overdue corrective actions", int((overdue["ACTION"] == "corrective").sum()))
+        m3.metric("Overdue preventive actions", int((overdue["ACTION"] == "preventive").sum()))
+
+        st.subheader("CAPAs per month by department")
+        if summary["by_month"].empty:
+            st.caption("No CAPAs recorded yet.")
+        else:
+            st.bar_chart(summary["by_month"])
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.subheader("By department")
+            st.dataframe(summary["by_department"], hide_index=True)
+            st.subheader("Breakdown duration")
+            st.bar_chart(summary["duration"], x="CLASS", y="CAPAs")
+        with col2:
+            st.subheader("By area / section")
+            st.dataframe(summary["by_area"], hide_index=True)
+            st.subheader("Root cause (5M) recurrence")
+            st.bar_chart(summary["root_causes"], x="ROOT_CAUSE", y="CAPAs")
+
+        if not summary["root_causes_by_area"].empty:
+            st.subheader("Root causes by area / section")
+            st.dataframe(summary["root_causes_by_area"])
+
+        st.subheader("Overdue actions")
+        st.caption("Target date (T1/T2) passed with no completion date (D1/D2).")
+        if overdue.empty:
+            st.success("No overdue actions 🎉")
+        else:
+            st.dataframe(overdue.assign(TARGET_DATE=overdue["TARGET_DATE"].dt.date), hide_index=True)
+
+
+# -------------------- Performance panel (admin) --------------------
+if os.environ.get("CAPA_ADMIN_PANEL") == "1" or st.query_params.get("admin") == "1":
+    with st.sidebar.expander("⏱ Performance", expanded=False):
+        st.markdown("**Google API calls in this page view**")
+        trace = metrics.current_trace()
+        if trace:
+            st.dataframe(pd.DataFrame(trace), hide_index=True)
+        else:
+            st.caption("None — served from local caches.")
+        st.markdown("**Since process start**")
+        summary = metrics.summary_rows()
+        if summary:
+            st.dataframe(pd.DataFrame(summary), hide_index=True)
+        st.caption(f"Prometheus text metrics are written to `{metrics.METRICS_FILE}`.")
+        if PDF_BACKEND == "docs":
+            try:
+                drift = template_drift()
+            except Exception as e:
+                drift = None
+                st.caption(f"Template check failed: {e}")
+            if drift and drift["unfilled"]:
+                st.warning("Template placeholders with no sheet column: " + ", ".join(drift["unfilled"]))
+            if drift and drift["unused"]:
+                st.caption("Sheet columns not used by the template: " + ", ".join(drift["unused"]))
+            pool = template_pool_stats()
+            if pool:
+                st.caption(f"Template pool: {pool['ready']} ready, {pool['taken']} taken, {pool['missed']} missed, "
+                           f"{pool['deleted']} deleted, {pool['swept']} orphans swept")
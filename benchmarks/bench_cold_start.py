@@ -0,0 +1,51 @@
+"""
+Measure cold-start import time of the modules app.py loads at start-up.
+
+    python benchmarks/bench_cold_start.py --runs 5
+
+Each run imports the modules in a fresh interpreter, the way a new Streamlit
+process does, and the median wall-clock time is reported per module set.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported at the top of app.py (streamlit itself excluded)
+APP_MODULES = ["drive_helper", "pdf_generator", "pdf_cache", "bulk_export", "write_queue"]
+
+_PROBE = (
+    "import sys, time\n"
+    "t = time.perf_counter()\n"
+    "for name in sys.argv[1:]:\n"
+    "    __import__(name)\n"
+    "print(time.perf_counter() - t)\n"
+)
+
+
+def time_import(modules) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE, *modules],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    args = parser.parse_args()
+
+    cases = [[m] for m in APP_MODULES] + [APP_MODULES]
+    print(f"{'modules':<60} {'median ms':>10} {'max ms':>10}")
+    for modules in cases:
+        samples = [time_import(modules) for _ in range(args.runs)]
+        label = "all app.py imports" if len(modules) > 1 else modules[0]
+        print(f"{label:<60} {statistics.median(samples) * 1000:>10.1f} {max(samples) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare PDF throughput of the Google Docs and local rendering backends.
+
+    python benchmarks/bench_pdf_backends.py --count 10 --backends local,docs
+
+The docs backend needs the same credentials as the app and makes real API calls.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drive_helper import SHEET_COLUMNS  # noqa: E402
+from pdf_generator import TICK_KEYS, generate_capa_pdf_timed  # noqa: E402
+
+
+def sample_row(n: int) -> dict:
+    row = {col: f"{col.title()} value for benchmark row {n}" for col in SHEET_COLUMNS}
+    for key in TICK_KEYS:
+        row[key] = "YES" if hash((key, n)) % 2 else ""
+    row["CAPA_NO"] = f"BENCH-{n:05d}"
+    row["DATE_OF_INCIDENT"] = "2025-01-15"
+    row["ACTIONS"] = "Replaced the pump seal and re-torqued the flange bolts. " * 8
+    return row
+
+
+def run(backend: str, count: int) -> dict:
+    totals = []
+    start = time.perf_counter()
+    for n in range(count):
+        _, timings = generate_capa_pdf_timed(sample_row(n), backend=backend)
+        totals.append(timings["total"])
+    elapsed = time.perf_counter() - start
+    totals.sort()
+    return {
+        "backend": backend,
+        "pdfs": count,
+        "seconds": elapsed,
+        "pdfs_per_sec": count / elapsed if elapsed else float("inf"),
+        "p50_ms": totals[len(totals) // 2] * 1000,
+        "max_ms": totals[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=10, help="PDFs to generate per backend")
+    parser.add_argument("--backends", default="local,docs", help="comma-separated backends to compare")
+    args = parser.parse_args()
+
+    print(f"{'backend':<8} {'pdfs':>5} {'seconds':>9} {'pdfs/sec':>9} {'p50 ms':>9} {'max ms':>9}")
+    for backend in args.backends.split(","):
+        r = run(backend.strip(), args.count)
+        print(f"{r['backend']:<8} {r['pdfs']:>5} {r['seconds']:>9.2f} {r['pdfs_per_sec']:>9.2f} "
+              f"{r['p50_ms']:>9.1f} {r['max_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
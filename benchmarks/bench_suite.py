@@ -0,0 +1,172 @@
+"""
+Benchmark drive_helper and pdf_generator against the local Google API stand-in.
+
+    python benchmarks/bench_suite.py --sizes 1000,10000,100000 --latency 0.05
+
+For every sheet size the suite seeds a fake CAPA sheet, then times
+query_records, find_by_capa_no, append_row and generate_capa_pdf, and compares
+a full dump through get_all_records with the paged export.export_records. It
+reports API calls per operation, p50/p95 latency, injected errors and peak
+Python memory (tracemalloc).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import drive_helper  # noqa: E402
+import export  # noqa: E402
+import migrate_partitions  # noqa: E402
+import pdf_generator  # noqa: E402
+import scheduler  # noqa: E402
+from fake_google import FakeGoogle, install  # noqa: E402
+from schema import SHEET_COLUMNS  # noqa: E402
+
+DEPARTMENTS = ["Maintenance", "Production", "Quality", "Utilities", "Stores", "Safety"]
+AREAS = ["Boiler", "Packing", "Line 1", "Line 2", "Warehouse", "Lab"]
+
+
+def make_row(n: int, rng: random.Random) -> list:
+    row = {c: "" for c in SHEET_COLUMNS}
+    row.update({
+        "DEPARTMENT": rng.choice(DEPARTMENTS),
+        "AREA_SECTION": rng.choice(AREAS),
+        "DATE_OF_INCIDENT": f"{rng.randint(2019, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "CAPA_NO": f"CAPA-{n:06d}",
+        "WHAT": "Seal leakage observed on the transfer pump",
+        "ACTIONS": "Isolated the pump, replaced the mechanical seal and flushed the line. " * 3,
+        "WHY1": "Seal worn", "WHY2": "Lubrication missed", "CONCLUSION": "PM schedule gap",
+        "M3": "YES" if n % 3 == 0 else "", "A": "YES" if n % 4 == 0 else "",
+        "T1": "2025-03-01", "D1": "" if n % 5 == 0 else "2025-03-05",
+    })
+    return [row[c] for c in SHEET_COLUMNS]
+
+
+def reset_process_state():
+    """Forget every cache so the next call behaves like a fresh process."""
+    drive_helper.reset_clients()
+    drive_helper._snapshots.clear()
+    drive_helper._store = None
+
+
+def seed(g: FakeGoogle, rows: int, rng: random.Random):
+    g.spreadsheets.clear()
+    from fake_google import FakeSpreadsheet
+    sh = FakeSpreadsheet(g, drive_helper.SPREADSHEET_NAME)
+    g.spreadsheets[sh.id] = sh
+    sh.add_seeded_worksheet(drive_helper.WORKSHEET_NAME, [SHEET_COLUMNS] + [make_row(i, rng) for i in range(rows)])
+
+
+def measure(name: str, g: FakeGoogle, fn, repeat: int) -> dict:
+    g.reset_counters()
+    samples, errors = [], 0
+    tracemalloc.start()
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        try:
+            fn(i)
+        except Exception:
+            errors += 1
+        samples.append(time.perf_counter() - t0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))]
+    return {
+        "op": name,
+        "calls": sum(g.calls.values()) / repeat,
+        "injected": sum(g.errors.values()),
+        "errors": errors,
+        "p50_ms": statistics.median(samples) * 1000,
+        "p95_ms": p95 * 1000,
+        "peak_mb": peak / 1e6,
+    }
+
+
+def run_size(g: FakeGoogle, rows: int, repeat: int, cold: bool, rng: random.Random,
+             dump_repeat: int = 2) -> list:
+    saved = (g.latency, g.quota_error_rate)
+    g.latency, g.quota_error_rate = 0.0, 0.0
+    seed(g, rows, rng)
+    reset_process_state()
+    if drive_helper.PARTITION_SCHEME != "none":
+        migrate_partitions.migrate(drive_helper.PARTITION_SCHEME)
+        reset_process_state()
+    g.latency, g.quota_error_rate = saved
+
+    def maybe_cold():
+        if cold:
+            reset_process_state()
+
+    capas = [f"CAPA-{rng.randrange(rows):06d}" for _ in range(repeat)]
+    results = []
+
+    def q(i):
+        maybe_cold()
+        drive_helper.query_records(department=DEPARTMENTS[i % len(DEPARTMENTS)], start_date="2022-01-01")
+    results.append(measure("query_records", g, q, repeat))
+
+    def f(i):
+        maybe_cold()
+        drive_helper.find_by_capa_no(capas[i])
+    results.append(measure("find_by_capa_no", g, f, repeat))
+
+    def a(i):
+        maybe_cold()
+        drive_helper.append_row(dict(zip(SHEET_COLUMNS, make_row(rows + 1_000_000 + i, rng))))
+    results.append(measure("append_row", g, a, repeat))
+
+    record = dict(zip(SHEET_COLUMNS, make_row(0, rng)))
+
+    def p(i):
+        pdf_generator.generate_capa_pdf(record, backend="docs")
+    results.append(measure("generate_capa_pdf", g, p, repeat))
+
+    def d(i):
+        drive_helper.get_all_records()
+    results.append(measure("get_all_records", g, d, dump_repeat))
+
+    def e(i):
+        with open(os.devnull, "wb") as out:
+            export.export_records(out, "csv")
+    results.append(measure("export_records", g, e, dump_repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated sheet row counts")
+    parser.add_argument("--repeat", type=int, default=20, help="calls per operation")
+    parser.add_argument("--dump-repeat", type=int, default=2, help="calls per full-dump operation")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake API call")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="fraction of calls failing with 429")
+    parser.add_argument("--cold", action="store_true", help="drop process caches before every call")
+    parser.add_argument("--partition-scheme", choices=["none", "year", "quarter"], default="none",
+                        help="split the seeded sheet into date partitions first")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    g = FakeGoogle(latency=args.latency, quota_error_rate=args.quota_error_rate)
+    with tempfile.TemporaryDirectory() as tmp:
+        install(g, SHEET_COLUMNS, os.path.join(tmp, "sheet_ids.json"))
+        drive_helper.PARTITION_SCHEME = args.partition_scheme
+        drive_helper.PARTITION_DIRECTORY_PATH = os.path.join(tmp, "partitions.json")
+        # Measure the calls themselves, not the quota pacing (see bench_scheduler.py)
+        scheduler.configure(rates={"docs": 0, "drive": 0, "sheets": 0})
+        print(f"{'rows':>7} {'operation':<18} {'calls/op':>9} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'peak MB':>8} {'429s':>5} {'errors':>6}")
+        for size in [int(s) for s in args.sizes.split(",")]:
+            for r in run_size(g, size, args.repeat, args.cold, rng, args.dump_repeat):
+                print(f"{size:>7} {r['op']:<18} {r['calls']:>9.1f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+                      f"{r['peak_mb']:>8.1f} {r['injected']:>5} {r['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare the all-string record frame with the typed one built by schema.rows_to_dataframe.
+
+    python benchmarks/bench_typed_schema.py --rows 100000
+
+Reports memory per row (pandas deep memory usage) and the time of a typical
+search filter and a flag count on each representation.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd  # noqa: E402
+
+from bench_suite import make_row  # noqa: E402
+from schema import SHEET_COLUMNS, rows_to_dataframe  # noqa: E402
+from storage import filter_records  # noqa: E402
+
+
+def untyped_dataframe(rows) -> pd.DataFrame:
+    # Previous representation: every column a string, only DATE_OF_INCIDENT parsed
+    df = pd.DataFrame(rows, columns=SHEET_COLUMNS)
+    df["DATE_OF_INCIDENT"] = pd.to_datetime(df["DATE_OF_INCIDENT"], errors="coerce")
+    return df
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    rows = [make_row(i, rng) for i in range(args.rows)]
+
+    frames = {}
+    t0 = time.perf_counter()
+    frames["untyped"] = untyped_dataframe(rows)
+    build = {"untyped": time.perf_counter() - t0}
+    t0 = time.perf_counter()
+    frames["typed"] = rows_to_dataframe(SHEET_COLUMNS, rows)
+    build["typed"] = time.perf_counter() - t0
+
+    print(f"{'frame':<8} {'build s':>8} {'bytes/row':>10} {'filter ms':>10} {'flag count ms':>14}")
+    for name, df in frames.items():
+        per_row = df.memory_usage(deep=True).sum() / len(df)
+        filter_s = best_of(lambda: filter_records(df, "maint", "line", "2022-01-01", "2024-12-31"), args.repeat)
+        if name == "typed":
+            flags_s = best_of(lambda: int(df["M3"].sum()), args.repeat)
+        else:
+            flags_s = best_of(lambda: int((df["M3"].astype(str).str.strip().str.upper() == "YES").sum()), args.repeat)
+        print(f"{name:<8} {build[name]:>8.2f} {per_row:>10.0f} {filter_s * 1000:>10.1f} {flags_s * 1000:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
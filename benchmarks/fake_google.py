@@ -0,0 +1,450 @@
+"""
+In-process stand-in for the Sheets (gspread), Docs and Drive calls made by
+drive_helper and pdf_generator, with configurable latency and injected quota
+errors. 'rate_limits' ({"docs": 5, ...}) rejects calls beyond that many per
+second per API with a 429, like a project quota. install() points both
+modules at a FakeGoogle instance.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+import gspread
+import httplib2
+import requests
+from googleapiclient.errors import HttpError
+
+
+class FakeGoogle:
+    def __init__(self, latency: float = 0.0, quota_error_rate: float = 0.0, seed: int = 0,
+                 rate_limits: Optional[Dict[str, float]] = None):
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.rate_limits = dict(rate_limits or {})
+        self._recent: Dict[str, deque] = {}
+        self.calls = Counter()
+        self.errors = Counter()
+        self.bytes_out = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.spreadsheets: Dict[str, "FakeSpreadsheet"] = {}
+        self.files: Dict[str, Dict] = {}
+        self._next_id = 0
+
+    def new_id(self, prefix: str) -> str:
+        with self._lock:
+            self._next_id += 1
+            return f"{prefix}{self._next_id:08d}"
+
+    def call(self, op: str, kind: str = "google", payload=None):
+        """Record one API call, sleep for the configured latency and maybe fail it with a 429."""
+        with self._lock:
+            self.calls[op] += 1
+            fail = self.quota_error_rate and self._rng.random() < self.quota_error_rate
+            api = op.split(".", 1)[0]
+            limit = self.rate_limits.get(api)
+            if limit and not fail:
+                now = time.monotonic()
+                recent = self._recent.setdefault(api, deque())
+                while recent and recent[0] <= now - 1.0:
+                    recent.popleft()
+                fail = len(recent) >= limit
+                if not fail:
+                    recent.append(now)
+            if fail:
+                self.errors[op] += 1
+            if payload is not None:
+                self.bytes_out[op] += len(json.dumps(payload, default=str))
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise _quota_error(kind)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.bytes_out.clear()
+
+
+def _quota_error(kind: str) -> Exception:
+    body = {"error": {"code": 429, "message": "Quota exceeded (fake)", "status": "RESOURCE_EXHAUSTED"}}
+    if kind == "sheets":
+        resp = requests.Response()
+        resp.status_code = 429
+        resp._content = json.dumps(body).encode()
+        resp.headers["Retry-After"] = "1"
+        return gspread.exceptions.APIError(resp)
+    return HttpError(httplib2.Response({"status": 429, "retry-after": "1"}), json.dumps(body).encode())
+
+
+def _not_found(file_id: str) -> Exception:
+    body = {"error": {"code": 404, "message": f"File not found: {file_id}.", "status": "NOT_FOUND"}}
+    return HttpError(httplib2.Response({"status": 404}), json.dumps(body).encode())
+
+
+# -------------------- Sheets (gspread-shaped) --------------------
+_A1 = re.compile(r"^(?:(?:'[^']+'|[^!]+)!)?([A-Z]+)?(\d+)?(?::([A-Z]+)?(\d+)?)?$")
+
+
+def _col_index(letters: Optional[str]) -> Optional[int]:
+    if not letters:
+        return None
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+class FakeWorksheet:
+    def __init__(self, g: FakeGoogle, spreadsheet: "FakeSpreadsheet", title: str, ws_id: int):
+        self.g = g
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = ws_id
+        self.values: List[List[str]] = []
+        self._lock = threading.Lock()
+
+    def seed(self, rows: List[List[str]]):
+        """Load rows without counting API calls."""
+        self.values.extend([list(map(str, r)) for r in rows])
+
+    def _slice(self, a1: str) -> List[List[str]]:
+        m = _A1.match(a1.replace("$", ""))
+        if not m:
+            raise ValueError(f"Unsupported range {a1}")
+        c1, r1, c2, r2 = m.groups()
+        c1 = _col_index(c1) or 1
+        c2 = _col_index(c2) or (c1 if (m.group(3) is None and m.group(4) is None) else None)
+        r1 = int(r1) if r1 else 1
+        r2 = int(r2) if r2 else (r1 if (m.group(3) is None and m.group(4) is None) else None)
+        rows = self.values[r1 - 1:r2]
+        out = []
+        for row in rows:
+            out.append(row[c1 - 1:c2] if c2 else row[c1 - 1:])
+        # Sheets drops trailing empty rows
+        while out and not any(out[-1]):
+            out.pop()
+        return [[v for v in r] for r in out]
+
+    def get_all_values(self, **kwargs):
+        self.g.call("sheets.values.get", "sheets")
+        return [list(r) for r in self.values]
+
+    def get_all_records(self, **kwargs):
+        values = self.get_all_values()
+        header = values[0] if values else []
+        return [dict(zip(header, r)) for r in values[1:]]
+
+    def get(self, range_name: str, **kwargs):
+        self.g.call("sheets.values.get", "sheets")
+        return self._slice(range_name)
+
+    def batch_get(self, ranges: List[str], **kwargs):
+        self.g.call("sheets.values.batchGet", "sheets")
+        return [self._slice(r) for r in ranges]
+
+    def row_values(self, row: int, **kwargs):
+        self.g.call("sheets.values.get", "sheets")
+        return list(self.values[row - 1]) if row <= len(self.values) else []
+
+    def append_rows(self, rows: List[List[str]], **kwargs):
+        self.g.call("sheets.values.append", "sheets", payload=rows)
+        with self._lock:
+            first = len(self.values) + 1
+            self.values.extend([list(map(str, r)) for r in rows])
+            last = len(self.values)
+            self.spreadsheet.modified += 1
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:A{last}", "updatedRows": len(rows)}}
+
+    def append_row(self, row: List[str], **kwargs):
+        return self.append_rows([row], **kwargs)
+
+    def _bounds(self, a1: str):
+        m = _A1.match(a1.replace("$", ""))
+        c1, r1, c2, r2 = m.groups()
+        return (int(r1 or 1), _col_index(c1) or 1,
+                int(r2) if r2 else None, _col_index(c2) if c2 else None)
+
+    def update(self, values: List[List[str]] = None, range_name: str = "A1", **kwargs):
+        self.g.call("sheets.values.update", "sheets", payload=values)
+        r1, c1, _, _ = self._bounds(range_name)
+        with self._lock:
+            for i, row in enumerate(values or []):
+                while len(self.values) < r1 + i:
+                    self.values.append([])
+                target = self.values[r1 - 1 + i]
+                target.extend([""] * (c1 - 1 + len(row) - len(target)))
+                target[c1 - 1:c1 - 1 + len(row)] = [str(v) for v in row]
+            self.spreadsheet.modified += 1
+        return {"updatedRange": f"{self.title}!{range_name}"}
+
+    def batch_clear(self, ranges: List[str], **kwargs):
+        self.g.call("sheets.values.batchClear", "sheets")
+        with self._lock:
+            for a1 in ranges:
+                r1, c1, r2, c2 = self._bounds(a1)
+                for row in self.values[r1 - 1:r2]:
+                    for c in range(c1 - 1, min(len(row), c2 or len(row))):
+                        row[c] = ""
+            # like Sheets, appends go after the last non-empty row
+            while self.values and not any(self.values[-1]):
+                self.values.pop()
+            self.spreadsheet.modified += 1
+
+    @property
+    def row_count(self) -> int:
+        return max(len(self.values), 1000)
+
+
+class FakeSpreadsheet:
+    def __init__(self, g: FakeGoogle, title: str):
+        self.g = g
+        self.title = title
+        self.id = g.new_id("sheet")
+        self._worksheets: List[FakeWorksheet] = []
+        self.modified = 0
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.g.call("sheets.spreadsheets.get", "sheets")
+        for ws in self._worksheets:
+            if ws.title == title:
+                return ws
+        raise gspread.WorksheetNotFound(title)
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        self.g.call("sheets.spreadsheets.get", "sheets")
+        return list(self._worksheets)
+
+    def fetch_sheet_metadata(self, params=None) -> Dict:
+        self.g.call("sheets.spreadsheets.get", "sheets")
+        return {"sheets": [{"properties": {"sheetId": ws.id, "title": ws.title,
+                                           "gridProperties": {"rowCount": ws.row_count}}}
+                           for ws in self._worksheets]}
+
+    def get_worksheet_by_id(self, ws_id: int) -> FakeWorksheet:
+        self.g.call("sheets.spreadsheets.get", "sheets")
+        for ws in self._worksheets:
+            if ws.id == ws_id:
+                return ws
+        raise gspread.WorksheetNotFound(ws_id)
+
+    def add_worksheet(self, title: str, rows=1000, cols=26, **kwargs) -> FakeWorksheet:
+        self.g.call("sheets.spreadsheets.batchUpdate", "sheets")
+        ws = FakeWorksheet(self.g, self, title, len(self._worksheets))
+        self._worksheets.append(ws)
+        return ws
+
+    def add_seeded_worksheet(self, title: str, rows: List[List[str]]) -> FakeWorksheet:
+        ws = FakeWorksheet(self.g, self, title, len(self._worksheets))
+        ws.seed(rows)
+        self._worksheets.append(ws)
+        return ws
+
+
+class _FakeResponse:
+    def __init__(self, data: Dict):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeHTTPClient:
+    """gspread's HTTPClient.request, answering Drive files.get for the fake spreadsheets."""
+
+    def __init__(self, g: FakeGoogle):
+        self.g = g
+
+    def request(self, method: str, endpoint: str, params=None, **kwargs):
+        self.g.call("drive.files.get", "sheets")
+        file_id = endpoint.rstrip("/").rsplit("/", 1)[-1]
+        sh = self.g.spreadsheets.get(file_id)
+        if sh is None:
+            raise gspread.SpreadsheetNotFound(file_id)
+        return _FakeResponse({"id": file_id, "version": str(sh.modified), "modifiedTime": str(sh.modified)})
+
+
+class FakeClient:
+    def __init__(self, g: FakeGoogle):
+        self.g = g
+        self.http_client = FakeHTTPClient(g)
+
+    def open(self, title: str) -> FakeSpreadsheet:
+        self.g.call("drive.files.list")
+        for sh in self.g.spreadsheets.values():
+            if sh.title == title:
+                return sh
+        raise gspread.SpreadsheetNotFound(title)
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self.g.call("sheets.spreadsheets.get", "sheets")
+        if key not in self.g.spreadsheets:
+            raise gspread.SpreadsheetNotFound(key)
+        return self.g.spreadsheets[key]
+
+    def create(self, title: str) -> FakeSpreadsheet:
+        self.g.call("sheets.spreadsheets.create", "sheets")
+        sh = FakeSpreadsheet(self.g, title)
+        self.g.spreadsheets[sh.id] = sh
+        return sh
+
+
+# -------------------- Docs / Drive (discovery-client shaped) --------------------
+class _Request:
+    def __init__(self, g: FakeGoogle, op: str, fn, payload=None):
+        self.g, self.op, self.fn, self.payload = g, op, fn, payload
+
+    def execute(self, **kwargs):
+        self.g.call(self.op, payload=self.payload)
+        return self.fn()
+
+
+class FakeDocs:
+    def __init__(self, g: FakeGoogle, placeholders: List[str]):
+        self.g = g
+        self.template_text = " ".join(f"{{{{{p}}}}}" for p in placeholders)
+
+    def documents(self):
+        return self
+
+    def get(self, documentId: str, **kwargs):
+        def run():
+            text = self.g.files.get(documentId, {}).get("text", self.template_text)
+            content = [{"paragraph": {"elements": [{"textRun": {"content": text}}]}}]
+            return {"documentId": documentId, "body": {"content": content}}
+        return _Request(self.g, "docs.documents.get", run)
+
+    def batchUpdate(self, documentId: str, body: Dict, **kwargs):
+        def run():
+            doc = self.g.files[documentId]
+            for req in body.get("requests", []):
+                rep = req["replaceAllText"]
+                doc["text"] = doc["text"].replace(rep["containsText"]["text"], rep["replaceText"])
+            return {"documentId": documentId, "replies": [{} for _ in body.get("requests", [])]}
+        return _Request(self.g, "docs.documents.batchUpdate", run, payload=body)
+
+
+class FakeDrive:
+    def __init__(self, g: FakeGoogle, template_id: str, docs: FakeDocs):
+        self.g = g
+        self.template_id = template_id
+        self.docs = docs
+
+    def files(self):
+        return self
+
+    def copy(self, fileId: str, body: Dict, **kwargs):
+        def run():
+            new_id = self.g.new_id("doc")
+            src = self.g.files.get(fileId, {"text": self.docs.template_text})
+            self.g.files[new_id] = {"id": new_id, "name": body.get("name", ""), "text": src["text"],
+                                    "mimeType": "application/vnd.google-apps.document",
+                                    "appProperties": dict(body.get("appProperties", {})), "trashed": False,
+                                    "createdTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+            return {"id": new_id}
+        return _Request(self.g, "drive.files.copy", run)
+
+    def export_media(self, fileId: str, mimeType: str, **kwargs):
+        return _Request(self.g, "drive.files.export", lambda: ("%PDF-1.4\n" + self.g.files[fileId]["text"]).encode("utf-8"))
+
+    def update(self, fileId: str, body: Dict, **kwargs):
+        def run():
+            f = self.g.files.get(fileId)
+            if f is None:
+                raise _not_found(fileId)
+            f["trashed"] = bool(body.get("trashed", f.get("trashed")))
+            return {"id": fileId}
+        return _Request(self.g, "drive.files.update", run)
+
+    def get(self, fileId: str, fields: str = "", **kwargs):
+        def run():
+            version = str(self.g.files.get(fileId, {}).get("version", 1))
+            return {"id": fileId, "version": version, "modifiedTime": version}
+        return _Request(self.g, "drive.files.get", run)
+
+    def list(self, q: str = "", fields: str = "", pageToken: Optional[str] = None, **kwargs):
+        # Only the appProperties, "trashed = false" and "createdTime < '...'" clauses are honoured
+        created_before = re.search(r"createdTime < '([^']+)'", q)
+        properties = dict(re.findall(r"appProperties has \{ key='([^']+)' and value='([^']+)' \}", q))
+        untrashed = "trashed = false" in q
+
+        def run():
+            files = [
+                {k: f.get(k) for k in ("id", "name", "createdTime", "mimeType")}
+                for f in self.g.files.values()
+                if all(f.get("appProperties", {}).get(k) == v for k, v in properties.items())
+                and not (untrashed and f.get("trashed"))
+                and (not created_before or f.get("createdTime", "") < created_before.group(1))
+            ]
+            return {"files": files}
+        return _Request(self.g, "drive.files.list", run)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.g, callback)
+
+
+class FakeBatch:
+    """BatchHttpRequest stand-in: one counted call, then a callback per queued request."""
+
+    def __init__(self, g: FakeGoogle, callback=None):
+        self.g = g
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback or self.callback))
+
+    def execute(self, **kwargs):
+        self.g.call("drive.batch")
+        for request_id, request, callback in self.requests:
+            try:
+                result, error = request.fn(), None
+            except HttpError as e:
+                result, error = None, e
+            if callback:
+                callback(request_id, result, error)
+
+
+class FakeDownloader:
+    """Replacement for MediaIoBaseDownload that reads a fake export request in one chunk."""
+
+    def __init__(self, fd, request, chunksize: int = 0):
+        self.fd = fd
+        self.request = request
+
+    def next_chunk(self, num_retries: int = 0):
+        self.fd.write(self.request.execute())
+        return None, True
+
+
+def install(g: FakeGoogle, placeholders: List[str], ids_path: str):
+    """Point drive_helper and pdf_generator at 'g' instead of the real Google APIs."""
+    import drive_helper
+    import pdf_generator
+
+    client = FakeClient(g)
+    drive_helper.get_client = lambda: client
+    drive_helper.SHEET_IDS_PATH = ids_path
+    drive_helper._sheet_ids = None
+    drive_helper.reset_clients()
+    drive_helper._change_watcher = None  # its cached version belongs to the previous fake
+
+    docs = FakeDocs(g, placeholders)
+    drive = FakeDrive(g, pdf_generator.DOC_TEMPLATE_ID, docs)
+    pdf_generator._service = lambda api, version: docs if api == "docs" else drive
+    # the placeholder cache describes the real template; keep the fake's next to its sheet ids
+    pdf_generator.TEMPLATE_CACHE_PATH = os.path.join(os.path.dirname(ids_path), ".capa_template.json")
+    pdf_generator._template.clear()
+    pdf_generator._reported_unfilled.clear()
+    # pooled copies belong to the previous fake
+    if pdf_generator._pool is not None:
+        pdf_generator._pool.stop()
+        pdf_generator._pool = None
+    pdf_generator.MediaIoBaseDownload = FakeDownloader
+    return client
@@ -0,0 +1,68 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import BinaryIO, Callable, Dict, Optional
+
+import pandas as pd
+
+import scheduler
+from drive_helper import find_many_by_capa_no
+from pdf_cache import get_cached_pdf
+from pdf_generator import use_thread_services
+
+# Parallel PDF generations for a bulk export; keep low enough to stay under the Docs/Drive quota
+ZIP_WORKERS = int(os.environ.get("CAPA_ZIP_WORKERS", "4"))
+
+
+def _safe_name(capa_no: str, used: Dict[str, int]) -> str:
+    base = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in capa_no) or "CAPA"
+    n = used.get(base, 0)
+    used[base] = n + 1
+    return f"{base}.pdf" if n == 0 else f"{base}_{n + 1}.pdf"
+
+
+def _init_worker():
+    use_thread_services()
+    # Bulk exports yield to interactive downloads for API quota
+    scheduler.set_priority(scheduler.BULK)
+
+
+def export_zip(df: pd.DataFrame, out: BinaryIO, workers: Optional[int] = None,
+               progress: Optional[Callable[[int, int], None]] = None) -> Dict:
+    """
+    Write a ZIP with one PDF per CAPA in 'df' (as returned by query_records) to 'out'.
+    PDFs are generated by a bounded thread pool, each worker with its own Docs/Drive
+    services and BULK scheduler priority, and each entry is written to the archive as soon as it finishes.
+    'progress' is called with (done, total) after every entry.
+    Returns {"written": n, "failed": {capa_no: error}}.
+    """
+    capa_nos = list(dict.fromkeys(str(c) for c in df["CAPA_NO"] if str(c).strip()))
+    records = find_many_by_capa_no(capa_nos)
+    total = len(capa_nos)
+    failed = {c: "record not found" for c, r in records.items() if r is None}
+    done = len(failed)
+    written = 0
+    used_names: Dict[str, int] = {}
+
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        if progress:
+            progress(done, total)
+        pool = ThreadPoolExecutor(max_workers=max(1, workers or ZIP_WORKERS),
+                                  initializer=_init_worker,
+                                  thread_name_prefix="capa-zip")
+        with pool:
+            futures = {pool.submit(get_cached_pdf, r): c for c, r in records.items() if r is not None}
+            for fut in as_completed(futures):
+                capa_no = futures[fut]
+                try:
+                    zf.writestr(_safe_name(capa_no, used_names), fut.result())
+                    written += 1
+                except Exception as e:
+                    failed[capa_no] = str(e)
+                done += 1
+                if progress:
+                    progress(done, total)
+        if failed:
+            zf.writestr("ERRORS.txt", "\n".join(f"{c}: {err}" for c, err in failed.items()))
+
+    return {"written": written, "failed": failed}
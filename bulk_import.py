@@ -0,0 +1,260 @@
+"""
+Import legacy CAPA records from a CSV or Excel export.
+
+    python bulk_import.py legacy_capas.csv
+    python bulk_import.py legacy_capas.xlsx --dayfirst --rejects rejects.csv
+
+The file is read in chunks and written with batched append_rows calls. Columns are
+matched to SHEET_COLUMNS by name ("Capa No" -> CAPA_NO); rows without a CAPA_NO,
+with an unreadable incident date, or whose CAPA_NO is already stored (or appears
+earlier in the file) are skipped and reported. "None", "nan" and blank dates are
+imported as blank; other date text that can't be parsed (e.g. "TBD" in D1) is kept
+as written. Progress is checkpointed after every batch, so
+an interrupted import resumes where it stopped when run again on the same file.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+import scheduler
+from drive_helper import append_rows, capa_exists, normalize_row, refresh_records
+from schema import DATE_COLUMNS, SHEET_COLUMNS, normalize_capa_no
+from write_queue import is_queued
+
+IMPORT_CHECKPOINT_PATH = os.environ.get("CAPA_IMPORT_CHECKPOINT_PATH", ".capa_import.json")
+READ_CHUNK_ROWS = 5000  # rows parsed from the file at a time
+IMPORT_BATCH_SIZE = 500  # rows per append_rows call
+# Date cell text that legacy exports use for "no date"
+_EMPTY_DATES = {"", "none", "nan", "nat", "null"}
+
+
+def _column_key(name) -> str:
+    # "Date of Incident", "date-of-incident" and "DATE_OF_INCIDENT" all match
+    return re.sub(r"[^A-Z0-9]+", "_", str(name).strip().upper()).strip("_")
+
+
+def _file_digest(source) -> str:
+    digest = hashlib.sha256()
+    if hasattr(source, "read"):
+        source.seek(0)
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+        source.seek(0)
+    else:
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_excel(name: str) -> bool:
+    return name.lower().endswith((".xlsx", ".xlsm"))
+
+
+def _open_text(source):
+    if hasattr(source, "read"):
+        source.seek(0)
+        return io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+    return open(source, "r", encoding="utf-8-sig", newline="")
+
+
+def _count_csv_rows(source) -> int:
+    f = _open_text(source)
+    try:
+        return max(0, sum(1 for _ in csv.reader(f)) - 1)
+    finally:
+        if hasattr(source, "read"):
+            f.detach()  # leave the caller's file open
+        else:
+            f.close()
+
+
+def _csv_chunks(source, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    if hasattr(source, "read"):
+        source.seek(0)
+    # blank lines are kept as rows so positions match the checkpoint on resume
+    reader = pd.read_csv(source, dtype=str, keep_default_na=False, encoding="utf-8-sig",
+                         skip_blank_lines=False, chunksize=chunk_rows)
+    with reader:
+        yield from reader
+
+
+def _excel_chunks(source, chunk_rows: int) -> Tuple[int, Iterator[pd.DataFrame]]:
+    try:
+        import openpyxl
+    except ImportError:
+        raise RuntimeError("Importing Excel files needs openpyxl (pip install openpyxl)")
+    if hasattr(source, "read"):
+        source.seek(0)
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    ws = wb.worksheets[0]
+    total = max(0, (ws.max_row or 1) - 1)
+
+    def chunks():
+        try:
+            rows = ws.iter_rows(values_only=True)
+            header = [str(h) if h is not None else "" for h in next(rows, [])]
+            batch = []
+            for values in rows:
+                values = ["" if v is None else v for v in values[:len(header)]]
+                batch.append(values + [""] * (len(header) - len(values)))
+                if len(batch) >= chunk_rows:
+                    yield pd.DataFrame(batch, columns=header, dtype=object)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header, dtype=object)
+        finally:
+            wb.close()
+
+    return total, chunks()
+
+
+def _validate(record: Dict, dayfirst: bool) -> Optional[str]:
+    """
+    Reason the record can't be imported, or None. Parses text dates in place;
+    placeholders such as "None" become blank and other unparsed text is kept.
+    """
+    if not str(record.get("CAPA_NO", "")).strip():
+        return "missing CAPA_NO"
+    for col in DATE_COLUMNS:
+        value = record.get(col, "")
+        if not isinstance(value, str):
+            continue
+        if value.strip().lower() in _EMPTY_DATES:
+            record[col] = ""
+            continue
+        ts = pd.to_datetime(value.strip(), errors="coerce", dayfirst=dayfirst)
+        if not pd.isna(ts):
+            record[col] = ts
+        elif col == "DATE_OF_INCIDENT":
+            # searches, partitions and the dashboard are keyed on it
+            return f"unreadable {col} '{value}'"
+    return None
+
+
+def _load_checkpoint(path: str, digest: str) -> Dict:
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("file") == digest:
+                return data
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Import checkpoint unreadable, starting from the first row: {e}")
+    return {"file": digest, "rows_done": 0, "imported": 0, "duplicates": 0, "invalid": 0}
+
+
+def _save_checkpoint(path: str, state: Dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(state))
+    os.replace(tmp_path, path)
+
+
+def import_file(source, name: Optional[str] = None, dayfirst: bool = False,
+                progress: Optional[Callable[[int, int], None]] = None,
+                batch_size: int = IMPORT_BATCH_SIZE, chunk_rows: int = READ_CHUNK_ROWS,
+                checkpoint_path: Optional[str] = None) -> Dict:
+    """
+    Import a CSV or Excel file (a path, or a binary file object such as a Streamlit
+    upload; 'name' gives its file name). progress(rows_done, total_rows) is called
+    after every batch. Returns the counts of imported, duplicate and invalid rows
+    (including those of an earlier interrupted run) and the 'rejects' of this run.
+    """
+    name = name or getattr(source, "name", None) or str(source)
+    checkpoint_path = checkpoint_path or IMPORT_CHECKPOINT_PATH
+    state = _load_checkpoint(checkpoint_path, _file_digest(source))
+    skip = state["rows_done"]
+    if skip:
+        # the last batch may have been written before the checkpoint was saved; its rows are found as duplicates
+        refresh_records()
+        print(f"Resuming {name} after row {skip}")
+
+    if _is_excel(name):
+        total, chunks = _excel_chunks(source, chunk_rows)
+    else:
+        total, chunks = _count_csv_rows(source), _csv_chunks(source, chunk_rows)
+
+    rejects: List[Dict] = []
+    seen = set()
+    with scheduler.priority(scheduler.BULK):
+        for chunk in chunks:
+            columns = {c: _column_key(c) for c in chunk.columns}
+            if "CAPA_NO" not in columns.values():
+                raise ValueError(f"{name} has no CAPA_NO column (found: {', '.join(map(str, chunk.columns))})")
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            chunk, skip = chunk.iloc[skip:], 0
+            chunk = chunk.rename(columns=columns)
+            chunk = chunk.loc[:, [c for c in chunk.columns if c in SHEET_COLUMNS]]
+            pending: List[List[str]] = []
+            for record in chunk.to_dict("records"):
+                row_number = state["rows_done"] + 2  # header is row 1
+                state["rows_done"] += 1
+                if not any(str(v).strip() for v in record.values()):
+                    continue
+                reason = _validate(record, dayfirst)
+                key = normalize_capa_no(record.get("CAPA_NO", ""))
+                if reason is None and (key in seen or capa_exists(key) or is_queued(key)):
+                    reason = "duplicate CAPA_NO"
+                if reason is not None:
+                    state["duplicates" if reason == "duplicate CAPA_NO" else "invalid"] += 1
+                    rejects.append({"ROW": row_number, "CAPA_NO": str(record.get("CAPA_NO", "")), "REASON": reason})
+                    continue
+                seen.add(key)
+                pending.append(normalize_row(record))
+                if len(pending) >= batch_size:
+                    _write_batch(pending, state, checkpoint_path, progress, total)
+                    pending = []
+            _write_batch(pending, state, checkpoint_path, progress, total)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return {**{k: state[k] for k in ("imported", "duplicates", "invalid")}, "rows": total, "rejects": rejects}
+
+
+def _write_batch(rows: List[List[str]], state: Dict, checkpoint_path: str,
+                 progress: Optional[Callable[[int, int], None]], total: int):
+    if rows:
+        append_rows(rows)
+        state["imported"] += len(rows)
+    try:
+        _save_checkpoint(checkpoint_path, state)
+    except OSError as e:
+        print(f"⚠️ Could not save import checkpoint: {e}")
+    if progress:
+        progress(state["rows_done"], total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="CSV or Excel (.xlsx) file")
+    parser.add_argument("--dayfirst", action="store_true", help="read dates like 03/04/2021 as 3 April")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="rows per Sheets write")
+    parser.add_argument("--rejects", help="write skipped rows and the reasons to this CSV file")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an interrupted run")
+    args = parser.parse_args()
+    if args.restart and os.path.exists(IMPORT_CHECKPOINT_PATH):
+        os.remove(IMPORT_CHECKPOINT_PATH)
+
+    def report(done: int, total: int):
+        print(f"\r{done}/{total} rows", end="", flush=True)
+
+    result = import_file(args.path, dayfirst=args.dayfirst, progress=report, batch_size=args.batch_size)
+    print(f"\nImported {result['imported']}, skipped {result['duplicates']} duplicate(s)"
+          f" and {result['invalid']} invalid row(s).")
+    if args.rejects and result["rejects"]:
+        pd.DataFrame(result["rejects"]).to_csv(args.rejects, index=False)
+        print(f"Skipped rows written to {args.rejects}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional
+
+import scheduler
+
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+
+
+class ChangeSource(ABC):
+    """Reports a token that changes whenever the watched spreadsheet changes."""
+
+    @abstractmethod
+    def token(self) -> str:
+        ...
+
+    def notify(self):
+        """Record a change reported by a push channel; polled sources ignore it."""
+
+
+class DriveChangeSource(ChangeSource):
+    """
+    Polls the spreadsheet's Drive metadata: 'version' is bumped by every edit, by
+    anyone, and reading it is one small files.get call.
+    """
+
+    def __init__(self, file_id: Callable[[], str], client: Callable):
+        self.file_id = file_id
+        self.client = client
+
+    def token(self) -> str:
+        url = f"{DRIVE_FILES_URL}/{self.file_id()}"
+        params = {"fields": "version,modifiedTime", "supportsAllDrives": True}
+        res = scheduler.call("drive.get", self.client().http_client.request, "get", url, params=params)
+        meta = res.json()
+        return f"{meta.get('version')}:{meta.get('modifiedTime')}"
+
+
+class LocalChangeSource(ChangeSource):
+    """
+    Stand-in for push notifications: the token changes when notify() is called,
+    e.g. by a webhook receiver, a script that edited the sheet, or a test. With
+    'path', the token is that marker file's modification time, so notify() in one
+    process is seen by every process sharing the file.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._count = 0
+
+    def token(self) -> str:
+        if self.path:
+            try:
+                return str(os.stat(self.path).st_mtime_ns)
+            except FileNotFoundError:
+                return "0"
+        return str(self._count)
+
+    def notify(self):
+        self._count += 1
+        if self.path:
+            with open(self.path, "a", encoding="utf-8"):
+                pass
+            os.utime(self.path)
+
+
+class ChangeWatcher:
+    """
+    Shares one ChangeSource check among all readers for 'interval' seconds, and
+    tells listeners when a worksheet was changed by someone else, so state derived
+    from its rows can be rebuilt.
+    """
+
+    def __init__(self, source: ChangeSource, interval: float):
+        self.source = source
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.listeners: List[Callable[[str], None]] = []
+        self._token: Optional[str] = None
+        self._checked_at = 0.0
+
+    def current(self, fresh: bool = False) -> Optional[str]:
+        """
+        The latest token, or None if it could not be read (callers then fall back to a
+        TTL). With 'fresh', the source is asked even if it was checked recently.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not fresh and self._token is not None and now - self._checked_at < self.interval:
+                return self._token
+            try:
+                self._token = self.source.token()
+            except Exception as e:
+                print(f"⚠️ Could not check the sheet for changes: {e}")
+                self._token = None
+            self._checked_at = now
+            return self._token
+
+    def expire(self):
+        """Make the next current() ask the source again (e.g. after writing to the sheet)."""
+        with self.lock:
+            self._checked_at = 0.0
+
+    def add_listener(self, fn: Callable[[str], None]):
+        self.listeners.append(fn)
+
+    def rows_changed(self, title: str):
+        for fn in list(self.listeners):
+            try:
+                fn(title)
+            except Exception as e:
+                print(f"⚠️ Change listener failed: {e}")
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+# The journal is folded into the saved file once it grows past this fraction of the file's size
+JOURNAL_COMPACT_RATIO = float(os.environ.get("CAPA_JOURNAL_COMPACT_RATIO", "0.5"))
+
+
+class DerivedState(ABC):
+    """
+    State built incrementally from CAPA rows (text_index.TextIndex, analytics.CapaStats).
+    Every change is a journal entry applied by _apply(); 'row_counts' is the watermark of
+    rows taken in per segment (worksheet partition). 'fingerprints' holds a value per row
+    position that changes with the row's content, so after an edit made elsewhere only
+    the rows that differ are taken in again (see _changed()).
+
+    save() writes the whole state once, then only appends the entries made since to
+    '<path>.log', so catching up a few rows costs a few lines rather than a rewrite of
+    the file. load() replays that journal; it is compacted into the file once it grows
+    past JOURNAL_COMPACT_RATIO of it.
+    """
+
+    VERSION = 3
+
+    def __init__(self, source: str = ""):
+        self.lock = threading.RLock()
+        self.source = source
+        self.row_counts: Dict[str, int] = {}
+        self.fingerprints: Dict[str, List] = {}  # segment -> fingerprint per row position
+        self._pending: List[Dict] = []  # entries applied but not saved yet
+        self._saved_to: Optional[str] = None  # path whose file + journal hold every other entry
+        self._file_bytes = 0
+        self._journal_bytes = 0
+
+    def indexed(self, segment: str = "") -> int:
+        with self.lock:
+            return self.row_counts.get(segment, 0)
+
+    @abstractmethod
+    def _apply(self, entry: Dict):
+        """Apply one journal entry; raises ValueError if it doesn't fit the current state."""
+
+    @abstractmethod
+    def _state(self) -> Dict:
+        """JSON-serializable state, besides 'row_counts'."""
+
+    @abstractmethod
+    def _restore(self, data: Dict):
+        """Inverse of _state()."""
+
+    def dirty(self) -> bool:
+        """True if there are changes save() hasn't written yet."""
+        with self.lock:
+            return bool(self._pending)
+
+    def _changed(self, segment: str, start: int, fingerprints: List) -> List[int]:
+        """Positions from 'start' whose stored fingerprint differs from the given one."""
+        with self.lock:
+            known = self.fingerprints.get(segment, [])
+            return [start + i for i, fp in enumerate(fingerprints)
+                    if start + i >= len(known) or known[start + i] != fp]
+
+    def _record(self, entry: Dict):
+        with self.lock:
+            self._apply(entry)
+            self._pending.append(entry)
+
+    def save(self, path: str):
+        journal_path = f"{path}.log"
+        with self.lock:
+            if self._saved_to == path and self._journal_bytes <= JOURNAL_COMPACT_RATIO * self._file_bytes:
+                if self._pending:
+                    lines = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in self._pending)
+                    with open(journal_path, "a", encoding="utf-8") as f:
+                        f.write(lines)
+                    self._journal_bytes += len(lines.encode("utf-8"))
+            else:
+                data = {"version": self.VERSION, "source": self.source, "row_counts": self.row_counts,
+                        "fingerprints": self.fingerprints, **self._state()}
+                blob = json.dumps(data, separators=(",", ":"))
+                # drop the journal first: a crash in between leaves an older watermark, not a doubled one
+                try:
+                    os.remove(journal_path)
+                except FileNotFoundError:
+                    pass
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(blob)
+                os.replace(tmp_path, path)
+                self._saved_to = path
+                self._file_bytes = len(blob.encode("utf-8"))
+                self._journal_bytes = 0
+            self._pending = []
+
+    @classmethod
+    def load(cls, path: str, source: str):
+        """Load saved state and its journal, or return an empty one if missing, unreadable or built from another source."""
+        state = cls(source)
+        if not os.path.exists(path):
+            return state
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return state
+        if data.get("version") != cls.VERSION or data.get("source") != source:
+            return state
+        state.row_counts = data["row_counts"]
+        state.fingerprints = data["fingerprints"]
+        state._restore(data)
+        state._saved_to = path
+        state._file_bytes = os.path.getsize(path)
+        journal_path = f"{path}.log"
+        try:
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    state._apply(json.loads(line))
+                    state._journal_bytes += len(line.encode("utf-8"))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            # e.g. a line cut short by a crash; the next save rewrites the file without it
+            print(f"⚠️ Ignoring the rest of {journal_path}: {e}")
+            state._saved_to = None
+        return state
@@ -1,7 +1,10 @@
+import json
 import os
 import pickle
 import tempfile
-from typing import Dict, List, Optional
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 import datetime as dt
 
 import gspread
@@ -11,6 +14,17 @@ from google.oauth2.service_account import Credentials as ServiceAccountCredentia
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.oauth2.credentials import Credentials as OAuthCredentials
 
+import metrics
+import scheduler
+from analytics import ANALYTICS_COLUMNS, CapaStats
+from change_watch import ChangeWatcher, DriveChangeSource, LocalChangeSource
+from partitions import (PARTITION_SCHEMES, PartitionDirectory, is_partition, partition_for,
+                        partitions_overlapping)
+from schema import (CATEGORY_COLUMNS, SEARCH_COLUMNS, SHEET_COLUMNS, normalize_capa_no, rows_to_dataframe,
+                    to_sheet_string, values_to_record)
+from storage import CapaStore, SQLiteStore, filter_records
+from text_index import TEXT_FIELDS, TextIndex
+
 # Scopes required for Google Sheets (and ability to create spreadsheets)
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
@@ -20,83 +34,51 @@ SCOPES = [
 SPREADSHEET_NAME = "CAPA_PORTAL_INDEX"  # spreadsheet name (created if absent)
 WORKSHEET_NAME = "CAPA"  # worksheet/tab name
 
-# Column order used in the sheet (keeps consistent)
-SHEET_COLUMNS = [
-    "DEPARTMENT",
-    "AREA_SECTION",
-    "DATE_OF_INCIDENT",
-    "CAPA_NO",
-    "WHAT",
-    "WHERE",
-    "WHEN",
-    "EXTENT",
-    "TIME1",
-    "TIME2",
-    "A",
-    "B",
-    "C",
-    "D",
-    "TEAM_NAME",
-    "LEADER",
-    "MEM1",
-    "MEM2",
-    "MEM3",
-    "MEM4",
-    "R1",
-    "R2",
-    "R3",
-    "R4",
-    "R5",
-    "C1",
-    "C2",
-    "C3",
-    "C4",
-    "C5",
-    "ACTIONS",
-    "TIME_FRAME",
-    "RESPONSIBILITY",
-    "WHY1",
-    "WHY2",
-    "WHY3",
-    "WHY4",
-    "WHY5",
-    "M1",
-    "M2",
-    "M3",
-    "M4",
-    "M5",
-    "CONCLUSION",
-    "C_ACTIONS",
-    "RES1",
-    "T1",
-    "D1",
-    "P_ACTIONS",
-    "RES2",
-    "T2",
-    "D2",
-    "PLAN",
-    "O1",
-    "O2",
-    "O3",
-    "O4",
-    "O5",
-    "OTHERS",
-    "TRAINING_DETAILS",
-    "DATE_IMPLE",
-    "EFFECTIVENESS_EVAL",
-    "INITIATOR",
-    "REVIEWER",
-    "HOD",
-]
+# Spreadsheet/worksheet IDs are remembered here after the first lookup by name
+SHEET_IDS_PATH = os.environ.get("CAPA_SHEET_IDS_PATH", ".capa_sheet_ids.json")
+# Refresh credentials in the background this long before they expire
+TOKEN_REFRESH_MARGIN = dt.timedelta(minutes=5)
+TOKEN_CHECK_INTERVAL = 60  # seconds between background expiry checks
+# How long the in-memory copy of the sheet is served before checking for new rows
+SNAPSHOT_TTL = float(os.environ.get("CAPA_SNAPSHOT_TTL", "60"))  # used when the change check is off or failing
+FULL_ROW_CACHE_SIZE = 2000  # full records kept in memory after being opened
+FULL_ROW_BATCH_SIZE = 200  # rows per batch_get when fetching full records
+
+# Keyword index over the narrative columns, persisted between restarts
+TEXT_INDEX_PATH = os.environ.get("CAPA_TEXT_INDEX_PATH", ".capa_text_index.json")
+TEXT_INDEX_SYNC_CHUNK = 5000  # rows read per call while catching the index (or analytics) up
+# Pre-aggregated counters behind the analytics dashboard, persisted the same way
+ANALYTICS_PATH = os.environ.get("CAPA_ANALYTICS_PATH", ".capa_analytics.json")
+
+# How snapshots learn that the spreadsheet changed: "drive" (poll its Drive version),
+# "local" (notify_sheet_changed(), shared through CHANGE_MARKER_PATH if set) or
+# "none" (re-read new rows every SNAPSHOT_TTL seconds)
+CHANGE_SOURCE = os.environ.get("CAPA_CHANGE_SOURCE", "drive")
+CHANGE_CHECK_INTERVAL = float(os.environ.get("CAPA_CHANGE_CHECK_INTERVAL", "5"))
+CHANGE_MARKER_PATH = os.environ.get("CAPA_CHANGE_MARKER_PATH")
+
+# "sheets" reads and writes the Google Sheet directly; "sqlite" keeps records in a local database
+STORAGE_BACKEND = os.environ.get("CAPA_STORAGE_BACKEND", "sheets")
+SQLITE_PATH = os.environ.get("CAPA_SQLITE_PATH", "capa.db")
+# With the sqlite backend, also copy every new row to the Google Sheet (one-way)
+SQLITE_MIRROR_TO_SHEET = os.environ.get("CAPA_SQLITE_MIRROR", "0") == "1"
+
+# "year"/"quarter" route new rows into CAPA_2024 / CAPA_2024_Q3 tabs by DATE_OF_INCIDENT
+# (undated rows stay in the CAPA tab); split existing history with migrate_partitions.py
+PARTITION_SCHEME = os.environ.get("CAPA_PARTITION_SCHEME", "none")
+PARTITION_DIRECTORY_PATH = os.environ.get("CAPA_PARTITION_DIRECTORY_PATH", ".capa_partitions.json")
+PARTITION_ROWS = 1000  # initial grid size of a new partition tab
+
+def _service_account_creds(sa_path: str):
+    return ServiceAccountCredentials.from_service_account_file(sa_path, scopes=SCOPES)
 
 
 def _auth_with_service_account(sa_path: str):
-    creds = ServiceAccountCredentials.from_service_account_file(sa_path, scopes=SCOPES)
-    client = gspread.authorize(creds)
+    client = gspread.authorize(_service_account_creds(sa_path))
     return client
 
 
-def _auth_with_oauth(credentials_path: str, token_path: str = "token.pickle"):
+def _oauth_creds(credentials_path: str, token_path: str = "token.pickle"):
     creds = None
     if os.path.exists(token_path):
         with open(token_path, "rb") as f:
@@ -104,123 +86,918 @@ def _auth_with_oauth(credentials_path: str, token_path: str = "token.pickle"):
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            metrics.call("auth.refresh", creds.refresh, Request())
         else:
             flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
             creds = flow.run_local_server(port=0)
         # Save the credentials for the next run
         with open(token_path, "wb") as token:
             pickle.dump(creds, token)
-    client = gspread.authorize(creds)
+    return creds
+
+
+def _auth_with_oauth(credentials_path: str, token_path: str = "token.pickle"):
+    client = gspread.authorize(_oauth_creds(credentials_path, token_path))
     return client
 
 
-def init_gspread_client():
+def _load_creds():
     """
-    Tries to auth using service_account.json first (recommended for server),
-    else falls back to credentials.json + local OAuth flow (interactive).
+    Returns (creds, token_path). token_path is set for OAuth credentials, which
+    must be written back to disk after a refresh, and None for a service account.
     """
     cwd = os.getcwd()
     sa_file = os.path.join(cwd, "service_account.json")
     oauth_file = os.path.join(cwd, "credentials.json")
 
     if os.path.exists(sa_file):
-        return _auth_with_service_account(sa_file)
+        return _service_account_creds(sa_file), None
     elif os.path.exists(oauth_file):
-        return _auth_with_oauth(oauth_file)
+        return _oauth_creds(oauth_file), "token.pickle"
     else:
         raise RuntimeError(
             "No credentials found. Place service_account.json (preferred) or credentials.json in project root."
         )
 
 
+def init_gspread_client():
+    """
+    Tries to auth using service_account.json first (recommended for server),
+    else falls back to credentials.json + local OAuth flow (interactive).
+    Returns a new client; use get_client() to share one across calls.
+    """
+    creds, _ = _load_creds()
+    return gspread.authorize(creds)
+
+
+# -------------------- Process-wide client / worksheet handles --------------------
+# Module globals outlive Streamlit reruns and are shared by every session in the
+# process, so credentials are loaded and the spreadsheet is located only once.
+_client_lock = threading.RLock()
+_creds = None
+_token_path: Optional[str] = None
+_client: Optional[gspread.Client] = None
+_spreadsheet: Optional[gspread.Spreadsheet] = None
+_worksheet: Optional[gspread.Worksheet] = None
+_partition_worksheets: Dict[str, gspread.Worksheet] = {}
+_sheet_ids: Optional[Dict] = None
+_refresher: Optional[threading.Thread] = None
+
+
+def _refresh_creds_if_needed(force: bool = False):
+    with _client_lock:
+        creds = _creds
+        if creds is None:
+            return
+        expiry = getattr(creds, "expiry", None)
+        due = expiry is None or expiry - TOKEN_REFRESH_MARGIN <= dt.datetime.utcnow()
+        if not (force or due or not creds.valid):
+            return
+        metrics.call("auth.refresh", creds.refresh, Request())
+        if _token_path:
+            with open(_token_path, "wb") as token:
+                pickle.dump(creds, token)
+
+
+def _token_refresher_loop():
+    while True:
+        time.sleep(TOKEN_CHECK_INTERVAL)
+        try:
+            _refresh_creds_if_needed()
+        except Exception as e:
+            print(f"⚠️ Background token refresh failed: {e}")
+
+
+def get_client() -> gspread.Client:
+    """Shared gspread client; credentials are refreshed by a background thread before expiry."""
+    global _creds, _token_path, _client, _refresher
+    with _client_lock:
+        if _client is None:
+            with metrics.timed("auth.load_creds"):
+                _creds, _token_path = _load_creds()
+            _client = gspread.authorize(_creds)
+        if _refresher is None:
+            _refresher = threading.Thread(target=_token_refresher_loop, name="capa-token-refresher", daemon=True)
+            _refresher.start()
+        return _client
+
+
+def _load_sheet_ids() -> Dict:
+    global _sheet_ids
+    if _sheet_ids is None:
+        _sheet_ids = {}
+        if os.path.exists(SHEET_IDS_PATH):
+            try:
+                with open(SHEET_IDS_PATH, "r", encoding="utf-8") as f:
+                    _sheet_ids = json.load(f)
+            except (OSError, ValueError):
+                _sheet_ids = {}
+    return _sheet_ids
+
+
+def _save_sheet_ids(ids: Dict):
+    global _sheet_ids
+    _sheet_ids = ids
+    try:
+        with open(SHEET_IDS_PATH, "w", encoding="utf-8") as f:
+            json.dump(ids, f)
+    except OSError as e:
+        print(f"⚠️ Could not persist sheet IDs: {e}")
+
+
+def get_worksheet(title: Optional[str] = None, create: bool = False) -> gspread.Worksheet:
+    """
+    Shared handle to the CAPA worksheet, or to the partition tab 'title'. The spreadsheet
+    is found by name only once; afterwards it and its tabs are reopened by remembered ID.
+    A missing partition tab is added if 'create' is set, else WorksheetNotFound is raised.
+    """
+    if title is not None and title != WORKSHEET_NAME:
+        return _partition_worksheet(title, create)
+    global _spreadsheet, _worksheet
+    with _client_lock:
+        if _worksheet is not None:
+            return _worksheet
+        client = get_client()
+        ids = _load_sheet_ids()
+        ws = None
+        if ids.get("spreadsheet_id") and ids.get("worksheet_id") is not None:
+            try:
+                sh = scheduler.call("sheets.open_by_key", client.open_by_key, ids["spreadsheet_id"])
+                ws = scheduler.call("sheets.get_worksheet", sh.get_worksheet_by_id, ids["worksheet_id"])
+            except (gspread.SpreadsheetNotFound, gspread.WorksheetNotFound):
+                ws = None
+        if ws is None:
+            sh, ws = _ensure_spreadsheet_and_worksheet(client)
+            _save_sheet_ids({"spreadsheet_id": sh.id, "worksheet_id": ws.id})
+        _spreadsheet, _worksheet = sh, ws
+        return ws
+
+
+def _partition_worksheet(title: str, create: bool) -> gspread.Worksheet:
+    with _client_lock:
+        if title in _partition_worksheets:
+            return _partition_worksheets[title]
+        get_worksheet()
+        ids = _load_sheet_ids()
+        known = ids.get("partitions", {})
+        ws = None
+        if title in known:
+            try:
+                ws = scheduler.call("sheets.get_worksheet", _spreadsheet.get_worksheet_by_id, known[title])
+            except gspread.WorksheetNotFound:
+                ws = None
+        if ws is None:
+            try:
+                ws = scheduler.call("sheets.get_worksheet", _spreadsheet.worksheet, title)
+            except gspread.WorksheetNotFound:
+                if not create:
+                    raise
+                ws = _add_worksheet(_spreadsheet, title, PARTITION_ROWS)
+            _save_sheet_ids({**ids, "partitions": {**known, title: ws.id}})
+        _partition_worksheets[title] = ws
+        return ws
+
+
+def _grid_rows(ws: gspread.Worksheet) -> int:
+    """Rows in the worksheet's grid, blank ones included, from fresh sheet metadata (ws.row_count may be stale)."""
+    meta = scheduler.call("sheets.get_metadata", ws.spreadsheet.fetch_sheet_metadata,
+                          {"fields": "sheets.properties(sheetId,gridProperties.rowCount)"})
+    for sheet in meta.get("sheets", []):
+        props = sheet.get("properties", {})
+        if props.get("sheetId") == ws.id:
+            return props.get("gridProperties", {}).get("rowCount", 0)
+    return ws.row_count
+
+
+def list_partitions() -> List[str]:
+    """Titles of the partition tabs in the spreadsheet, in date order."""
+    get_worksheet()
+    worksheets = scheduler.call("sheets.list_worksheets", _spreadsheet.worksheets)
+    titles = []
+    with _client_lock:
+        for ws in worksheets:
+            if is_partition(ws.title, WORKSHEET_NAME):
+                _partition_worksheets.setdefault(ws.title, ws)
+                titles.append(ws.title)
+    return sorted(titles)
+
+
+def reset_clients():
+    """Drop the shared client and handles (e.g. after revoking credentials); IDs are kept."""
+    global _creds, _token_path, _client, _spreadsheet, _worksheet
+    with _client_lock:
+        _creds = _token_path = _client = _spreadsheet = _worksheet = None
+        _partition_worksheets.clear()
+
+
+def _add_worksheet(sh: gspread.Spreadsheet, title: str, rows: int) -> gspread.Worksheet:
+    """Add a tab with the CAPA header row (or open it if another process just added it)."""
+    try:
+        ws = scheduler.call("sheets.add_worksheet", sh.add_worksheet,
+                            title=title, rows=str(rows), cols=str(len(SHEET_COLUMNS)))
+    except gspread.exceptions.APIError:
+        return scheduler.call("sheets.get_worksheet", sh.worksheet, title)
+    # Write header row
+    scheduler.call("sheets.append", ws.append_row, SHEET_COLUMNS)
+    return ws
+
+
 def _ensure_spreadsheet_and_worksheet(client: gspread.Client):
     # Open spreadsheet if exists; else create
     try:
-        sh = client.open(SPREADSHEET_NAME)
+        sh = scheduler.call("drive.open_by_name", client.open, SPREADSHEET_NAME)
     except gspread.SpreadsheetNotFound:
-        sh = client.create(SPREADSHEET_NAME)
+        sh = scheduler.call("sheets.create", client.create, SPREADSHEET_NAME)
         # If using service account, you may need to share the sheet with your user email to see it in Drive.
     # Try to open worksheet tab
     try:
-        ws = sh.worksheet(WORKSHEET_NAME)
+        ws = scheduler.call("sheets.get_worksheet", sh.worksheet, WORKSHEET_NAME)
     except gspread.WorksheetNotFound:
-        ws = sh.add_worksheet(title=WORKSHEET_NAME, rows="2000", cols=str(len(SHEET_COLUMNS)))
-        # Write header row
-        ws.append_row(SHEET_COLUMNS)
+        ws = _add_worksheet(sh, WORKSHEET_NAME, 2000)
     return sh, ws
 
 
-def append_row(data: Dict):
+# -------------------- Shared sheet snapshot --------------------
+def _last_column_letter(n_cols: int) -> str:
+    return gspread.utils.rowcol_to_a1(1, n_cols).rstrip("0123456789")
+
+
+class _SheetSnapshot:
     """
-    Insert a row into the Google Sheet. 'data' is a dict with keys matching SHEET_COLUMNS (case-insensitive).
-    Missing columns will be left blank. Extra keys are ignored.
+    In-memory copy of the SEARCH_COLUMNS of one worksheet, shared by every session in
+    the process. Only those columns are read (as batched range reads); full rows are
+    fetched on demand for the records that are actually opened and kept in
+    'full_rows'. 'index' maps each normalized CAPA_NO to the position of its first row.
+
+    The snapshot remembers the change token (see change_watcher) it was read at and
+    is re-read only when the token moves. Our own appends advance the token without
+    a re-read; if the token hadn't moved yet when we looked, the rows we appended are
+    kept in 'own_rows', and a re-read that finds nothing but those rows is not
+    reported as a change made by someone else. If the change check is off or
+    failing, rows past the last known row count are fetched every SNAPSHOT_TTL
+    seconds instead.
     """
-    client = init_gspread_client()
-    sh, ws = _ensure_spreadsheet_and_worksheet(client)
 
-    # Normalize keys and produce row in correct order
+    def __init__(self, title: str = WORKSHEET_NAME):
+        self.title = title
+        self.lock = threading.RLock()
+        self.header: List[str] = []
+        self.rows: List[List[str]] = []  # SEARCH_COLUMNS values, in that order
+        self.index: Dict[str, int] = {}
+        self.full_rows: Dict[int, List[str]] = {}  # position -> full row, in header order
+        self.loaded = False
+        self.fetched_at = 0.0
+        self.token: Optional[str] = None
+        self.own_rows: List[range] = []  # positions we appended that no token move has accounted for
+        self._df: Optional[pd.DataFrame] = None
+
+    def _index_from(self, start: int):
+        pos = SEARCH_COLUMNS.index("CAPA_NO")
+        for i in range(start, len(self.rows)):
+            key = normalize_capa_no(self.rows[i][pos])
+            if key:
+                self.index.setdefault(key, i)
+
+    def _column_ranges(self, columns: List[str], first_row: int, last_row: Optional[int]):
+        """A1 ranges covering 'columns' over the given sheet rows, merging adjacent columns."""
+        positions = sorted(self.header.index(c) + 1 for c in columns if c in self.header)
+        groups: List[List[int]] = []
+        for p in positions:
+            if groups and groups[-1][-1] == p - 1:
+                groups[-1].append(p)
+            else:
+                groups.append([p])
+        end = str(last_row) if last_row else ""
+        ranges = [f"{_last_column_letter(g[0])}{first_row}:{_last_column_letter(g[-1])}{end}" for g in groups]
+        return ranges, [[self.header[p - 1] for p in g] for g in groups]
+
+    def read_columns(self, ws: gspread.Worksheet, columns: List[str], first_row: int,
+                     last_row: Optional[int] = None, trim: bool = False) -> List[Dict[str, str]]:
+        """
+        Values of 'columns' for sheet rows first_row..last_row (to the end of the data if
+        last_row is None), read with a single batch_get. Rows past the end of the data
+        are returned blank unless 'trim' is set.
+        """
+        with self.lock:
+            if not self.header:
+                # only the header is needed, not a snapshot load
+                self.header = scheduler.call("sheets.get_range", ws.row_values, 1) or list(SHEET_COLUMNS)
+        ranges, range_cols = self._column_ranges(columns, first_row, last_row)
+        if not ranges:
+            return []
+        results = scheduler.call("sheets.batch_get", ws.batch_get, ranges)
+        if last_row and not trim:
+            n = last_row - first_row + 1
+        else:
+            n = max((len(r) for r in results), default=0)
+        rows = [{} for _ in range(n)]
+        for values, cols in zip(results, range_cols):
+            for j in range(n):
+                cells = list(values[j]) if j < len(values) else []
+                cells += [""] * (len(cols) - len(cells))
+                rows[j].update(zip(cols, cells))
+        return rows
+
+    def _read_search_columns(self, ws: gspread.Worksheet, first_row: int) -> List[List[str]]:
+        return [[r.get(c, "") for c in SEARCH_COLUMNS] for r in self.read_columns(ws, SEARCH_COLUMNS, first_row)]
+
+    def _full_load(self, ws: gspread.Worksheet):
+        self.header = scheduler.call("sheets.get_range", ws.row_values, 1) or list(SHEET_COLUMNS)
+        self.rows = self._read_search_columns(ws, 2)
+        self.index = {}
+        self.full_rows = {}
+        self._index_from(0)
+        self.loaded = True
+
+    def _fetch_new_rows(self, ws: gspread.Worksheet):
+        new_rows = self._read_search_columns(ws, len(self.rows) + 2)  # header is sheet row 1
+        if new_rows:
+            start = len(self.rows)
+            self.rows.extend(new_rows)
+            self._index_from(start)
+
+    def _reload(self, ws: gspread.Worksheet):
+        before, own_rows = self.rows, self.own_rows
+        self._full_load(ws)
+        self._df = None
+        self.own_rows = []
+        if own_rows and self.rows == before:
+            # the token moved for the rows we appended, which are already in place
+            return
+        # Any column may have been edited, including ones this snapshot doesn't hold
+        watcher = change_watcher()
+        if watcher is not None:
+            watcher.rows_changed(self.title)
+
+    def refresh(self, full: bool = False):
+        with self.lock:
+            # read the token first, so a change made while the rows are read is seen next time
+            token = _change_token()
+            ws = get_worksheet(self.title)
+            before = len(self.rows)
+            if not self.loaded:
+                self._full_load(ws)
+                self._df = None
+            elif full or (token is not None and token != self.token):
+                self._reload(ws)
+            else:
+                self._fetch_new_rows(ws)
+                if len(self.rows) != before:
+                    self._df = None
+            self.token = token
+            self.fetched_at = time.monotonic()
+
+    def ensure_fresh(self):
+        with self.lock:
+            if not self.loaded:
+                self.refresh()
+                return
+            token = _change_token()
+            if token is None:
+                stale = time.monotonic() - self.fetched_at >= SNAPSHOT_TTL
+            else:
+                stale = token != self.token
+            if stale:
+                self.refresh()
+
+    def _remember_full_row(self, pos: int, values: List[str]):
+        width = max(len(self.header), len(SHEET_COLUMNS))
+        self.full_rows[pos] = (list(values) + [""] * width)[:width]
+        while len(self.full_rows) > FULL_ROW_CACHE_SIZE:
+            self.full_rows.pop(next(iter(self.full_rows)))
+
+    def record_append(self, rows: List[List[str]], updated_range: Optional[str]):
+        """Add rows we just appended, or mark the snapshot stale if someone else appended first."""
+        with self.lock:
+            if not self.loaded:
+                return
+            sheet_row = _row_from_range(updated_range)
+            if sheet_row == len(self.rows) + 2:
+                start = len(self.rows)
+                # appended rows are in SHEET_COLUMNS order (normalize_row)
+                positions = [SHEET_COLUMNS.index(c) for c in SEARCH_COLUMNS]
+                for i, r in enumerate(rows):
+                    self.rows.append([r[p] if p < len(r) else "" for p in positions])
+                    self._remember_full_row(start + i, r)
+                self._index_from(start)
+                self._df = None
+                self.own_rows.append(range(start, len(self.rows)))
+            else:
+                self.fetched_at = 0.0
+                self.token = None
+
+    def cached_columns(self, columns: List[str], start: int, stop: int) -> Optional[List[Dict[str, str]]]:
+        """Values of 'columns' for positions [start, stop) if every row is in 'full_rows' (e.g. just appended)."""
+        with self.lock:
+            if not self.header or any(p not in self.full_rows for p in range(start, stop)):
+                return None
+            cols = [(c, self.header.index(c)) for c in columns if c in self.header]
+            return [{c: self.full_rows[p][i] for c, i in cols} for p in range(start, stop)]
+
+    def position(self, capa_no: str) -> Optional[int]:
+        self.ensure_fresh()
+        with self.lock:
+            return self.index.get(normalize_capa_no(capa_no))
+
+    def full_records(self, positions: List[int]) -> Dict[int, Dict]:
+        """Full records for the given row positions, reading uncached rows in one batch call."""
+        with self.lock:
+            missing = sorted({p for p in positions if p not in self.full_rows})
+            if missing:
+                ws = get_worksheet(self.title)
+                last_col = _last_column_letter(max(len(self.header), len(SHEET_COLUMNS)))
+                for i in range(0, len(missing), FULL_ROW_BATCH_SIZE):
+                    chunk = missing[i:i + FULL_ROW_BATCH_SIZE]
+                    ranges = [f"A{p + 2}:{last_col}{p + 2}" for p in chunk]
+                    results = scheduler.call("sheets.batch_get", ws.batch_get, ranges)
+                    for p, values in zip(chunk, results):
+                        self._remember_full_row(p, values[0] if values else [])
+            header = self.header or list(SHEET_COLUMNS)
+            return {p: values_to_record(header, self.full_rows[p]) for p in positions if p in self.full_rows}
+
+    def dataframe(self) -> pd.DataFrame:
+        self.ensure_fresh()
+        with self.lock:
+            if self._df is None:
+                self._df = rows_to_dataframe(SEARCH_COLUMNS, self.rows, SEARCH_COLUMNS)
+            return self._df
+
+
+_snapshots: Dict[str, _SheetSnapshot] = {}
+_snapshots_lock = threading.Lock()
+
+
+def _snapshot_for(title: str = WORKSHEET_NAME) -> _SheetSnapshot:
+    with _snapshots_lock:
+        if title not in _snapshots:
+            _snapshots[title] = _SheetSnapshot(title)
+        return _snapshots[title]
+
+
+# -------------------- Change notifications --------------------
+_change_watcher: Optional[ChangeWatcher] = None
+_change_watcher_lock = threading.Lock()
+_rows_changed_generation = 0  # bumped whenever a worksheet was changed by someone else
+
+
+def _spreadsheet_id() -> str:
+    get_worksheet()
+    return _load_sheet_ids()["spreadsheet_id"]
+
+
+def _on_rows_changed(title: str):
+    global _rows_changed_generation
+    _rows_changed_generation += 1
+    print(f"'{title}' was changed outside this process; edited rows will be re-indexed in the search index and analytics")
+
+
+def change_watcher() -> Optional[ChangeWatcher]:
+    """The watcher selected by CAPA_CHANGE_SOURCE, created once per process (None if "none")."""
+    global _change_watcher
+    with _change_watcher_lock:
+        if _change_watcher is None and CHANGE_SOURCE != "none":
+            if CHANGE_SOURCE == "drive":
+                source = DriveChangeSource(_spreadsheet_id, get_client)
+            elif CHANGE_SOURCE == "local":
+                source = LocalChangeSource(CHANGE_MARKER_PATH)
+            else:
+                raise RuntimeError(f"Unknown CAPA_CHANGE_SOURCE '{CHANGE_SOURCE}', expected 'drive', 'local' or 'none'")
+            _change_watcher = ChangeWatcher(source, CHANGE_CHECK_INTERVAL)
+            _change_watcher.add_listener(_on_rows_changed)
+        return _change_watcher
+
+
+def _change_token(fresh: bool = False) -> Optional[str]:
+    watcher = change_watcher()
+    return watcher.current(fresh) if watcher is not None else None
+
+
+def notify_sheet_changed():
+    """
+    Report that the sheet was edited (e.g. from a Drive push notification receiver or
+    a script that wrote to it). With CAPA_CHANGE_SOURCE=local this is how changes are
+    learned; with "drive" it only makes the next read check at once.
+    """
+    watcher = change_watcher()
+    if watcher is not None:
+        watcher.source.notify()
+        watcher.expire()
+
+
+def _acknowledge_write(before: Optional[str], after: Optional[str]):
+    """
+    Move snapshots read at token 'before' to 'after', the token our own write produced.
+    If the token hasn't moved yet, the snapshots keep the appended rows in 'own_rows'
+    so the re-read the later move causes is not taken for someone else's edit.
+    """
+    if before is None or after is None or after == before:
+        return
+    with _snapshots_lock:
+        snapshots = list(_snapshots.values())
+    for snapshot in snapshots:
+        with snapshot.lock:
+            if snapshot.token == before:
+                snapshot.token = after
+                snapshot.own_rows = []
+
+
+def _concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    if len(frames) == 1:
+        return frames[0].copy()
+    # align categories across worksheets so the concatenation stays categorical
+    for c in CATEGORY_COLUMNS:
+        if all(c in f.columns and isinstance(f[c].dtype, pd.CategoricalDtype) for f in frames):
+            categories = pd.api.types.union_categoricals([f[c] for f in frames]).categories
+            frames = [f.assign(**{c: f[c].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def _row_from_range(updated_range: Optional[str]) -> Optional[int]:
+    """Sheet row number from an A1 range like 'CAPA!A5:BM5'."""
+    if not updated_range:
+        return None
+    cell = updated_range.split("!")[-1].split(":")[0]
+    digits = "".join(ch for ch in cell if ch.isdigit())
+    return int(digits) if digits else None
+
+
+class SheetsStore(CapaStore):
+    """
+    Google Sheets storage; searches and lookups are served from per-worksheet snapshots.
+    With a partition scheme other than "none", rows are routed into per-year or
+    per-quarter tabs by DATE_OF_INCIDENT, searches only read the tabs overlapping
+    the date range, and lookups go straight to a record's tab via the partition
+    directory.
+    """
+
+    def __init__(self, scheme: Optional[str] = None):
+        scheme = scheme or PARTITION_SCHEME
+        if scheme not in PARTITION_SCHEMES:
+            raise RuntimeError(f"Unknown CAPA_PARTITION_SCHEME '{scheme}', expected one of {PARTITION_SCHEMES}")
+        self.scheme = scheme
+        self.directory = PartitionDirectory(PARTITION_DIRECTORY_PATH) if scheme != "none" else None
+        self._lock = threading.Lock()
+        self._titles: List[str] = [WORKSHEET_NAME]
+        self._titles_at: Optional[float] = None
+        self._titles_token: Optional[str] = None
+
+    def partitions(self) -> List[str]:
+        """Worksheets holding CAPA rows: the CAPA tab, then partition tabs in date order."""
+        if self.scheme == "none":
+            return [WORKSHEET_NAME]
+        token = _change_token()
+        with self._lock:
+            if token is None:
+                stale = self._titles_at is None or time.monotonic() - self._titles_at >= SNAPSHOT_TTL
+            else:
+                stale = self._titles_at is None or token != self._titles_token
+            if stale:
+                self._titles = [WORKSHEET_NAME] + list_partitions()
+                self._titles_at = time.monotonic()
+                self._titles_token = token
+            return list(self._titles)
+
+    def append_rows(self, rows: List[List[str]]):
+        # An edit by someone else between the two token checks is taken for ours and
+        # only seen at the next change; the window is one API round trip either side.
+        before = _change_token(fresh=True)
+        date_pos = SHEET_COLUMNS.index("DATE_OF_INCIDENT")
+        key_pos = SHEET_COLUMNS.index("CAPA_NO")
+        groups: Dict[str, List[List[str]]] = {}
+        for r in rows:
+            title = partition_for(r[date_pos] if date_pos < len(r) else "", self.scheme, WORKSHEET_NAME)
+            groups.setdefault(title, []).append(r)
+        for title, group in groups.items():
+            ws = get_worksheet(title, create=True)
+            resp = scheduler.call("sheets.append", ws.append_rows, group)
+            updated_range = (resp or {}).get("updates", {}).get("updatedRange")
+            _snapshot_for(title).record_append(group, updated_range)
+            if self.directory is not None:
+                first = _row_from_range(updated_range)
+                if first:
+                    self.directory.update({normalize_capa_no(r[key_pos]): (title, first - 2 + i)
+                                           for i, r in enumerate(group)})
+                with self._lock:
+                    if title not in self._titles:
+                        self._titles_at = None
+        notify_sheet_changed()
+        _acknowledge_write(before, _change_token(fresh=True))
+
+    def dataframe(self) -> pd.DataFrame:
+        # Full dump of every column; not cached, searches use the projected snapshots
+        frames = []
+        for title in self.partitions():
+            values = scheduler.call("sheets.get_all_values", get_worksheet(title).get_all_values)
+            if len(values) > 1:
+                frames.append(rows_to_dataframe(values[0], values[1:]))
+        if not frames:
+            return rows_to_dataframe(list(SHEET_COLUMNS), [])
+        return _concat_frames(frames)
+
+    def query(self, department: Optional[str] = None, area: Optional[str] = None,
+              start_date: Optional[str] = None, end_date: Optional[str] = None) -> pd.DataFrame:
+        titles = partitions_overlapping(self.partitions(), WORKSHEET_NAME, start_date, end_date)
+        frames = [df for df in (_snapshot_for(t).dataframe() for t in titles) if not df.empty]
+        if not frames:
+            return rows_to_dataframe(SEARCH_COLUMNS, [], SEARCH_COLUMNS)
+        return filter_records(_concat_frames(frames), department, area, start_date, end_date)
+
+    def _locate(self, capa_no: str, use_directory: bool = True) -> Optional[Tuple[str, int, bool]]:
+        """(worksheet title, row position, came from the directory) of the first row with this CAPA_NO."""
+        key = normalize_capa_no(capa_no)
+        if use_directory and self.directory is not None:
+            hint = self.directory.get(key)
+            if hint is not None:
+                return hint[0], hint[1], True
+        for title in self.partitions():
+            pos = _snapshot_for(title).position(capa_no)
+            if pos is not None:
+                if self.directory is not None:
+                    self.directory.update({key: (title, pos)})
+                return title, pos, False
+        return None
+
+    def _read_located(self, locations: Dict[str, Tuple[str, int, bool]]) -> Dict[str, Optional[Dict]]:
+        by_title: Dict[str, List[int]] = {}
+        for title, pos, _ in locations.values():
+            by_title.setdefault(title, []).append(pos)
+        records: Dict[Tuple[str, int], Dict] = {}
+        for title, positions in by_title.items():
+            try:
+                found = _snapshot_for(title).full_records(positions)
+            except gspread.WorksheetNotFound:
+                found = {}
+            records.update({(title, p): r for p, r in found.items()})
+        out = {}
+        for capa_no, (title, pos, from_directory) in locations.items():
+            record = records.get((title, pos))
+            key = normalize_capa_no(capa_no)
+            if from_directory and (record is None or normalize_capa_no(record.get("CAPA_NO", "")) != key):
+                # stale directory entry (tab edited by hand); search the snapshots instead
+                self.directory.forget(key)
+                located = self._locate(capa_no, use_directory=False)
+                record = self._read_located({capa_no: located})[capa_no] if located else None
+            out[capa_no] = record
+        return out
+
+    def lookup(self, capa_no: str) -> Optional[Dict]:
+        located = self._locate(capa_no)
+        if located is None:
+            return None
+        return self._read_located({capa_no: located})[capa_no]
+
+    def lookup_many(self, capa_nos: List[str]) -> Dict[str, Optional[Dict]]:
+        located = {c: self._locate(c) for c in capa_nos}
+        records = self._read_located({c: loc for c, loc in located.items() if loc is not None})
+        return {c: records.get(c) for c in capa_nos}
+
+    def exists(self, capa_no: str) -> bool:
+        # a directory hint is only a hint: lookup() reads the row and checks its CAPA_NO
+        return self.lookup(capa_no) is not None
+
+    def source_id(self) -> str:
+        get_worksheet()
+        ids = _load_sheet_ids()
+        if self.scheme == "none":
+            return f"sheets:{ids.get('spreadsheet_id')}:{ids.get('worksheet_id')}"
+        return f"sheets:{ids.get('spreadsheet_id')}:{self.scheme}"
+
+    def segments(self) -> List[str]:
+        return self.partitions()
+
+    def row_count(self, segment: str = "") -> int:
+        snapshot = _snapshot_for(segment or WORKSHEET_NAME)
+        snapshot.ensure_fresh()
+        return len(snapshot.rows)
+
+    def read_columns(self, columns: List[str], start: int, stop: int, segment: str = "") -> List[Dict[str, str]]:
+        if stop <= start:
+            return []
+        title = segment or WORKSHEET_NAME
+        snapshot = _snapshot_for(title)
+        with snapshot.lock:
+            snapshot.ensure_fresh()
+            cached = snapshot.cached_columns(columns, start, stop)
+            if cached is not None:
+                return cached
+            return snapshot.read_columns(get_worksheet(title), columns, start + 2, stop + 1)
+
+    def read_rows(self, columns: List[str], start: int, limit: int, segment: str = "") -> List[Dict[str, str]]:
+        # Straight from the sheet, so a full dump does not load (or refresh) the snapshots
+        title = segment or WORKSHEET_NAME
+        ws = get_worksheet(title)
+        rows = _snapshot_for(title).read_columns(ws, columns, start + 2, start + limit + 1, trim=True)
+        if len(rows) < limit:
+            # Sheets drops trailing blank rows, so a short read may just end in a gap;
+            # it is the end only if the grid ends there too (row 1 is the header)
+            end = min(start + limit, _grid_rows(ws) - 1)
+            rows += [{c: "" for c in columns} for _ in range(end - start - len(rows))]
+        return rows
+
+    def refresh(self, full: bool = False):
+        with self._lock:
+            self._titles_at = None
+        for title in self.partitions():
+            snapshot = _snapshot_for(title)
+            # partitions nobody has searched yet are loaded on first use
+            if full or snapshot.loaded or title == WORKSHEET_NAME:
+                snapshot.refresh(full=full)
+
+
+_store: Optional[CapaStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> CapaStore:
+    """The storage backend selected by CAPA_STORAGE_BACKEND, created once per process."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STORAGE_BACKEND == "sheets":
+                _store = SheetsStore()
+            elif STORAGE_BACKEND == "sqlite":
+                _store = SQLiteStore(SQLITE_PATH, mirror=SheetsStore() if SQLITE_MIRROR_TO_SHEET else None)
+            else:
+                raise RuntimeError(f"Unknown CAPA_STORAGE_BACKEND '{STORAGE_BACKEND}', expected 'sheets' or 'sqlite'")
+        return _store
+
+
+_derived_generations: Dict[str, int] = {}  # path -> _rows_changed_generation it was built at
+
+
+def _catch_up(derived, cls, path: str, columns: List[str], add, update, name: str):
+    """
+    'derived' (a TextIndex or CapaStats, or None) loaded from 'path' if needed and fed
+    the rows of every store segment past its watermark, via add(derived, start, rows,
+    segment). If a worksheet was changed by someone else, the rows already taken in
+    are read again and passed to update(derived, start, rows, segment), which only
+    re-indexes those that differ. Rebuilt from scratch if it was built from another
+    source or rows were removed.
+    """
+    store = get_store()
+    source = store.source_id()
+    # counting rows re-reads changed snapshots, which reports changes made by someone else
+    totals = {segment: store.row_count(segment) for segment in store.segments()}
+    generation = _rows_changed_generation
+    if derived is None or derived.source != source:
+        derived = cls.load(path, source)
+        # a saved copy may predate rows changed since this process started
+        resync = generation != 0
+    else:
+        resync = _derived_generations.get(path) != generation
+    _derived_generations[path] = generation
+    if any(derived.indexed(segment) > total for segment, total in totals.items()):
+        # rows were removed from the sheet; positions no longer line up
+        derived = cls(source)
+    elif resync:
+        changed = 0
+        for segment in totals:
+            indexed = derived.indexed(segment)
+            for start in range(0, indexed, TEXT_INDEX_SYNC_CHUNK):
+                stop = min(indexed, start + TEXT_INDEX_SYNC_CHUNK)
+                changed += update(derived, start, store.read_columns(columns, start, stop, segment), segment)
+        if changed:
+            print(f"Re-indexed {changed} edited row(s) in the {name}")
+    for segment, total in totals.items():
+        while derived.indexed(segment) < total:
+            start = derived.indexed(segment)
+            stop = min(total, start + TEXT_INDEX_SYNC_CHUNK)
+            rows = store.read_columns(columns, start, stop, segment)
+            if not rows:
+                break
+            add(derived, start, rows, segment)
+    if derived.dirty():
+        try:
+            derived.save(path)
+        except OSError as e:
+            print(f"⚠️ Could not save {name}: {e}")
+    return derived
+
+
+_text_index: Optional[TextIndex] = None
+_text_index_lock = threading.Lock()
+
+
+def _synced_text_index() -> TextIndex:
+    """The keyword index, loaded from disk once and caught up with rows added since."""
+    global _text_index
+    with _text_index_lock:
+        _text_index = _catch_up(
+            _text_index, TextIndex, TEXT_INDEX_PATH, TEXT_FIELDS + ["CAPA_NO"],
+            lambda index, start, rows, segment: index.add_rows(
+                start, rows, [normalize_capa_no(r.get("CAPA_NO", "")) for r in rows], segment),
+            lambda index, start, rows, segment: index.update_rows(
+                start, rows, [normalize_capa_no(r.get("CAPA_NO", "")) for r in rows], segment),
+            "text index")
+        return _text_index
+
+
+_analytics: Optional[CapaStats] = None
+_analytics_lock = threading.Lock()
+
+
+def _synced_analytics() -> CapaStats:
+    """The dashboard counters, loaded from disk once and caught up with rows added since."""
+    global _analytics
+    with _analytics_lock:
+        _analytics = _catch_up(
+            _analytics, CapaStats, ANALYTICS_PATH, ANALYTICS_COLUMNS,
+            lambda stats, start, rows, segment: stats.add_rows(start, rows, segment),
+            lambda stats, start, rows, segment: stats.update_rows(start, rows, segment),
+            "analytics")
+        return _analytics
+
+
+def _update_analytics():
+    # Keep counters already in use current after a write; others catch up when first viewed
+    if _analytics is None:
+        return
+    try:
+        _synced_analytics()
+    except Exception as e:
+        print(f"⚠️ Analytics not updated, will catch up on next view: {e}")
+
+
+def analytics_summary() -> Dict:
+    """Counter tables for the dashboard (see CapaStats.summary), the 'overdue' actions as of today and the 'total'."""
+    stats = _synced_analytics()
+    return {**stats.summary(), "overdue": stats.overdue(), "total": stats.total}
+
+
+def search_text(query: str, limit: Optional[int] = None) -> Dict[str, float]:
+    """Ranked keyword search over TEXT_FIELDS; returns {normalized CAPA_NO: score}, best first."""
+    return _synced_text_index().search(query, limit)
+
+
+def refresh_records(full: bool = False):
+    """Pick up rows added outside this process now (full=True re-reads the whole sheet)."""
+    get_store().refresh(full=full)
+    _update_analytics()
+
+
+def normalize_row(data: Dict) -> List[str]:
+    """
+    Sheet row for 'data' in SHEET_COLUMNS order (keys matched case-insensitively). Typed
+    values (flags as bool, dates as date/Timestamp) are written back in the sheet's format.
+    """
     row = []
     for col in SHEET_COLUMNS:
         v = data.get(col) or data.get(col.lower()) or data.get(col.title()) or ""
-        # if it's a datetime, convert to ISO date
-        if isinstance(v, (dt.date, dt.datetime)):
-            v = v.isoformat()
-        row.append(str(v))
-    ws.append_row(row)
+        row.append(to_sheet_string(col, v))
+    return row
+
+
+def append_row(data: Dict):
+    """
+    Insert a row into the Google Sheet. 'data' is a dict with keys matching SHEET_COLUMNS (case-insensitive).
+    Missing columns will be left blank. Extra keys are ignored.
+    """
+    get_store().append_rows([normalize_row(data)])
+    _update_analytics()
+
+
+def append_rows(rows: List[List[str]]):
+    """Append already-normalized rows (see normalize_row) in a single write."""
+    if not rows:
+        return
+    get_store().append_rows(rows)
+    _update_analytics()
 
 
 def _sheet_to_dataframe():
-    client = init_gspread_client()
-    sh, ws = _ensure_spreadsheet_and_worksheet(client)
-    records = ws.get_all_records()
-    if not records:
-        return pd.DataFrame(columns=SHEET_COLUMNS)
-    df = pd.DataFrame(records)
-    # Ensure columns exist
-    for c in SHEET_COLUMNS:
-        if c not in df.columns:
-            df[c] = ""
-    # Parse date column if present
-    try:
-        df["DATE_OF_INCIDENT"] = pd.to_datetime(df["DATE_OF_INCIDENT"], errors="coerce")
-    except Exception:
-        pass
-    return df
+    return get_store().dataframe()
 
 
 def get_all_records() -> pd.DataFrame:
-    return _sheet_to_dataframe()
+    return _sheet_to_dataframe().copy()
 
 
 def find_by_capa_no(capa_no: str) -> Optional[Dict]:
-    df = _sheet_to_dataframe()
-    if df.empty:
-        return None
-    row = df[df["CAPA_NO"].astype(str).str.strip().str.lower() == str(capa_no).strip().lower()]
-    if row.empty:
-        return None
-    # return first match as dict (with original column names)
-    return row.iloc[0].to_dict()
+    """First record whose CAPA_NO matches (ignoring surrounding spaces and case), or None."""
+    return get_store().lookup(capa_no)
+
+
+def find_many_by_capa_no(capa_nos: List[str]) -> Dict[str, Optional[Dict]]:
+    """Batch form of find_by_capa_no, keyed by the CAPA numbers as given."""
+    return get_store().lookup_many(capa_nos)
+
+
+def capa_exists(capa_no: str) -> bool:
+    return get_store().exists(capa_no)
 
 
 def query_records(department: Optional[str] = None, area: Optional[str] = None,
-                  start_date: Optional[str] = None, end_date: Optional[str] = None) -> pd.DataFrame:
-    df = _sheet_to_dataframe()
-    if df.empty:
-        return df
-    res = df.copy()
-    if department:
-        res = res[res["DEPARTMENT"].astype(str).str.contains(department, case=False, na=False)]
-    if area:
-        res = res[res["AREA_SECTION"].astype(str).str.contains(area, case=False, na=False)]
-    if start_date:
-        sd = pd.to_datetime(start_date, errors="coerce")
-        if not pd.isna(sd):
-            res = res[res["DATE_OF_INCIDENT"] >= sd]
-    if end_date:
-        ed = pd.to_datetime(end_date, errors="coerce")
-        if not pd.isna(ed):
-            # include that day
-            res = res[res["DATE_OF_INCIDENT"] <= (ed + pd.Timedelta(days=1))]
-    return res
+                  start_date: Optional[str] = None, end_date: Optional[str] = None,
+                  text: Optional[str] = None) -> pd.DataFrame:
+    """
+    Matching records with SEARCH_COLUMNS only; use find_by_capa_no for a full record.
+    With 'text', only records matching those keywords in TEXT_FIELDS are kept, ranked
+    best first, with their relevance in a SCORE column.
+    """
+    df = get_store().query(department, area, start_date, end_date)
+    if text and text.strip() and not df.empty:
+        scores = search_text(text)
+        keys = df["CAPA_NO"].astype(str).map(normalize_capa_no)
+        df = df.assign(SCORE=keys.map(scores)).dropna(subset=["SCORE"])
+        df = df.sort_values("SCORE", ascending=False, kind="stable")
+    return df
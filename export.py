@@ -0,0 +1,169 @@
+"""
+Full dump of the CAPA register to CSV or Parquet.
+
+    python export.py capa_register.csv
+    python export.py capa_register.parquet
+
+Rows are read EXPORT_PAGE_ROWS at a time (from every partition tab) straight from
+storage, bypassing the search snapshots, and each page is written before the next
+is read, so memory use does not grow with the sheet.
+CSV keeps the cell text as stored; Parquet has typed columns (flags as booleans,
+dates as timestamps, department/area dictionary-encoded) and needs pyarrow.
+"""
+import argparse
+import atexit
+import csv
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+from drive_helper import get_store
+from schema import CATEGORY_COLUMNS, DATE_COLUMNS, FLAG_COLUMNS, SHEET_COLUMNS, rows_to_dataframe
+
+EXPORT_PAGE_ROWS = 2000  # rows per read; one Sheets call per page
+EXPORT_FORMATS = ("csv", "parquet")
+EXPORT_FILE_MAX_AGE = 3600  # seconds a prepared export file is kept for download
+
+_export_dir: Optional[str] = None
+_export_dir_lock = threading.Lock()
+
+
+def iter_pages(page_rows: int = EXPORT_PAGE_ROWS) -> Iterator[List[List[str]]]:
+    """
+    Every stored row as SHEET_COLUMNS-ordered cell text, in pages of at most 'page_rows'.
+    Blank rows (e.g. left by records cleared by hand) are skipped, not taken as the end.
+    """
+    store = get_store()
+    for segment in store.segments():
+        start = 0
+        while True:
+            records = store.read_rows(SHEET_COLUMNS, start, page_rows, segment)
+            rows = [[r.get(c, "") for c in SHEET_COLUMNS] for r in records]
+            rows = [r for r in rows if any(r)]
+            if rows:
+                yield rows
+            if len(records) < page_rows:
+                break
+            start += page_rows
+
+
+def _arrow_schema(pa):
+    def arrow_type(col: str):
+        if col in FLAG_COLUMNS:
+            return pa.bool_()
+        if col in DATE_COLUMNS:
+            return pa.timestamp("ms")
+        if col in CATEGORY_COLUMNS:
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.string()
+
+    return pa.schema([pa.field(c, arrow_type(c)) for c in SHEET_COLUMNS])
+
+
+def _write_csv(out: BinaryIO, pages: Iterator[List[List[str]]], on_page: Callable[[int], None]):
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    try:
+        writer = csv.writer(text)
+        writer.writerow(SHEET_COLUMNS)
+        for rows in pages:
+            writer.writerows(rows)
+            on_page(len(rows))
+        text.flush()
+    finally:
+        text.detach()  # leave the caller's file open
+
+
+def _write_parquet(out: BinaryIO, pages: Iterator[List[List[str]]], on_page: Callable[[int], None]):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    schema = _arrow_schema(pa)
+    with pq.ParquetWriter(out, schema) as writer:
+        for rows in pages:
+            if not rows:
+                continue
+            # one row group per page; categories differ between pages, the schema does not
+            df = rows_to_dataframe(SHEET_COLUMNS, rows)
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            on_page(len(rows))
+
+
+def export_records(out: BinaryIO, fmt: str = "csv", page_rows: int = EXPORT_PAGE_ROWS,
+                   progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Write every CAPA record to the binary file 'out' as 'fmt' ("csv" or "parquet").
+    'progress' is called with the number of rows written so far after every page.
+    Returns the number of rows written.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {EXPORT_FORMATS}")
+    written = 0
+
+    def on_page(n: int):
+        nonlocal written
+        written += n
+        if progress:
+            progress(written)
+
+    pages = iter_pages(page_rows)
+    if fmt == "csv":
+        _write_csv(out, pages, on_page)
+    else:
+        _write_parquet(out, pages, on_page)
+    return written
+
+
+def _prepared_exports_dir() -> str:
+    """Per-process directory for prepared exports, removed at exit; files past EXPORT_FILE_MAX_AGE are pruned."""
+    global _export_dir
+    with _export_dir_lock:
+        if _export_dir is None:
+            _export_dir = tempfile.mkdtemp(prefix="capa_export_")
+            atexit.register(shutil.rmtree, _export_dir, True)
+        cutoff = time.time() - EXPORT_FILE_MAX_AGE
+        for entry in os.scandir(_export_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+        return _export_dir
+
+
+def export_to_file(fmt: str = "csv", progress: Optional[Callable[[int], None]] = None) -> Tuple[str, int]:
+    """
+    export_records into a new file in this process's export directory, for serving as
+    a download. Returns its path and the number of rows. The file is removed after
+    EXPORT_FILE_MAX_AGE seconds or when the process exits.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {EXPORT_FORMATS}")
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}", dir=_prepared_exports_dir())
+    try:
+        with os.fdopen(fd, "wb") as f:
+            rows = export_records(f, fmt, progress=progress)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="output file; the format is taken from its extension (.csv or .parquet)")
+    parser.add_argument("--page-rows", type=int, default=EXPORT_PAGE_ROWS)
+    args = parser.parse_args()
+    fmt = "parquet" if args.path.lower().endswith(".parquet") else "csv"
+    with open(args.path, "wb") as f:
+        n = export_records(f, fmt, args.page_rows, progress=lambda done: print(f"\r{done} rows", end="", flush=True))
+    print(f"\nWrote {n} CAPA record(s) to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# Offline CAPA report renderer: lays out the same {{KEY}} fields that fill the
+# Google Docs template and writes PDF bytes directly, using only the standard
+# base fonts (Helvetica, plus ZapfDingbats for tick marks).
+from typing import Dict, List, Tuple
+
+PAGE_WIDTH = 595  # A4 in points
+PAGE_HEIGHT = 842
+MARGIN = 40
+BODY_SIZE = 9
+HEADING_SIZE = 11
+LINE_GAP = 3
+
+# Characters the form uses that the base fonts cannot encode
+_TEXT_SUBSTITUTIONS = {"≥": ">=", "≤": "<=", "’": "'", "‘": "'", "“": '"', "”": '"', "—": "-", "–": "-"}
+
+# (heading, [(label, key)]) — plain text fields, in the template's order
+_SECTIONS = [
+    ("General Information", [
+        ("Department", "DEPARTMENT"),
+        ("Area / Section", "AREA_SECTION"),
+        ("Date of Incident", "DATE_OF_INCIDENT"),
+        ("CAPA No", "CAPA_NO"),
+    ]),
+    ("Problem Description", [
+        ("What", "WHAT"),
+        ("Where", "WHERE"),
+        ("When", "WHEN"),
+        ("Extent", "EXTENT"),
+    ]),
+]
+
+_BREAKDOWN_TICKS = [("≥ 4 Hrs", "A"), ("2 - 4 Hrs", "B"), ("1 - 2 Hrs", "C"), ("≤ 1 Hrs", "D")]
+_FIVE_M_TICKS = [("Material", "M1"), ("Man", "M2"), ("Machine", "M3"), ("Measure", "M4"), ("Method", "M5")]
+_DOCUMENT_TICKS = [
+    ("MOC", "O1"),
+    ("SOP / SMP", "O2"),
+    ("Risk and Opportunity Register", "O3"),
+    ("Register of Environmental Aspect Impact and OH & S Risks", "O4"),
+    ("Training Need Identification", "O5"),
+]
+_TEAM_ROWS = [("LEADER", "R1", "C1"), ("MEM1", "R2", "C2"), ("MEM2", "R3", "C3"),
+              ("MEM3", "R4", "C4"), ("MEM4", "R5", "C5")]
+
+
+def _encode(text: str) -> str:
+    for src, dst in _TEXT_SUBSTITUTIONS.items():
+        text = text.replace(src, dst)
+    text = text.encode("cp1252", errors="replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _wrap(text: str, width: float, size: float) -> List[str]:
+    # Helvetica averages roughly half an em per character
+    max_chars = max(1, int(width / (size * 0.5)))
+    lines = []
+    for para in str(text).splitlines() or [""]:
+        words = para.split()
+        line = ""
+        for word in words:
+            while len(word) > max_chars:
+                if line:
+                    lines.append(line)
+                    line = ""
+                lines.append(word[:max_chars])
+                word = word[max_chars:]
+            candidate = f"{line} {word}" if line else word
+            if len(candidate) > max_chars:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+class _Layout:
+    def __init__(self):
+        self.pages: List[List[str]] = []
+        self._new_page()
+
+    def _new_page(self):
+        self.ops: List[str] = []
+        self.pages.append(self.ops)
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def _ensure(self, height: float):
+        if self.y - height < MARGIN:
+            self._new_page()
+
+    def _text(self, x: float, y: float, text: str, font: str = "F1", size: float = BODY_SIZE):
+        self.ops.append(f"BT /{font} {size} Tf {x:.1f} {y:.1f} Td ({_encode(text)}) Tj ET")
+
+    def title(self, text: str):
+        self._ensure(30)
+        self.y -= 16
+        self._text(MARGIN, self.y, text, font="F2", size=16)
+        self.y -= 14
+
+    def heading(self, text: str):
+        self._ensure(HEADING_SIZE + 24)
+        self.y -= 8
+        self.ops.append(f"0.5 w {MARGIN} {self.y:.1f} m {PAGE_WIDTH - MARGIN} {self.y:.1f} l S")
+        self.y -= HEADING_SIZE + 4
+        self._text(MARGIN, self.y, text, font="F2", size=HEADING_SIZE)
+        self.y -= LINE_GAP + 2
+
+    def field(self, label: str, value: str, label_width: float = 130):
+        value_x = MARGIN + label_width
+        lines = _wrap(value, PAGE_WIDTH - MARGIN - value_x, BODY_SIZE)
+        for i, line in enumerate(lines):
+            self._ensure(BODY_SIZE + LINE_GAP)
+            self.y -= BODY_SIZE + LINE_GAP
+            if i == 0:
+                self._text(MARGIN, self.y, f"{label}:", font="F2")
+            self._text(value_x, self.y, line)
+
+    def columns(self, cells: List[Tuple[str, bool]], widths: List[float]):
+        self._ensure(BODY_SIZE + LINE_GAP)
+        self.y -= BODY_SIZE + LINE_GAP
+        x = MARGIN
+        for (text, bold), width in zip(cells, widths):
+            max_chars = max(1, int(width / (BODY_SIZE * 0.5)) - 1)
+            self._text(x, self.y, str(text)[:max_chars], font="F2" if bold else "F1")
+            x += width
+
+    def ticks(self, items: List[Tuple[str, bool]]):
+        box = BODY_SIZE
+        for label, ticked in items:
+            self._ensure(box + LINE_GAP + 2)
+            self.y -= box + LINE_GAP + 2
+            self.ops.append(f"0.5 w {MARGIN:.1f} {self.y - 1:.1f} {box} {box} re S")
+            if ticked:
+                # '4' is the check mark glyph in ZapfDingbats
+                self._text(MARGIN + 1, self.y, "4", font="F3", size=box)
+            self._text(MARGIN + box + 6, self.y, label)
+
+    def gap(self, height: float = 4):
+        self.y -= height
+
+
+def _build_pdf(pages: List[List[str]]) -> bytes:
+    objects: List[bytes] = []
+
+    def add(obj: bytes) -> int:
+        objects.append(obj)
+        return len(objects)
+
+    catalog_id = add(b"")  # filled in once the page tree exists
+    pages_id = add(b"")
+    fonts = (
+        add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"),
+        add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>"),
+        add(b"<< /Type /Font /Subtype /Type1 /BaseFont /ZapfDingbats >>"),
+    )
+    resources = "<< /Font << /F1 %d 0 R /F2 %d 0 R /F3 %d 0 R >> >>" % fonts
+
+    page_ids = []
+    for number, ops in enumerate(pages, start=1):
+        footer = f"BT /F1 8 Tf {PAGE_WIDTH - MARGIN - 60} {MARGIN / 2:.1f} Td (Page {number} of {len(pages)}) Tj ET"
+        stream = "\n".join(ops + [footer]).encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            (f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+             f"/Resources {resources} /Contents {content_id} 0 R >>").encode("latin-1")
+        ))
+
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("latin-1")
+    objects[catalog_id - 1] = f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode("latin-1")
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref_at)
+    return bytes(out)
+
+
+def render_capa_pdf(fields: Dict[str, str]) -> bytes:
+    """
+    Render a CAPA report from template fields (the values that would replace each
+    {{KEY}}; tick columns hold '✔' or '') and return PDF bytes.
+    """
+    def get(key: str) -> str:
+        return str(fields.get(key, "") or "")
+
+    def ticked(key: str) -> bool:
+        return bool(get(key).strip())
+
+    doc = _Layout()
+    doc.title(f"CAPA Report — {get('CAPA_NO')}")
+
+    for heading, items in _SECTIONS:
+        doc.heading(heading)
+        for label, key in items:
+            doc.field(label, get(key))
+
+    doc.heading("In Case of Breakdown")
+    doc.field("Duration From", get("TIME1"))
+    doc.field("Duration To", get("TIME2"))
+    doc.ticks([(label, ticked(key)) for label, key in _BREAKDOWN_TICKS])
+
+    doc.heading("Responsible Team for Corrective/Preventive Actions")
+    doc.field("Team Name", get("TEAM_NAME"))
+    widths = [60, 160, 160, 135]
+    doc.columns([("", True), ("Name", True), ("Role", True), ("Contact No.", True)], widths)
+    for i, (name_key, role_key, contact_key) in enumerate(_TEAM_ROWS):
+        title = "Leader" if i == 0 else f"Member {i}"
+        doc.columns([(title, True), (get(name_key), False), (get(role_key), False), (get(contact_key), False)], widths)
+
+    doc.heading("Correction / Immediate Actions Taken")
+    doc.field("Actions taken", get("ACTIONS"))
+    doc.field("Time Frame", get("TIME_FRAME"))
+    doc.field("Responsibility", get("RESPONSIBILITY"))
+
+    doc.heading("Root Cause Analysis - Analysis Finding")
+    for n, key in enumerate(["WHY1", "WHY2", "WHY3", "WHY4", "WHY5"], start=1):
+        doc.field(f"Why {n}", get(key))
+    doc.gap()
+    doc.field("Applicable 5 M's", "")
+    doc.ticks([(label, ticked(key)) for label, key in _FIVE_M_TICKS])
+    doc.field("Conclusion(s)", get("CONCLUSION"))
+
+    doc.heading("Recommended Corrective Action(s)")
+    doc.field("Corrective Actions", get("C_ACTIONS"))
+    doc.field("Responsibility", get("RES1"))
+    doc.field("Target date", get("T1"))
+    doc.field("Date of implementation", get("D1"))
+
+    doc.heading("Recommended Preventive Action(s)")
+    doc.field("Preventive Actions", get("P_ACTIONS"))
+    doc.field("Responsibility", get("RES2"))
+    doc.field("Target date", get("T2"))
+    doc.field("Date of implementation", get("D2"))
+
+    doc.heading("Detailed Implementation Plan")
+    doc.field("Plan", get("PLAN"))
+
+    doc.heading("Modified Documents")
+    doc.ticks([(label, ticked(key)) for label, key in _DOCUMENT_TICKS])
+    doc.field("Others", get("OTHERS"))
+
+    doc.heading("Training Details")
+    doc.field("Training Details", get("TRAINING_DETAILS"))
+    doc.field("Date of Implementation", get("DATE_IMPLE"))
+
+    doc.heading("Effectiveness Evaluation")
+    doc.field("Evaluation", get("EFFECTIVENESS_EVAL"))
+
+    doc.heading("Sign-off")
+    doc.field("Prepared By", get("INITIATOR"))
+    doc.field("Reviewed By", get("REVIEWER"))
+    doc.field("Approved By (HOD)", get("HOD"))
+
+    return _build_pdf(doc.pages)
@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# Prometheus text-format snapshot, rewritten every METRICS_FLUSH_INTERVAL seconds
+# (point a node_exporter textfile collector at it, or just read it)
+METRICS_FILE = os.environ.get("CAPA_METRICS_FILE", ".capa_metrics.prom")
+METRICS_FLUSH_INTERVAL = 15.0
+# If set, /metrics is also served over HTTP on this port, on localhost unless
+# CAPA_METRICS_HOST says otherwise (e.g. 0.0.0.0 for a scraper on another machine)
+METRICS_PORT = int(os.environ.get("CAPA_METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("CAPA_METRICS_HOST", "127.0.0.1")
+
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SIZE_SAMPLE = 20  # list items measured when estimating payload size; the rest are assumed alike
+
+_lock = threading.Lock()
+_ops: Dict[str, Dict] = {}
+_local = threading.local()
+_exporter: Optional[threading.Thread] = None
+
+
+def _new_op() -> Dict:
+    return {"count": 0, "seconds": 0.0, "buckets": [0] * (len(BUCKETS) + 1),
+            "bytes_sent": 0, "bytes_received": 0, "errors": 0, "quota_errors": 0, "retries": 0}
+
+
+def status_of(error: Exception) -> Optional[int]:
+    # HttpError (discovery clients) and gspread APIError expose the status differently
+    resp = getattr(error, "resp", None)
+    if resp is not None and getattr(resp, "status", None):
+        return int(resp.status)
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "status_code", None):
+        return int(response.status_code)
+    return None
+
+
+def is_quota_error(error: Exception) -> bool:
+    return status_of(error) == 429
+
+
+def _size(obj) -> int:
+    """
+    Approximate JSON size of a request or response. Only the first SIZE_SAMPLE items
+    of each list are measured, so a full-sheet read is not serialized a second time.
+    """
+    if obj is None:
+        return 0
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, str):
+        return len(obj) + 2
+    if isinstance(obj, dict):
+        return 2 + sum(len(str(k)) + 4 + _size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        if not obj:
+            return 2
+        sample = obj[:SIZE_SAMPLE]
+        return 2 + sum(_size(v) + 1 for v in sample) * len(obj) // len(sample)
+    return len(str(obj))
+
+
+def record(op: str, seconds: float, bytes_sent: int = 0, bytes_received: int = 0,
+           error: Optional[Exception] = None):
+    with _lock:
+        stats = _ops.setdefault(op, _new_op())
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        stats["buckets"][i] += 1
+        stats["bytes_sent"] += bytes_sent
+        stats["bytes_received"] += bytes_received
+        if error is not None:
+            stats["errors"] += 1
+            if is_quota_error(error):
+                stats["quota_errors"] += 1
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.append({"op": op, "ms": round(seconds * 1000, 1), "error": "" if error is None else type(error).__name__})
+
+
+def record_retry(op: str):
+    with _lock:
+        _ops.setdefault(op, _new_op())["retries"] += 1
+
+
+@contextmanager
+def timed(op: str):
+    """Time a block as one call of 'op'. Set 'bytes_sent'/'bytes_received' on the yielded dict."""
+    info = {"bytes_sent": 0, "bytes_received": 0}
+    t0 = time.perf_counter()
+    try:
+        yield info
+    except Exception as e:
+        record(op, time.perf_counter() - t0, info["bytes_sent"], info["bytes_received"], error=e)
+        raise
+    record(op, time.perf_counter() - t0, info["bytes_sent"], info["bytes_received"])
+
+
+def call(op: str, fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) as one instrumented API call (used for gspread methods)."""
+    with timed(op) as info:
+        info["bytes_sent"] = _size(args[0]) if args and isinstance(args[0], list) else 0
+        result = fn(*args, **kwargs)
+        info["bytes_received"] = _size(result)
+    return result
+
+
+def execute(op: str, request):
+    """request.execute() for a googleapiclient request, instrumented."""
+    with timed(op) as info:
+        info["bytes_sent"] = _size(getattr(request, "body", None))
+        result = request.execute()
+        info["bytes_received"] = _size(result)
+    return result
+
+
+# -------------------- Per-rerun traces --------------------
+def start_trace():
+    """Start collecting the API calls made by the current thread (one Streamlit rerun)."""
+    _local.trace = []
+
+
+def current_trace() -> List[Dict]:
+    return list(getattr(_local, "trace", None) or [])
+
+
+# -------------------- Export --------------------
+def snapshot() -> Dict[str, Dict]:
+    with _lock:
+        return {op: dict(stats, buckets=list(stats["buckets"])) for op, stats in _ops.items()}
+
+
+def summary_rows() -> List[Dict]:
+    rows = []
+    for op, s in sorted(snapshot().items()):
+        rows.append({
+            "operation": op,
+            "calls": s["count"],
+            "avg ms": round(s["seconds"] / s["count"] * 1000, 1) if s["count"] else 0.0,
+            "total s": round(s["seconds"], 2),
+            "errors": s["errors"],
+            "429s": s["quota_errors"],
+            "retries": s["retries"],
+            "KB sent": round(s["bytes_sent"] / 1024, 1),
+            "KB received": round(s["bytes_received"] / 1024, 1),
+        })
+    return rows
+
+
+def render_prometheus() -> str:
+    lines = [
+        "# HELP capa_api_call_seconds Latency of Google API calls by operation.",
+        "# TYPE capa_api_call_seconds histogram",
+    ]
+    data = snapshot()
+    for op, s in sorted(data.items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS, s["buckets"]):
+            cumulative += n
+            lines.append(f'capa_api_call_seconds_bucket{{op="{op}",le="{bound}"}} {cumulative}')
+        lines.append(f'capa_api_call_seconds_bucket{{op="{op}",le="+Inf"}} {s["count"]}')
+        lines.append(f'capa_api_call_seconds_sum{{op="{op}"}} {s["seconds"]:.6f}')
+        lines.append(f'capa_api_call_seconds_count{{op="{op}"}} {s["count"]}')
+    for name, key, help_text in [
+        ("capa_api_errors_total", "errors", "Failed Google API calls."),
+        ("capa_api_quota_errors_total", "quota_errors", "Google API calls rejected with HTTP 429."),
+        ("capa_api_retries_total", "retries", "Google API calls retried."),
+        ("capa_api_bytes_sent_total", "bytes_sent", "Approximate request payload bytes."),
+        ("capa_api_bytes_received_total", "bytes_received", "Approximate response payload bytes."),
+    ]:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for op, s in sorted(data.items()):
+            lines.append(f'{name}{{op="{op}"}} {s[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path: Optional[str] = None):
+    path = path or METRICS_FILE
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _export_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            write_metrics_file()
+        except OSError as e:
+            print(f"⚠️ Could not write metrics file: {e}")
+
+
+def start_exporter():
+    """Start the metrics file writer (and HTTP endpoint if CAPA_METRICS_PORT is set) once per process."""
+    global _exporter
+    with _lock:
+        if _exporter is not None:
+            return
+        _exporter = threading.Thread(target=_export_loop, name="capa-metrics", daemon=True)
+        _exporter.start()
+        if METRICS_PORT:
+            server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="capa-metrics-http", daemon=True).start()
@@ -0,0 +1,98 @@
+"""
+Split the CAPA worksheet into per-year or per-quarter tabs.
+
+    python migrate_partitions.py --scheme year --dry-run
+    python migrate_partitions.py --scheme year
+
+Dated rows are copied into their partition tab, then the CAPA tab is rewritten
+with only the undated rows, and the partition directory is rebuilt. Rows already
+present in a partition are not copied again, so an interrupted run can simply be
+repeated. Stop the app while migrating, then start it with the same
+CAPA_PARTITION_SCHEME.
+"""
+import argparse
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import drive_helper
+import scheduler
+from drive_helper import SHEET_COLUMNS, WORKSHEET_NAME, _last_column_letter, get_worksheet, list_partitions
+from partitions import PartitionDirectory, partition_for
+from schema import normalize_capa_no
+
+APPEND_BATCH_SIZE = 500  # rows per append_rows call
+
+
+def _in_sheet_order(header: List[str], values: List[str]) -> List[str]:
+    record = dict(zip(header, values))
+    return [record.get(c, "") for c in SHEET_COLUMNS]
+
+
+def migrate(scheme: str, dry_run: bool = False) -> Dict[str, int]:
+    """Move dated rows out of the CAPA tab. Returns the number of rows per destination tab."""
+    if scheme not in ("year", "quarter"):
+        raise ValueError(f"Partition scheme must be 'year' or 'quarter', not '{scheme}'")
+    base = get_worksheet()
+    values = scheduler.call("sheets.get_all_values", base.get_all_values)
+    if not values:
+        return {}
+    header = values[0]
+    rows = [_in_sheet_order(header, v) for v in values[1:] if any(v)]
+    date_pos = SHEET_COLUMNS.index("DATE_OF_INCIDENT")
+    groups: Dict[str, List[List[str]]] = {}
+    for r in rows:
+        groups.setdefault(partition_for(r[date_pos], scheme, WORKSHEET_NAME), []).append(r)
+    counts = {title: len(group) for title, group in sorted(groups.items())}
+    if dry_run:
+        return counts
+
+    key_pos = SHEET_COLUMNS.index("CAPA_NO")
+    locations: Dict[str, Tuple[str, int]] = {}
+    undated = groups.pop(WORKSHEET_NAME, [])
+    # every partition tab is read so the directory also covers rows moved by an earlier run
+    for title in sorted(set(groups) | set(list_partitions())):
+        group = groups.get(title, [])
+        ws = get_worksheet(title, create=True)
+        existing = scheduler.call("sheets.get_all_values", ws.get_all_values)[1:]
+        already = Counter(tuple(_in_sheet_order(SHEET_COLUMNS, v)) for v in existing)
+        todo = []
+        for r in group:
+            if already[tuple(r)]:
+                already[tuple(r)] -= 1
+            else:
+                todo.append(r)
+        for i in range(0, len(todo), APPEND_BATCH_SIZE):
+            scheduler.call("sheets.append", ws.append_rows, todo[i:i + APPEND_BATCH_SIZE])
+        for pos, r in enumerate(existing + todo):
+            locations.setdefault(normalize_capa_no(r[key_pos]), (title, pos))
+        if group:
+            print(f"{title}: {len(todo)} row(s) copied, {len(group) - len(todo)} already there")
+
+    # Only now that every partition holds its rows, shrink the CAPA tab to the undated ones
+    last_col = _last_column_letter(max(len(header), len(SHEET_COLUMNS)))
+    scheduler.call("sheets.batch_clear", base.batch_clear, [f"A2:{last_col}{len(values)}"])
+    if header != SHEET_COLUMNS:
+        scheduler.call("sheets.update", base.update, values=[SHEET_COLUMNS], range_name="A1")
+    if undated:
+        scheduler.call("sheets.update", base.update, values=undated, range_name="A2")
+    for pos, r in enumerate(undated):
+        locations.setdefault(normalize_capa_no(r[key_pos]), (WORKSHEET_NAME, pos))
+    PartitionDirectory(drive_helper.PARTITION_DIRECTORY_PATH).replace(locations)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scheme", choices=["year", "quarter"],
+                        default=drive_helper.PARTITION_SCHEME if drive_helper.PARTITION_SCHEME != "none" else "year")
+    parser.add_argument("--dry-run", action="store_true", help="only report how rows would be split")
+    args = parser.parse_args()
+    counts = migrate(args.scheme, dry_run=args.dry_run)
+    for title, n in counts.items():
+        print(f"{title:<16} {n:>7}")
+    if not args.dry_run:
+        print(f"Done. Start the app with CAPA_PARTITION_SCHEME={args.scheme}.")
+
+
+if __name__ == "__main__":
+    main()
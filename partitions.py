@@ -0,0 +1,144 @@
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from schema import parse_date
+
+# "none": one worksheet; "year"/"quarter": one worksheet per period of DATE_OF_INCIDENT
+PARTITION_SCHEMES = ("none", "year", "quarter")
+
+
+def partition_for(date_value, scheme: str, base: str) -> str:
+    """
+    Worksheet title for a row with this incident date. Undated rows, and dates that
+    aren't YYYY-MM-DD (kept as text, see schema.parse_date), stay in 'base'.
+    """
+    if scheme == "none":
+        return base
+    ts = parse_date(date_value)
+    if not isinstance(ts, pd.Timestamp) or pd.isna(ts):
+        return base
+    if scheme == "year":
+        return f"{base}_{ts.year}"
+    if scheme == "quarter":
+        return f"{base}_{ts.year}_Q{(ts.month - 1) // 3 + 1}"
+    raise ValueError(f"Unknown partition scheme '{scheme}', expected one of {PARTITION_SCHEMES}")
+
+
+def partition_bounds(title: str, base: str) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """[first day, first day of the next period) covered by a partition title, or None if it isn't one."""
+    m = re.fullmatch(re.escape(base) + r"_(\d{4})(?:_Q([1-4]))?", title)
+    if not m:
+        return None
+    year = int(m.group(1))
+    if m.group(2):
+        start = pd.Timestamp(year=year, month=3 * (int(m.group(2)) - 1) + 1, day=1)
+        return start, start + pd.DateOffset(months=3)
+    return pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year + 1, month=1, day=1)
+
+
+def is_partition(title: str, base: str) -> bool:
+    return partition_bounds(title, base) is not None
+
+
+def partitions_overlapping(titles: List[str], base: str, start_date: Optional[str] = None,
+                           end_date: Optional[str] = None) -> List[str]:
+    """
+    The worksheets that can hold rows dated within [start_date, end_date]: 'base'
+    (undated rows, or history not yet split) plus every partition whose period
+    overlaps the range. The end date is inclusive up to the next day, as in
+    storage.filter_records.
+    """
+    sd = pd.to_datetime(start_date, errors="coerce") if start_date else pd.NaT
+    ed = pd.to_datetime(end_date, errors="coerce") if end_date else pd.NaT
+    out = []
+    for title in titles:
+        bounds = partition_bounds(title, base)
+        if bounds is None:
+            if title == base:
+                out.append(title)
+            continue
+        first, after = bounds
+        if not pd.isna(sd) and after <= sd:
+            continue
+        if not pd.isna(ed) and first > ed + pd.Timedelta(days=1):
+            continue
+        out.append(title)
+    return out
+
+
+class PartitionDirectory:
+    """
+    Local map of normalized CAPA_NO -> (worksheet title, row position), so a record
+    can be read from its own partition without searching the others. Entries are
+    hints: callers verify the row they read and fall back to a search. The file is a
+    JSON-lines log ([key, title, position] per line, or [key] to drop a key), so
+    recording new rows only appends to it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, List] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        self._apply(json.loads(line))
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Partition directory unreadable, lookups will search every tab: {e}")
+
+    def _apply(self, item: List):
+        if len(item) == 1:
+            self.entries.pop(item[0], None)
+        else:
+            self.entries.setdefault(item[0], [item[1], item[2]])
+
+    def get(self, capa_key: str) -> Optional[Tuple[str, int]]:
+        with self.lock:
+            entry = self.entries.get(capa_key)
+        return (entry[0], int(entry[1])) if entry else None
+
+    def update(self, locations: Dict[str, Tuple[str, int]]):
+        """Record locations (first one wins, as for duplicate CAPA numbers in the sheet) and save."""
+        if not locations:
+            return
+        with self.lock:
+            new = [[key, title, pos] for key, (title, pos) in locations.items() if key and key not in self.entries]
+            for item in new:
+                self._apply(item)
+            self._append(new)
+
+    def replace(self, locations: Dict[str, Tuple[str, int]]):
+        """Drop every entry and record 'locations' (after rows have been moved between tabs)."""
+        with self.lock:
+            self.entries = {}
+            for key, (title, pos) in locations.items():
+                if key:
+                    self._apply([key, title, pos])
+            lines = "".join(json.dumps([k, t, p]) + "\n" for k, (t, p) in self.entries.items())
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(lines)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"⚠️ Could not save partition directory: {e}")
+
+    def forget(self, capa_key: str):
+        with self.lock:
+            if self.entries.pop(capa_key, None) is not None:
+                self._append([[capa_key]])
+
+    def _append(self, items: List[List]):
+        if not items:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(item) + "\n" for item in items))
+        except OSError as e:
+            print(f"⚠️ Could not save partition directory: {e}")
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Optional
+
+from pdf_generator import DOC_TEMPLATE_ID, PDF_BACKEND, current_template_version, generate_capa_pdf
+from schema import to_sheet_strings
+
+# Directory holding cached PDFs (one <sha256>.pdf file per entry)
+CACHE_DIR = os.environ.get("CAPA_PDF_CACHE_DIR", ".pdf_cache")
+# Total size the cache may grow to before least recently used entries are evicted
+CACHE_MAX_BYTES = int(os.environ.get("CAPA_PDF_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Streamlit serves every session from threads of one process, so a process-wide
+# lock serialises eviction; writes go through a temp file + os.replace so other
+# processes sharing the directory never see a half-written PDF.
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def cache_key(row: Dict) -> str:
+    """
+    Hash of the row contents plus the template ID, its Drive version and the backend,
+    so edited records, another template or an edited template miss the cache.
+    """
+    payload = {
+        "template": DOC_TEMPLATE_ID,
+        # the local backend doesn't use the Docs template
+        "template_version": current_template_version() if PDF_BACKEND == "docs" else "",
+        "backend": PDF_BACKEND,
+        "row": {str(k): v for k, v in to_sheet_strings(row).items()},
+    }
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+def _path_for(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.pdf")
+
+
+def _read(key: str) -> Optional[bytes]:
+    path = _path_for(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    # Touch the entry so eviction treats it as recently used
+    try:
+        os.utime(path, None)
+    except FileNotFoundError:
+        pass
+    return data
+
+
+def _write(key: str, data: bytes):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, _path_for(key))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _evict():
+    """Drop least recently used entries until the cache fits in CACHE_MAX_BYTES."""
+    entries = []
+    total = 0
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".pdf"):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        _stats["evictions"] += 1
+
+
+def get_cached_pdf(row: Dict) -> bytes:
+    """
+    Return the PDF for 'row' from the on-disk cache, generating and storing it on a miss.
+    If the template's version can't be read, the PDF is generated without the cache.
+    """
+    try:
+        key = cache_key(row)
+    except Exception as e:
+        print(f"⚠️ Could not check the template version, generating without the PDF cache: {e}")
+        with _lock:
+            _stats["misses"] += 1
+        return generate_capa_pdf(row)
+    data = _read(key)
+    if data is not None:
+        with _lock:
+            _stats["hits"] += 1
+        return data
+
+    with _lock:
+        _stats["misses"] += 1
+    data = generate_capa_pdf(row)
+    with _lock:
+        _write(key, data)
+        _evict()
+    return data
+
+
+def cache_stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_stats)
+
+
+def clear_cache():
+    with _lock:
+        if not os.path.isdir(CACHE_DIR):
+            return
+        for name in os.listdir(CACHE_DIR):
+            try:
+                os.remove(os.path.join(CACHE_DIR, name))
+            except FileNotFoundError:
+                pass
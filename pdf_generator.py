@@ -3,13 +3,41 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+import atexit
 import pickle
 import json
 import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import metrics
+import scheduler
+from local_renderer import render_capa_pdf
+from schema import FLAG_COLUMNS, SHEET_COLUMNS, parse_flag, to_sheet_strings
+from template_pool import TemplatePool
 
 # --- OAuth setup using credentials.json (same as drive_helper.py) ---
 SCOPES = ["https://www.googleapis.com/auth/documents", "https://www.googleapis.com/auth/drive"]
 DOC_TEMPLATE_ID = "1qGFGK9NOkISKbGWYqg3U0w5jqNOmVeSCnS97SJJawG0"  # your Google Doc template ID
+# "docs" fills the Google Docs template; "local" renders offline with local_renderer
+PDF_BACKEND = os.environ.get("CAPA_PDF_BACKEND", "docs")
+PDF_BACKENDS = ("docs", "local")
+# Placeholders found in the template, kept across restarts; re-read when its Drive version changes
+TEMPLATE_CACHE_PATH = os.environ.get("CAPA_TEMPLATE_CACHE_PATH", ".capa_template.json")
+TEMPLATE_CHECK_INTERVAL = float(os.environ.get("CAPA_TEMPLATE_CHECK_INTERVAL", "300"))  # seconds
+# Copies of the template kept ready so a download skips the copy call (0 = copy on demand)
+TEMPLATE_POOL_SIZE = int(os.environ.get("CAPA_TEMPLATE_POOL_SIZE", "2"))
+# Temporary docs are named TEMP_DOC_PREFIX + CAPA_NO and tagged with the TEMP_DOC_PROPERTY
+# app property; tagged ones older than ORPHAN_MAX_AGE were left behind by a crashed run and
+# are moved to the trash every ORPHAN_SWEEP_INTERVAL seconds (0 = never)
+TEMP_DOC_PREFIX = "CAPA_"
+TEMP_DOC_PROPERTY = ("capa_temp", "1")
+ORPHAN_MAX_AGE = float(os.environ.get("CAPA_ORPHAN_MAX_AGE", "3600"))
+ORPHAN_SWEEP_INTERVAL = float(os.environ.get("CAPA_ORPHAN_SWEEP_INTERVAL", "900"))
+DELETE_BATCH_SIZE = 100  # calls per Drive batch request (the API maximum)
+GOOGLE_DOC_MIME = "application/vnd.google-apps.document"
 
 def get_creds():
     creds = None
@@ -18,7 +46,7 @@ def get_creds():
             creds = pickle.load(token)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            metrics.call("auth.refresh", creds.refresh, Request())
         else:
             flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
             creds = flow.run_local_server(port=0)
@@ -26,60 +54,417 @@ def get_creds():
             pickle.dump(creds, token)
     return creds
 
-creds = get_creds()
-docs_service = build("docs", "v1", credentials=creds)
-drive_service = build("drive", "v3", credentials=creds)
+# Credentials and services are created on first PDF use, not at import, so app
+# start-up (and users who only submit forms) never pay for a token load or a
+# discovery build. They are then shared by the whole process.
+_services_lock = threading.Lock()
+_creds = None
+_shared_services: Dict[str, object] = {}
+
+# httplib2-backed service objects are not thread-safe; worker threads that
+# generate PDFs in parallel get their own pair via use_thread_services().
+_local = threading.local()
+
+
+def _get_shared_creds():
+    global _creds
+    with _services_lock:
+        if _creds is None:
+            with metrics.timed("auth.load_creds"):
+                _creds = get_creds()
+        return _creds
+
+
+def _build_service(api: str, version: str):
+    # static_discovery uses the discovery document bundled with
+    # google-api-python-client, so building never fetches it over the network
+    return build(api, version, credentials=_get_shared_creds(), cache_discovery=False, static_discovery=True)
+
+
+def _service(api: str, version: str):
+    if getattr(_local, "own_services", False):
+        services = _local.__dict__.setdefault("services", {})
+        if api not in services:
+            services[api] = _build_service(api, version)
+        return services[api]
+    if api not in _shared_services:
+        service = _build_service(api, version)
+        with _services_lock:
+            _shared_services.setdefault(api, service)
+    return _shared_services[api]
+
+
+def use_thread_services():
+    """Make the calling thread build and use its own Docs/Drive service objects."""
+    _local.own_services = True
+
+
+def _docs():
+    return _service("docs", "v1")
+
+
+def _drive():
+    return _service("drive", "v3")
+
+
+# -------------------- Template placeholders --------------------
+_PLACEHOLDER = re.compile(r"\{\{([A-Za-z0-9_]+)\}\}")
+_template_lock = threading.Lock()
+_template: Dict = {}  # {"template_id", "version", "placeholders", "checked_at"}
+_reported_unfilled: Set[Tuple[str, ...]] = set()
+
+
+def _document_text(elements: List[Dict]) -> str:
+    """All text in a Docs structural element list, including tables, in document order."""
+    parts = []
+    for el in elements or []:
+        for run in el.get("paragraph", {}).get("elements", []):
+            parts.append(run.get("textRun", {}).get("content", ""))
+        for table_row in el.get("table", {}).get("tableRows", []):
+            for cell in table_row.get("tableCells", []):
+                parts.append(_document_text(cell.get("content")))
+        parts.append(_document_text(el.get("tableOfContents", {}).get("content")))
+    return "".join(parts)
+
+
+def _template_placeholders_from(doc: Dict) -> List[str]:
+    text = [_document_text(doc.get("body", {}).get("content"))]
+    for section in ("headers", "footers", "footnotes"):
+        for part in (doc.get(section) or {}).values():
+            text.append(_document_text(part.get("content")))
+    return sorted(set(_PLACEHOLDER.findall("\n".join(text))))
+
+
+def template_version() -> str:
+    """Drive version of the template; it increases on every edit."""
+    meta = scheduler.execute("drive.get", _drive().files().get(fileId=DOC_TEMPLATE_ID, fields="version"))
+    return str(meta.get("version", ""))
 
 
-def _tick(val: str) -> str:
-    """Return a checkmark if 'YES', else empty string."""
-    return "✔" if str(val).strip().upper() == "YES" else ""
+def _load_template_cache():
+    try:
+        with open(TEMPLATE_CACHE_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    if data.get("template_id") == DOC_TEMPLATE_ID:
+        _template.update(data, checked_at=0.0)
 
 
-def generate_capa_pdf(row: dict) -> bytes:
+def _save_template_cache():
+    data = {k: _template[k] for k in ("template_id", "version", "placeholders")}
+    tmp_path = f"{TEMPLATE_CACHE_PATH}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, TEMPLATE_CACHE_PATH)
+    except OSError as e:
+        print(f"⚠️ Could not save template placeholder cache: {e}")
+
+
+def template_placeholders() -> Set[str]:
     """
-    Fill the Google Docs CAPA template with row values and return PDF bytes.
+    {{KEY}} placeholders in DOC_TEMPLATE_ID. Read once with documents().get and
+    re-read only when the template's Drive version has changed; the version is
+    checked at most every TEMPLATE_CHECK_INTERVAL seconds.
+    """
+    with _template_lock:
+        if not _template:
+            _load_template_cache()
+        now = time.time()
+        if _template and now - _template["checked_at"] < TEMPLATE_CHECK_INTERVAL:
+            return set(_template["placeholders"])
+        try:
+            version = template_version()
+        except Exception as e:
+            if not _template:
+                raise
+            print(f"⚠️ Could not check template version, using cached placeholders: {e}")
+            _template["checked_at"] = now
+            return set(_template["placeholders"])
+        if _template.get("version") != version:
+            doc = scheduler.execute("docs.get", _docs().documents().get(documentId=DOC_TEMPLATE_ID))
+            _template.update(template_id=DOC_TEMPLATE_ID, version=version,
+                             placeholders=_template_placeholders_from(doc))
+            _save_template_cache()
+        _template["checked_at"] = now
+        return set(_template["placeholders"])
+
+
+def current_template_version() -> str:
+    """Drive version of the template, checked as template_placeholders() does."""
+    template_placeholders()
+    return str(_template.get("version", ""))
+
+
+def template_drift() -> Dict[str, List[str]]:
+    """Template placeholders with no sheet column ("unfilled") and sheet columns the template doesn't use ("unused")."""
+    placeholders = template_placeholders()
+    return {
+        "unfilled": sorted(placeholders - set(SHEET_COLUMNS)),
+        "unused": sorted(set(SHEET_COLUMNS) - placeholders),
+    }
+
+
+# -------------------- Temporary copies --------------------
+def _copy_template(name: str) -> str:
+    key, value = TEMP_DOC_PROPERTY
+    # the tag is what the orphan sweep looks for; untagged docs are never touched
+    body = {"name": name, "appProperties": {key: value}}
+    copied_file = scheduler.execute("drive.copy", _drive().files().copy(fileId=DOC_TEMPLATE_ID, body=body))
+    return copied_file.get("id")
+
+
+def _trash_batch(doc_ids: List[str]) -> List[str]:
+    failed = []
+
+    def on_reply(request_id, response, exception):
+        # a doc that is already gone counts as removed
+        if exception is not None and metrics.status_of(exception) != 404:
+            failed.append(request_id)
+
+    batch = _drive().new_batch_http_request(callback=on_reply)
+    for doc_id in doc_ids:
+        batch.add(_drive().files().update(fileId=doc_id, body={"trashed": True}), request_id=doc_id)
+    metrics.execute("drive.batch_trash", batch)
+    return failed
+
+
+def _trash_docs(doc_ids: List[str]) -> List[str]:
+    """
+    Move docs to the Drive trash with one batch request; returns the ids that failed.
+    Trashed rather than deleted, so a doc removed by mistake can still be restored.
     """
+    return scheduler.run("drive.batch_trash", _trash_batch, doc_ids)
+
+
+def _find_orphans() -> List[str]:
+    """Tagged temporary docs older than ORPHAN_MAX_AGE; never the template itself."""
+    cutoff = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - ORPHAN_MAX_AGE))
+    key, value = TEMP_DOC_PROPERTY
+    q = (f"appProperties has {{ key='{key}' and value='{value}' }} and mimeType = '{GOOGLE_DOC_MIME}'"
+         f" and trashed = false and 'me' in owners and createdTime < '{cutoff}'")
+    found, page_token = [], None
+    while True:
+        resp = scheduler.execute("drive.list", _drive().files().list(
+            q=q, fields="nextPageToken, files(id, name)", pageSize=1000, pageToken=page_token))
+        found += [f["id"] for f in resp.get("files", [])
+                  if f.get("name", "").startswith(TEMP_DOC_PREFIX) and f["id"] != DOC_TEMPLATE_ID]
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return found
+
 
-    # --- 1. Copy the template temporarily ---
-    copy_title = f"CAPA_{row.get('CAPA_NO', 'TEMP')}"
-    body = {"name": copy_title}
-    copied_file = drive_service.files().copy(fileId=DOC_TEMPLATE_ID, body=body).execute()
-    doc_id = copied_file.get("id")
+_pool: Optional[TemplatePool] = None
+_pool_lock = threading.Lock()
 
-    # --- 2. Build replacements dict ---
+
+def _template_pool() -> TemplatePool:
+    """The process-wide pool, created (with its background thread) on first PDF generation."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = TemplatePool(
+                TEMPLATE_POOL_SIZE,
+                make_copy=lambda: _copy_template(f"{TEMP_DOC_PREFIX}POOL"),
+                delete_many=_trash_docs,
+                version=current_template_version,
+                find_orphans=_find_orphans,
+                # pooled copies are replaced well before the sweeper would consider them orphaned
+                max_age=ORPHAN_MAX_AGE / 2,
+                sweep_interval=ORPHAN_SWEEP_INTERVAL,
+                delete_batch=DELETE_BATCH_SIZE,
+                setup_thread=use_thread_services,
+            )
+            atexit.register(_shutdown_pool)
+        return _pool
+
+
+def _shutdown_pool():
+    # Best effort: unused copies and queued deletes would otherwise wait for the next sweep
+    try:
+        _pool.drain()
+        while _pool.to_delete:
+            before = len(_pool.to_delete)
+            _pool.flush_deletes(force=True)
+            if len(_pool.to_delete) >= before:
+                break
+    except Exception as e:
+        print(f"⚠️ Could not clean up temporary docs on exit: {e}")
+
+
+def template_pool_stats() -> Dict[str, int]:
+    """Copies taken from / missing in the pool, made, deleted and swept since start-up."""
+    if _pool is None:
+        return {}
+    with _pool.lock:
+        return dict(_pool.stats, ready=len(_pool.ready), queued_deletes=len(_pool.to_delete))
+
+
+def _tick(val) -> str:
+    """Return a checkmark if 'YES' (or True), else empty string."""
+    return "✔" if parse_flag(val) else ""
+
+
+# Max replaceAllText requests sent in a single documents().batchUpdate call
+BATCH_UPDATE_CHUNK_SIZE = 50
+
+# Columns rendered as a tick mark in the template instead of their raw value
+TICK_KEYS = FLAG_COLUMNS
+
+
+def _build_replacements(row: dict) -> Dict[str, str]:
+    # Typed records (bool flags, Timestamp dates) are rendered the way the sheet stores them
     replacements = {}
-    for k, v in row.items():
-        if k in ["A", "B", "C", "D", "M1", "M2", "M3", "M4", "M5", "O1", "O2", "O3", "O4", "O5"]:
+    for k, v in to_sheet_strings(row).items():
+        if k in TICK_KEYS:
             replacements[k] = _tick(v)
         else:
-            replacements[k] = str(v) if v else ""
+            replacements[k] = v
+    return replacements
 
-    # --- 3. Replace placeholders in copied Doc (one by one) ---
-    for key, value in replacements.items():
-        request = {
-            "replaceAllText": {
-                "containsText": {"text": f"{{{{{key}}}}}", "matchCase": True},
-                "replaceText": value
-            }
+
+def _replace_request(key: str, value: str) -> dict:
+    return {
+        "replaceAllText": {
+            "containsText": {"text": f"{{{{{key}}}}}", "matchCase": True},
+            "replaceText": value
         }
+    }
+
+
+def _fill_one_by_one(doc_id: str, replacements: Dict[str, str]) -> int:
+    """Send one batchUpdate per placeholder, skipping keys that fail. Returns the number of calls made."""
+    calls = 0
+    for key, value in replacements.items():
+        calls += 1
         try:
-            docs_service.documents().batchUpdate(
+            scheduler.execute("docs.batchUpdate", _docs().documents().batchUpdate(
                 documentId=doc_id,
-                body={"requests": [request]}
-            ).execute()
+                body={"requests": [_replace_request(key, value)]}
+            ))
         except Exception as e:
+            if scheduler.is_retryable(e):
+                # Out of retries on a quota/server error: don't hand back a half-filled PDF
+                raise
             print(f"⚠️ Failed to replace {key} with '{value}': {e}")
+    return calls
 
-    # --- 4. Export the updated Doc as PDF ---
-    request = drive_service.files().export_media(fileId=doc_id, mimeType="application/pdf")
+
+def _fill_batched(doc_id: str, replacements: Dict[str, str],
+                  chunk_size: int = BATCH_UPDATE_CHUNK_SIZE) -> int:
+    """
+    Send all replacements in size-capped batchUpdate calls. A batchUpdate is applied
+    atomically, so if a chunk is rejected it is retried key by key to keep skipping
+    only the bad keys. Quota and server errors are retried by the scheduler and
+    raised if they persist. Returns the number of calls made.
+    """
+    items = list(replacements.items())
+    calls = 0
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i + chunk_size]
+        calls += 1
+        try:
+            scheduler.execute("docs.batchUpdate", _docs().documents().batchUpdate(
+                documentId=doc_id,
+                body={"requests": [_replace_request(k, v) for k, v in chunk]}
+            ))
+        except Exception as e:
+            if scheduler.is_retryable(e):
+                raise
+            print(f"⚠️ Batch replace of {len(chunk)} keys failed, retrying one by one: {e}")
+            calls += _fill_one_by_one(doc_id, dict(chunk))
+    return calls
+
+
+def _export_pdf(doc_id: str) -> bytes:
+    request = _drive().files().export_media(fileId=doc_id, mimeType="application/pdf")
     pdf_buf = BytesIO()
     downloader = MediaIoBaseDownload(pdf_buf, request)
     done = False
-    while not done:
-        status, done = downloader.next_chunk()
+    with metrics.timed("drive.export") as info:
+        while not done:
+            status, done = downloader.next_chunk()
+        info["bytes_received"] = pdf_buf.tell()
+    return pdf_buf.getvalue()
 
-    # --- 5. Delete the temporary doc so Drive doesn’t fill up ---
-    drive_service.files().delete(fileId=doc_id).execute()
 
-    return pdf_buf.getvalue()
+def generate_capa_pdf_timed(row: dict, batched: bool = True,
+                            backend: Optional[str] = None) -> Tuple[bytes, Dict]:
+    """
+    Fill the Google Docs CAPA template with row values and return (PDF bytes, timings).
+    'timings' holds seconds spent per stage (copy/fill/export/delete/total), whether
+    the copy came from the template pool ("pooled"), the number of batchUpdate
+    calls and replacements sent while filling, and under "unfilled" the template
+    placeholders no field of 'row' fills. 'backend' overrides PDF_BACKEND.
+    """
+    backend = backend or PDF_BACKEND
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f"Unknown PDF backend '{backend}', expected one of {PDF_BACKENDS}")
+    timings = {}
+    t_start = time.perf_counter()
+
+    if backend == "local":
+        pdf_bytes = render_capa_pdf(_build_replacements(row))
+        timings["render"] = timings["total"] = time.perf_counter() - t_start
+        return pdf_bytes, timings
+
+    # --- 1. Take a ready copy of the template, or copy it now ---
+    t0 = time.perf_counter()
+    pool = _template_pool()
+    try:
+        doc_id = pool.take()
+    except Exception as e:
+        print(f"⚠️ Template pool unavailable, copying on demand: {e}")
+        doc_id = None
+    timings["pooled"] = doc_id is not None
+    if doc_id is None:
+        doc_id = _copy_template(f"{TEMP_DOC_PREFIX}{row.get('CAPA_NO', 'TEMP')}")
+    timings["copy"] = time.perf_counter() - t0
+
+    try:
+        # --- 2. Build replacements dict, limited to the template's placeholders ---
+        replacements = _build_replacements(row)
+        try:
+            placeholders = template_placeholders()
+        except Exception as e:
+            print(f"⚠️ Could not read template placeholders, sending every field: {e}")
+            placeholders = None
+        if placeholders is not None:
+            unfilled = sorted(placeholders - replacements.keys())
+            replacements = {k: v for k, v in replacements.items() if k in placeholders}
+            timings["unfilled"] = unfilled
+            if unfilled and tuple(unfilled) not in _reported_unfilled:
+                _reported_unfilled.add(tuple(unfilled))
+                print(f"⚠️ Template placeholders with no matching field: {', '.join(unfilled)}")
+        timings["fill_keys"] = len(replacements)
+
+        # --- 3. Replace placeholders in copied Doc ---
+        t0 = time.perf_counter()
+        if batched:
+            timings["fill_calls"] = _fill_batched(doc_id, replacements)
+        else:
+            timings["fill_calls"] = _fill_one_by_one(doc_id, replacements)
+        timings["fill"] = time.perf_counter() - t0
+
+        # --- 4. Export the updated Doc as PDF ---
+        t0 = time.perf_counter()
+        pdf_bytes = scheduler.run("drive.export", _export_pdf, doc_id)
+        timings["export"] = time.perf_counter() - t0
+    finally:
+        # --- 5. Queue the temporary doc for a batched delete (also when filling failed) ---
+        t0 = time.perf_counter()
+        pool.discard(doc_id)
+        timings["delete"] = time.perf_counter() - t0
+
+    timings["total"] = time.perf_counter() - t_start
+    return pdf_bytes, timings
+
+
+def generate_capa_pdf(row: dict, batched: bool = True, backend: Optional[str] = None) -> bytes:
+    """
+    Fill the Google Docs CAPA template with row values and return PDF bytes.
+    Set batched=False to fall back to one batchUpdate per placeholder.
+    """
+    pdf_bytes, _ = generate_capa_pdf_timed(row, batched=batched, backend=backend)
+    return pdf_bytes
@@ -0,0 +1,217 @@
+import email.utils
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+# Sustained request rate per API in requests/second (0 = unlimited), shared by every
+# session in the process. Defaults follow the per-user quotas: 60 requests/minute for
+# Docs writes and Sheets, much more for Drive.
+API_RATES = {
+    "docs": float(os.environ.get("CAPA_DOCS_RATE", "1.0")),
+    "drive": float(os.environ.get("CAPA_DRIVE_RATE", "10")),
+    "sheets": float(os.environ.get("CAPA_SHEETS_RATE", "1.0")),
+}
+API_BURST = float(os.environ.get("CAPA_API_BURST", "10"))  # requests allowed back to back after an idle spell
+API_WORKERS = int(os.environ.get("CAPA_API_WORKERS", "8"))  # Google calls in flight at once
+MAX_RETRIES = int(os.environ.get("CAPA_API_MAX_RETRIES", "5"))
+BACKOFF_BASE = 1.0  # seconds; doubled on every retry unless the server sends Retry-After
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Calls that may have taken effect despite a server error; only retried when rejected for quota
+NON_IDEMPOTENT_OPS = {"sheets.append", "sheets.create", "sheets.add_worksheet", "drive.copy"}
+
+# Call priorities; lower goes first
+INTERACTIVE = 0
+BULK = 1
+
+_local = threading.local()
+
+
+def current_priority() -> int:
+    return getattr(_local, "priority", INTERACTIVE)
+
+
+def set_priority(level: int):
+    """Set the priority of calls made from this thread (e.g. BULK in worker pools)."""
+    _local.priority = level
+
+
+@contextmanager
+def priority(level: int):
+    previous = current_priority()
+    set_priority(level)
+    try:
+        yield
+    finally:
+        set_priority(previous)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds from the Retry-After header of an HttpError/APIError, if the server sent one."""
+    value = None
+    resp = getattr(error, "resp", None)
+    if resp is not None and hasattr(resp, "get"):
+        value = resp.get("retry-after")
+    response = getattr(error, "response", None)
+    if value is None and response is not None:
+        value = getattr(response, "headers", {}).get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _rate_limited(error: Exception) -> bool:
+    status = metrics.status_of(error)
+    # Drive reports some per-user quota errors as 403 userRateLimitExceeded
+    return status == 429 or (status == 403 and "ratelimitexceeded" in str(error).lower())
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return metrics.status_of(error) in RETRY_STATUSES or _rate_limited(error)
+
+
+def _backoff(attempt: int) -> float:
+    # Exponential backoff with "equal jitter": half fixed, half random
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class Scheduler:
+    """
+    Admission control for Google API calls: a token bucket per API (the first part
+    of the operation name, e.g. "docs" for "docs.batchUpdate"), a cap on calls in
+    flight across all APIs, and priority order among waiting callers. Calls run on
+    the caller's thread, so per-thread Docs/Drive services stay valid.
+    """
+
+    def __init__(self, rates: Dict[str, float], burst: float, workers: int):
+        self.rates = dict(rates)
+        self.burst = max(1.0, burst)
+        self.workers = max(1, workers)
+        self._cond = threading.Condition()
+        self._tokens: Dict[str, float] = {}
+        self._updated: Dict[str, float] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._queues: Dict[str, List[Tuple[int, int]]] = {}
+        self._seq = itertools.count()
+        self._in_flight = 0
+
+    def _wait_time(self, api: str, now: float) -> float:
+        """Seconds until 'api' may send again (0 if it can send now); refills its bucket."""
+        pause = self._paused_until.get(api, 0.0) - now
+        rate = self.rates.get(api, 0.0)
+        if rate <= 0:
+            return max(0.0, pause)
+        tokens = self._tokens.get(api, self.burst) + (now - self._updated.get(api, now)) * rate
+        self._tokens[api] = min(self.burst, tokens)
+        self._updated[api] = now
+        return max(0.0, pause, (1 - self._tokens[api]) / rate)
+
+    def _outranked(self, level: int, now: float) -> bool:
+        # A higher-priority caller of another API is ready and only waiting for a slot
+        return any(q and q[0][0] < level and self._wait_time(api, now) <= 0
+                   for api, q in self._queues.items())
+
+    def _acquire(self, api: str, level: int):
+        with self._cond:
+            queue = self._queues.setdefault(api, [])
+            ticket = (level, next(self._seq))
+            heapq.heappush(queue, ticket)
+            try:
+                while True:
+                    timeout = None
+                    if queue[0] == ticket:
+                        now = time.monotonic()
+                        wait = self._wait_time(api, now)
+                        if wait > 0:
+                            timeout = wait
+                        elif self._in_flight < self.workers and not self._outranked(level, now):
+                            heapq.heappop(queue)
+                            if self.rates.get(api, 0.0) > 0:
+                                self._tokens[api] -= 1
+                            self._in_flight += 1
+                            self._cond.notify_all()
+                            return
+                    self._cond.wait(timeout)
+            except BaseException:
+                if ticket in queue:
+                    queue.remove(ticket)
+                    heapq.heapify(queue)
+                    self._cond.notify_all()
+                raise
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def pause(self, api: str, seconds: float):
+        """Hold every call to 'api' for 'seconds' (after a 429, so other callers don't pile on)."""
+        with self._cond:
+            until = time.monotonic() + seconds
+            self._paused_until[api] = max(self._paused_until.get(api, 0.0), until)
+
+    def run(self, op: str, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) once admitted, retrying quota and transient server errors."""
+        api = op.split(".", 1)[0]
+        level = current_priority()
+        attempt = 0
+        while True:
+            self._acquire(api, level)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= MAX_RETRIES or not is_retryable(e):
+                    raise
+                if op in NON_IDEMPOTENT_OPS and not _rate_limited(e):
+                    raise
+                wait = retry_after(e)
+                if wait is None:
+                    wait = _backoff(attempt)
+                if _rate_limited(e):
+                    self.pause(api, wait)
+            finally:
+                self._release()
+            metrics.record_retry(op)
+            time.sleep(wait)
+            attempt += 1
+
+
+_scheduler = Scheduler(API_RATES, API_BURST, API_WORKERS)
+
+
+def configure(rates: Optional[Dict[str, float]] = None, burst: Optional[float] = None,
+              workers: Optional[int] = None):
+    """Replace the shared scheduler (rates are merged over API_RATES)."""
+    global _scheduler
+    _scheduler = Scheduler({**API_RATES, **(rates or {})}, burst or API_BURST, workers or API_WORKERS)
+
+
+def run(op: str, fn, *args, **kwargs):
+    return _scheduler.run(op, fn, *args, **kwargs)
+
+
+def call(op: str, fn, *args, **kwargs):
+    """metrics.call through the shared scheduler: each attempt is timed separately."""
+    return _scheduler.run(op, metrics.call, op, fn, *args, **kwargs)
+
+
+def execute(op: str, request):
+    """metrics.execute through the shared scheduler."""
+    return _scheduler.run(op, metrics.execute, op, request)
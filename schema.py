@@ -0,0 +1,169 @@
+import datetime as dt
+from typing import Dict, List
+
+import pandas as pd
+
+# Column order used in the sheet (keeps consistent)
+SHEET_COLUMNS = [
+    "DEPARTMENT",
+    "AREA_SECTION",
+    "DATE_OF_INCIDENT",
+    "CAPA_NO",
+    "WHAT",
+    "WHERE",
+    "WHEN",
+    "EXTENT",
+    "TIME1",
+    "TIME2",
+    "A",
+    "B",
+    "C",
+    "D",
+    "TEAM_NAME",
+    "LEADER",
+    "MEM1",
+    "MEM2",
+    "MEM3",
+    "MEM4",
+    "R1",
+    "R2",
+    "R3",
+    "R4",
+    "R5",
+    "C1",
+    "C2",
+    "C3",
+    "C4",
+    "C5",
+    "ACTIONS",
+    "TIME_FRAME",
+    "RESPONSIBILITY",
+    "WHY1",
+    "WHY2",
+    "WHY3",
+    "WHY4",
+    "WHY5",
+    "M1",
+    "M2",
+    "M3",
+    "M4",
+    "M5",
+    "CONCLUSION",
+    "C_ACTIONS",
+    "RES1",
+    "T1",
+    "D1",
+    "P_ACTIONS",
+    "RES2",
+    "T2",
+    "D2",
+    "PLAN",
+    "O1",
+    "O2",
+    "O3",
+    "O4",
+    "O5",
+    "OTHERS",
+    "TRAINING_DETAILS",
+    "DATE_IMPLE",
+    "EFFECTIVENESS_EVAL",
+    "INITIATOR",
+    "REVIEWER",
+    "HOD",
+]
+
+# Columns query_records filters on and returns; everything else is fetched per record
+SEARCH_COLUMNS = ["DEPARTMENT", "AREA_SECTION", "DATE_OF_INCIDENT", "CAPA_NO"]
+
+# Tick-box columns; "YES" or "" in the sheet, bool in memory
+FLAG_COLUMNS = ["A", "B", "C", "D", "M1", "M2", "M3", "M4", "M5", "O1", "O2", "O3", "O4", "O5"]
+# Low-cardinality columns held as pandas categoricals
+CATEGORY_COLUMNS = ["DEPARTMENT", "AREA_SECTION"]
+# Date columns; YYYY-MM-DD in the sheet, datetime64 (NaT when blank) in memory.
+# Only ISO dates are parsed: a hand-typed 05/01/2025 could be either day order,
+# and text like "TBD" is not a date. Frames hold NaT for those; records keep the text.
+DATE_COLUMNS = ["DATE_OF_INCIDENT", "T1", "D1", "T2", "D2", "DATE_IMPLE"]
+SHEET_DATE_FORMAT = "%Y-%m-%d"
+
+
+def normalize_capa_no(capa_no) -> str:
+    """Key used to match CAPA numbers: surrounding spaces stripped, case-folded."""
+    return str(capa_no).strip().casefold()
+
+
+def parse_flag(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().upper() == "YES"
+
+
+def apply_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the flag, category and date columns present in 'df' (in place) to their in-memory types."""
+    for c in FLAG_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype(str).str.strip().str.upper().eq("YES")
+    for c in CATEGORY_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype(str).astype("category")
+    for c in DATE_COLUMNS:
+        if c in df.columns:
+            df[c] = pd.to_datetime(df[c], errors="coerce", format="ISO8601")
+    return df
+
+
+def rows_to_dataframe(header: List[str], rows: List[List[str]],
+                      columns: List[str] = SHEET_COLUMNS) -> pd.DataFrame:
+    if not rows:
+        return apply_types(pd.DataFrame({c: pd.Series(dtype=object) for c in columns}))
+    df = pd.DataFrame(rows, columns=header)
+    # Ensure columns exist
+    for c in columns:
+        if c not in df.columns:
+            df[c] = ""
+    return apply_types(df)
+
+
+def parse_date(value):
+    """
+    Timestamp for an ISO date cell (NaT if blank). Any other text is returned
+    unchanged, so to_sheet_string gives back exactly what the sheet holds.
+    """
+    text = str(value).strip()
+    if not text:
+        return pd.NaT
+    ts = pd.to_datetime(text, errors="coerce", format="ISO8601")
+    if pd.isna(ts) or to_sheet_string(DATE_COLUMNS[0], ts) != text:
+        return value
+    return ts
+
+
+def values_to_record(header: List[str], values: List[str]) -> Dict:
+    # Same shape as a rows_to_dataframe row: every column present, flags and ISO dates typed
+    record = dict(zip(header, values))
+    for c in SHEET_COLUMNS:
+        record.setdefault(c, "")
+    for c in FLAG_COLUMNS:
+        record[c] = parse_flag(record[c])
+    for c in DATE_COLUMNS:
+        record[c] = parse_date(record[c])
+    return record
+
+
+def to_sheet_string(column: str, value) -> str:
+    """Cell text for 'value' as the sheet stores it: flags as "YES"/"", dates as YYYY-MM-DD, blanks as ""."""
+    if column in FLAG_COLUMNS:
+        return "YES" if parse_flag(value) else ""
+    if value is None or (not isinstance(value, (list, dict)) and pd.isna(value)):
+        return ""
+    if isinstance(value, dt.datetime):
+        if value.time() == dt.time(0, 0):
+            return value.strftime(SHEET_DATE_FORMAT)
+        return value.isoformat()
+    if isinstance(value, dt.date):
+        return value.strftime(SHEET_DATE_FORMAT)
+    return str(value)
+
+
+def to_sheet_strings(record: Dict) -> Dict[str, str]:
+    """A typed record converted back to sheet cell text."""
+    return {k: to_sheet_string(k, v) for k, v in record.items()}
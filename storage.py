@@ -0,0 +1,249 @@
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from schema import SEARCH_COLUMNS, SHEET_COLUMNS, normalize_capa_no, rows_to_dataframe, values_to_record
+
+
+def _contains(series: pd.Series, text: str) -> pd.Series:
+    # Categoricals are matched once per distinct value instead of once per row
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = pd.Series(series.cat.categories.astype(str))
+        return series.isin(categories[categories.str.contains(text, case=False, na=False)])
+    return series.astype(str).str.contains(text, case=False, na=False)
+
+
+def filter_records(df: pd.DataFrame, department: Optional[str] = None, area: Optional[str] = None,
+                   start_date: Optional[str] = None, end_date: Optional[str] = None) -> pd.DataFrame:
+    res = df
+    if department:
+        res = res[_contains(res["DEPARTMENT"], department)]
+    if area:
+        res = res[_contains(res["AREA_SECTION"], area)]
+    if start_date:
+        sd = pd.to_datetime(start_date, errors="coerce")
+        if not pd.isna(sd):
+            res = res[res["DATE_OF_INCIDENT"] >= sd]
+    if end_date:
+        ed = pd.to_datetime(end_date, errors="coerce")
+        if not pd.isna(ed):
+            # include that day
+            res = res[res["DATE_OF_INCIDENT"] <= (ed + pd.Timedelta(days=1))]
+    return res
+
+
+class CapaStore(ABC):
+    """
+    Storage behind drive_helper's public functions. Rows are lists of strings in
+    SHEET_COLUMNS order (see drive_helper.normalize_row); records are dicts shaped
+    like a rows_to_dataframe row.
+    """
+
+    @abstractmethod
+    def append_rows(self, rows: List[List[str]]):
+        ...
+
+    @abstractmethod
+    def dataframe(self) -> pd.DataFrame:
+        """All records. Callers must not modify the returned frame."""
+
+    @abstractmethod
+    def lookup(self, capa_no: str) -> Optional[Dict]:
+        ...
+
+    def lookup_many(self, capa_nos: List[str]) -> Dict[str, Optional[Dict]]:
+        return {c: self.lookup(c) for c in capa_nos}
+
+    def exists(self, capa_no: str) -> bool:
+        return self.lookup(capa_no) is not None
+
+    @abstractmethod
+    def source_id(self) -> str:
+        """Identifies the underlying data set, so derived indexes built from another one are discarded."""
+
+    def segments(self) -> List[str]:
+        """Independently appended parts of the data (e.g. worksheet partitions); row positions are per segment."""
+        return [""]
+
+    @abstractmethod
+    def row_count(self, segment: str = "") -> int:
+        ...
+
+    @abstractmethod
+    def read_columns(self, columns: List[str], start: int, stop: int, segment: str = "") -> List[Dict[str, str]]:
+        """Values of 'columns' for row positions [start, stop) of 'segment', in storage order."""
+
+    def read_rows(self, columns: List[str], start: int, limit: int, segment: str = "") -> List[Dict[str, str]]:
+        """
+        Up to 'limit' rows of 'segment' from position 'start'; fewer only at the end of the
+        segment, and blank rows inside it are returned blank. Needs no row count.
+        """
+        return self.read_columns(columns, start, min(self.row_count(segment), start + limit), segment)
+
+    def query(self, department: Optional[str] = None, area: Optional[str] = None,
+              start_date: Optional[str] = None, end_date: Optional[str] = None) -> pd.DataFrame:
+        """Matching records, with SEARCH_COLUMNS only; use lookup() for the full record."""
+        df = self.dataframe()[SEARCH_COLUMNS]
+        if df.empty:
+            return df
+        return filter_records(df.copy(), department, area, start_date, end_date)
+
+    def refresh(self, full: bool = False):
+        """Pick up changes made outside this process, if the backend can have any."""
+
+
+def _quote(col: str) -> str:
+    # Several column names (WHERE, WHEN, ...) are SQL keywords
+    return '"' + col.replace('"', '""') + '"'
+
+
+def _sql_date(ts: pd.Timestamp) -> str:
+    # Dates are stored as written by the form (YYYY-MM-DD), which sorts as text
+    if ts == ts.normalize():
+        return ts.strftime("%Y-%m-%d")
+    return ts.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class SQLiteStore(CapaStore):
+    """
+    Local SQLite storage with indexes on the searched columns. If 'mirror' is given,
+    every new row is also appended to it (one-way); rows the mirror has not
+    accepted yet are retried on the next write or refresh.
+    """
+
+    INDEXED_COLUMNS = ["CAPA_NO", "DEPARTMENT", "AREA_SECTION", "DATE_OF_INCIDENT"]
+
+    def __init__(self, path: str, mirror: Optional[CapaStore] = None):
+        self.path = path
+        self.mirror = mirror
+        self._mirror_lock = threading.Lock()
+        self._cols = ", ".join(_quote(c) for c in SHEET_COLUMNS)
+        self._search_cols = ", ".join(_quote(c) for c in SEARCH_COLUMNS)
+        conn = self._connect()
+        try:
+            with conn:
+                col_defs = ", ".join(f"{_quote(c)} TEXT NOT NULL DEFAULT ''" for c in SHEET_COLUMNS)
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS capa ("
+                    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    " capa_key TEXT NOT NULL,"
+                    " mirrored INTEGER NOT NULL DEFAULT 0,"
+                    f" {col_defs})"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS capa_by_key ON capa (capa_key)")
+                for col in self.INDEXED_COLUMNS:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS capa_by_{col.lower()} ON capa ({_quote(col)})")
+                conn.execute("CREATE INDEX IF NOT EXISTS capa_unmirrored ON capa (mirrored)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _select(self, where: str = "", params=(), limit: str = "", cols: Optional[str] = None) -> List[List[str]]:
+        conn = self._connect()
+        try:
+            cur = conn.execute(f"SELECT {cols or self._cols} FROM capa {where} ORDER BY id {limit}", params)
+            return [list(r) for r in cur.fetchall()]
+        finally:
+            conn.close()
+
+    def append_rows(self, rows: List[List[str]]):
+        if not rows:
+            return
+        key_pos = SHEET_COLUMNS.index("CAPA_NO")
+        placeholders = ", ".join("?" for _ in SHEET_COLUMNS)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO capa (capa_key, {self._cols}) VALUES (?, {placeholders})",
+                    [[normalize_capa_no(r[key_pos])] + list(r) for r in rows],
+                )
+        finally:
+            conn.close()
+        self.mirror_pending()
+
+    def mirror_pending(self):
+        """Send rows not yet accepted by the mirror store."""
+        if self.mirror is None:
+            return
+        with self._mirror_lock:
+            conn = self._connect()
+            try:
+                pending = conn.execute(f"SELECT id, {self._cols} FROM capa WHERE mirrored = 0 ORDER BY id").fetchall()
+                if not pending:
+                    return
+                try:
+                    self.mirror.append_rows([list(r[1:]) for r in pending])
+                except Exception as e:
+                    print(f"⚠️ Mirroring {len(pending)} CAPA row(s) to Google Sheet failed: {e}")
+                    return
+                with conn:
+                    conn.executemany("UPDATE capa SET mirrored = 1 WHERE id = ?", [(r[0],) for r in pending])
+            finally:
+                conn.close()
+
+    def dataframe(self) -> pd.DataFrame:
+        return rows_to_dataframe(SHEET_COLUMNS, self._select())
+
+    def lookup(self, capa_no: str) -> Optional[Dict]:
+        rows = self._select("WHERE capa_key = ?", (normalize_capa_no(capa_no),), "LIMIT 1")
+        return values_to_record(SHEET_COLUMNS, rows[0]) if rows else None
+
+    def lookup_many(self, capa_nos: List[str]) -> Dict[str, Optional[Dict]]:
+        keys = list({normalize_capa_no(c) for c in capa_nos})
+        first: Dict[str, Dict] = {}
+        key_pos = SHEET_COLUMNS.index("CAPA_NO")
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            where = f"WHERE capa_key IN ({', '.join('?' for _ in chunk)})"
+            for row in self._select(where, chunk):
+                first.setdefault(normalize_capa_no(row[key_pos]), values_to_record(SHEET_COLUMNS, row))
+        return {c: first.get(normalize_capa_no(c)) for c in capa_nos}
+
+    def query(self, department: Optional[str] = None, area: Optional[str] = None,
+              start_date: Optional[str] = None, end_date: Optional[str] = None) -> pd.DataFrame:
+        clauses, params = [], []
+        if department:
+            clauses.append('instr(lower("DEPARTMENT"), lower(?)) > 0')
+            params.append(department)
+        if area:
+            clauses.append('instr(lower("AREA_SECTION"), lower(?)) > 0')
+            params.append(area)
+        date_ok = "\"DATE_OF_INCIDENT\" GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"
+        if start_date:
+            sd = pd.to_datetime(start_date, errors="coerce")
+            if not pd.isna(sd):
+                clauses += [date_ok, '"DATE_OF_INCIDENT" >= ?']
+                params.append(_sql_date(sd))
+        if end_date:
+            ed = pd.to_datetime(end_date, errors="coerce")
+            if not pd.isna(ed):
+                # include that day
+                clauses += [date_ok, '"DATE_OF_INCIDENT" <= ?']
+                params.append(_sql_date(ed + pd.Timedelta(days=1)))
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        return rows_to_dataframe(SEARCH_COLUMNS, self._select(where, params, cols=self._search_cols), SEARCH_COLUMNS)
+
+    def source_id(self) -> str:
+        return f"sqlite:{os.path.abspath(self.path)}"
+
+    def row_count(self, segment: str = "") -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM capa").fetchone()[0]
+        finally:
+            conn.close()
+
+    def read_columns(self, columns: List[str], start: int, stop: int, segment: str = "") -> List[Dict[str, str]]:
+        cols = ", ".join(_quote(c) for c in columns)
+        rows = self._select(params=(max(0, stop - start), start), limit="LIMIT ? OFFSET ?", cols=cols)
+        return [dict(zip(columns, r)) for r in rows]
+
+    def refresh(self, full: bool = False):
+        self.mirror_pending()
@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Iterable, List, Optional, Set, Tuple
+
+import scheduler
+
+
+class TemplatePool:
+    """
+    Ready-made copies of the PDF template plus asynchronous cleanup, run by one
+    background thread per process:
+
+    - keeps up to 'size' copies made by make_copy() -> doc id, tagged with the
+      template version they were copied from; take() hands one out immediately and
+      copies of another version (the template was edited) are discarded.
+    - deletes used copies in batches of up to 'delete_batch' ids via delete_many(ids)
+      -> ids that failed (retried on the next round).
+    - every 'sweep_interval' seconds (0 = never) deletes the ids from find_orphans()
+      that are not in the pool, e.g. copies left behind by a crashed process.
+      Pooled copies are replaced once older than 'max_age', so a sweeper that only
+      removes older copies never takes one still in use.
+    """
+
+    def __init__(self, size: int, make_copy: Callable[[], str], delete_many: Callable[[List[str]], List[str]],
+                 version: Callable[[], str], find_orphans: Callable[[], Iterable[str]],
+                 max_age: float, sweep_interval: float, delete_batch: int = 100, delete_delay: float = 2.0,
+                 setup_thread: Optional[Callable[[], None]] = None):
+        self.size = max(0, size)
+        self.make_copy = make_copy
+        self.delete_many = delete_many
+        self.version = version
+        self.find_orphans = find_orphans
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.delete_batch = max(1, delete_batch)
+        self.delete_delay = delete_delay
+        self.setup_thread = setup_thread
+        self.lock = threading.Lock()
+        self.ready: Deque[Tuple[str, str, float]] = deque()  # (doc id, template version, created at)
+        self.to_delete: List[str] = []
+        self.stats = {"taken": 0, "missed": 0, "copied": 0, "deleted": 0, "swept": 0}
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._next_sweep = 0.0
+        self._first_delete_at: Optional[float] = None
+
+    def _start(self):
+        with self.lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="capa-template-pool", daemon=True)
+                self._thread.start()
+
+    def take(self, version: Optional[str] = None) -> Optional[str]:
+        """A ready copy of the template at 'version' (default: version()), or None if the pool is empty."""
+        if self.size <= 0 or self._stopped:
+            return None
+        self._start()
+        version = version if version is not None else self.version()
+        now = time.time()
+        doc_id = None
+        with self.lock:
+            self._drop_stale(version, now)
+            if self.ready:
+                doc_id = self.ready.popleft()[0]
+                self.stats["taken"] += 1
+            else:
+                self.stats["missed"] += 1
+        self._wake.set()
+        return doc_id
+
+    def discard(self, doc_id: str):
+        """Queue a used copy for deletion; returns at once."""
+        self._start()
+        with self.lock:
+            self.to_delete.append(doc_id)
+            if self._first_delete_at is None:
+                self._first_delete_at = time.monotonic()
+        self._wake.set()
+
+    def drain(self):
+        """Discard every pooled copy (e.g. on shutdown)."""
+        with self.lock:
+            self.to_delete.extend(doc_id for doc_id, _, _ in self.ready)
+            self.ready.clear()
+        self._wake.set()
+
+    def stop(self):
+        """End the background thread after its current step; queued deletes are left to the sweeper."""
+        self._stopped = True
+        self._wake.set()
+
+    def pooled_ids(self) -> Set[str]:
+        with self.lock:
+            return {doc_id for doc_id, _, _ in self.ready}
+
+    def _drop_stale(self, version: str, now: float):
+        # caller holds self.lock
+        keep = [e for e in self.ready if e[1] == version and now - e[2] < self.max_age]
+        if len(keep) != len(self.ready):
+            self.to_delete.extend(e[0] for e in self.ready if e not in keep)
+            self.ready = deque(keep)
+
+    def _refill(self):
+        try:
+            version = self.version()
+        except Exception as e:
+            print(f"⚠️ Template pool could not check the template version: {e}")
+            return
+        with self.lock:
+            self._drop_stale(version, time.time())
+            missing = self.size - len(self.ready)
+        for _ in range(missing):
+            doc_id = self.make_copy()
+            with self.lock:
+                self.ready.append((doc_id, version, time.time()))
+                self.stats["copied"] += 1
+
+    def flush_deletes(self, force: bool = False):
+        """Delete queued copies if a full batch is waiting, the oldest has waited delete_delay, or 'force'."""
+        with self.lock:
+            due = force or len(self.to_delete) >= self.delete_batch or (
+                self._first_delete_at is not None and time.monotonic() - self._first_delete_at >= self.delete_delay)
+            if not due or not self.to_delete:
+                return
+            batch, self.to_delete = self.to_delete[:self.delete_batch], self.to_delete[self.delete_batch:]
+            self._first_delete_at = time.monotonic() if self.to_delete else None
+        try:
+            failed = self.delete_many(batch)
+        except Exception as e:
+            print(f"⚠️ Could not delete {len(batch)} temporary doc(s), will retry: {e}")
+            failed = batch
+        with self.lock:
+            self.stats["deleted"] += len(batch) - len(failed)
+            if failed:
+                self.to_delete.extend(failed)
+                if self._first_delete_at is None:
+                    self._first_delete_at = time.monotonic()
+
+    def sweep(self) -> int:
+        """Queue orphaned copies for deletion; returns how many were found."""
+        pooled = self.pooled_ids()
+        with self.lock:
+            queued = set(self.to_delete)
+        orphans = [doc_id for doc_id in self.find_orphans() if doc_id not in pooled and doc_id not in queued]
+        if orphans:
+            with self.lock:
+                self.to_delete.extend(orphans)
+                self.stats["swept"] += len(orphans)
+                if self._first_delete_at is None:
+                    self._first_delete_at = time.monotonic()
+        return len(orphans)
+
+    def _loop(self):
+        if self.setup_thread:
+            self.setup_thread()
+        # Pool upkeep yields to interactive downloads for API quota
+        scheduler.set_priority(scheduler.BULK)
+        while not self._stopped:
+            for step in (self._refill, self.flush_deletes, self._maybe_sweep):
+                try:
+                    step()
+                except Exception as e:
+                    print(f"⚠️ Template pool {step.__name__.strip('_')} failed: {e}")
+            with self.lock:
+                pending = self._first_delete_at
+            timeout = 5.0 if pending is None else max(0.05, self.delete_delay - (time.monotonic() - pending))
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def _maybe_sweep(self):
+        if self.sweep_interval <= 0 or time.monotonic() < self._next_sweep:
+            return
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        found = self.sweep()
+        if found:
+            print(f"Removing {found} orphaned temporary doc(s)")
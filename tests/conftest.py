@@ -0,0 +1,37 @@
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import drive_helper  # noqa: E402
+import scheduler  # noqa: E402
+from bench_suite import make_row, reset_process_state  # noqa: E402
+from fake_google import FakeGoogle, FakeSpreadsheet, install  # noqa: E402
+from schema import SHEET_COLUMNS  # noqa: E402
+
+
+@pytest.fixture
+def fake_sheet(tmp_path, monkeypatch):
+    """The CAPA worksheet on the Google API fake, seeded with 50 rows; state files go to tmp_path."""
+    g = FakeGoogle()
+    install(g, SHEET_COLUMNS, str(tmp_path / "sheet_ids.json"))
+    scheduler.configure(rates={"docs": 0, "drive": 0, "sheets": 0})
+    for name, file_name in [("TEXT_INDEX_PATH", "text_index.json"), ("ANALYTICS_PATH", "analytics.json"),
+                            ("PARTITION_DIRECTORY_PATH", "partitions.json")]:
+        monkeypatch.setattr(drive_helper, name, str(tmp_path / file_name))
+    monkeypatch.setattr(drive_helper, "_text_index", None)
+    monkeypatch.setattr(drive_helper, "_analytics", None)
+    monkeypatch.setattr(drive_helper, "_derived_generations", {})
+    monkeypatch.setattr(drive_helper, "_rows_changed_generation", 0)
+    reset_process_state()
+    sh = FakeSpreadsheet(g, drive_helper.SPREADSHEET_NAME)
+    g.spreadsheets[sh.id] = sh
+    rng = random.Random(1)
+    ws = sh.add_seeded_worksheet(drive_helper.WORKSHEET_NAME, [SHEET_COLUMNS] + [make_row(i, rng) for i in range(50)])
+    yield ws
+    reset_process_state()
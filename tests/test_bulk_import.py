@@ -0,0 +1,26 @@
+import pandas as pd
+
+import drive_helper
+import write_queue
+from bulk_import import import_file
+
+
+def test_legacy_placeholder_dates_are_imported(fake_sheet, tmp_path, monkeypatch):
+    monkeypatch.setattr(write_queue, "QUEUE_PATH", str(tmp_path / "queue.db"))
+    monkeypatch.setattr(write_queue, "_initialized", False)
+    path = tmp_path / "legacy.csv"
+    path.write_text(
+        "Capa No,Date of Incident,T1,D1,T2,D2\n"
+        "L-1,2021-03-04,2021-04-01,None,TBD,nan\n"
+        "L-2,not a date,,,,\n"
+        ",2021-03-04,,,,\n",
+        encoding="utf-8")
+
+    result = import_file(str(path), checkpoint_path=str(tmp_path / "import.json"))
+
+    assert (result["imported"], result["duplicates"], result["invalid"]) == (1, 0, 2)
+    assert [r["REASON"] for r in result["rejects"]] == ["unreadable DATE_OF_INCIDENT 'not a date'", "missing CAPA_NO"]
+    record = drive_helper.find_by_capa_no("L-1")
+    assert str(record["T1"].date()) == "2021-04-01"
+    assert pd.isna(record["D1"]) and pd.isna(record["D2"])
+    assert record["T2"] == "TBD"
@@ -0,0 +1,43 @@
+import os
+
+import gspread
+
+import drive_helper
+from schema import SHEET_COLUMNS
+
+
+def _cell(row: int, column: str) -> str:
+    return gspread.utils.rowcol_to_a1(row, SHEET_COLUMNS.index(column) + 1)
+
+
+def test_external_edit_reindexes_only_that_row(fake_sheet):
+    drive_helper.search_text("seal")
+    drive_helper.analytics_summary()
+    path = drive_helper.TEXT_INDEX_PATH
+    saved = os.stat(path)
+
+    fake_sheet.update([["Gearbox overheated"]], _cell(12, "WHY1"))
+    fake_sheet.update([["Safety"]], _cell(13, "DEPARTMENT"))
+    drive_helper.notify_sheet_changed()
+
+    assert list(drive_helper.search_text("gearbox")) == ["capa-000010"]
+    assert drive_helper.analytics_summary()["by_department"].set_index("DEPARTMENT")["CAPAs"].get("Safety", 0) >= 1
+    assert os.stat(path).st_mtime_ns == saved.st_mtime_ns
+    with open(f"{path}.log", encoding="utf-8") as f:
+        assert [line.count('"op":"replace"') for line in f] == [1]
+
+
+def test_own_append_is_not_taken_for_an_external_change(fake_sheet, monkeypatch):
+    drive_helper.search_text("seal")
+    generation = drive_helper._rows_changed_generation
+    # the sheet's version hasn't moved yet when the write is acknowledged
+    real_token = drive_helper._change_token
+    tokens = iter([real_token(fresh=True)] * 2)
+    monkeypatch.setattr(drive_helper, "_change_token", lambda fresh=False: next(tokens, None) or real_token(fresh))
+
+    drive_helper.append_row({"CAPA_NO": "CAPA-NEW", "WHY1": "Gearbox overheated"})
+    monkeypatch.setattr(drive_helper, "_change_token", real_token)
+    drive_helper.change_watcher().expire()
+
+    assert "capa-new" in drive_helper.search_text("gearbox")
+    assert drive_helper._rows_changed_generation == generation
@@ -0,0 +1,41 @@
+import os
+
+import drive_helper
+
+
+def test_one_row_catch_up_does_not_rewrite_the_index_file(fake_sheet):
+    assert drive_helper.search_text("seal")
+    path = drive_helper.TEXT_INDEX_PATH
+    before = os.stat(path)
+    with open(path, "rb") as f:
+        saved = f.read()
+
+    drive_helper.append_row({"CAPA_NO": "CAPA-NEW", "WHY1": "Gearbox overheated"})
+    assert "capa-new" in drive_helper.search_text("gearbox")
+
+    after = os.stat(path)
+    assert (after.st_mtime_ns, after.st_size) == (before.st_mtime_ns, before.st_size)
+    with open(path, "rb") as f:
+        assert f.read() == saved
+    with open(f"{path}.log", encoding="utf-8") as f:
+        assert len(f.readlines()) == 1
+
+    # another process loads the file and replays the journal
+    drive_helper._text_index = None
+    assert "capa-new" in drive_helper.search_text("gearbox")
+
+
+def test_journal_is_compacted_into_the_file(fake_sheet, monkeypatch):
+    import derived_state
+
+    monkeypatch.setattr(derived_state, "JOURNAL_COMPACT_RATIO", 0.0)
+    drive_helper.analytics_summary()
+    path = drive_helper.ANALYTICS_PATH
+    drive_helper.append_row({"CAPA_NO": "CAPA-NEW", "DEPARTMENT": "Quality"})
+    assert os.path.exists(f"{path}.log")
+    # the journal now outgrows the (zero) limit, so the next save rewrites the file
+    drive_helper.append_row({"CAPA_NO": "CAPA-NEW2", "DEPARTMENT": "Quality"})
+    assert not os.path.exists(f"{path}.log")
+
+    drive_helper._analytics = None
+    assert drive_helper.analytics_summary()["total"] == 52
@@ -0,0 +1,13 @@
+from export import iter_pages
+from schema import SHEET_COLUMNS
+
+
+def test_export_continues_past_a_gap(fake_sheet):
+    # records at sheet rows 10-29 cleared by hand, leaving blank rows mid-sheet
+    fake_sheet.batch_clear([f"A{r}:BM{r}" for r in range(10, 30)])
+    capa = SHEET_COLUMNS.index("CAPA_NO")
+
+    exported = [row[capa] for page in iter_pages(page_rows=10) for row in page]
+
+    expected = [f"CAPA-{i:06d}" for i in range(50) if not 8 <= i < 28]
+    assert exported == expected
@@ -0,0 +1,163 @@
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from derived_state import DerivedState
+
+# Narrative columns searched by keyword queries
+TEXT_FIELDS = ["WHY1", "WHY2", "WHY3", "WHY4", "WHY5", "CONCLUSION", "ACTIONS", "C_ACTIONS", "P_ACTIONS"]
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "of", "on", "or", "that", "the", "to", "was", "were", "with", "not", "no", "due",
+}
+
+
+def stem(token: str) -> str:
+    """Light suffix stripping so 'leaks', 'leaking' and 'leaked' share a term."""
+    if len(token) <= 3:
+        return token
+    if token.endswith("sses"):
+        token = token[:-2]
+    elif token.endswith("ies") and len(token) > 4:
+        token = token[:-3] + "y"
+    elif (token.endswith("es") and token[-3] in "sxz") or token.endswith(("ches", "shes")):
+        token = token[:-2]
+    elif token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        token = token[:-1]
+    for suffix in ("ingly", "edly", "ing", "ed", "ly"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[:-len(suffix)]
+            break
+    if token.endswith("e") and len(token) > 4:
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(t) for t in _TOKEN.findall(str(text).lower()) if t not in _STOPWORDS]
+
+
+def _text_of(row: Dict[str, str]) -> Dict[str, str]:
+    return {f: row[f] for f in TEXT_FIELDS if row.get(f)}
+
+
+def _fingerprint(text: Dict[str, str], capa_key: str) -> int:
+    blob = "\x1f".join([capa_key] + [text.get(f, "") for f in TEXT_FIELDS]).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(blob, digest_size=8).digest(), "big")
+
+
+class TextIndex(DerivedState):
+    """
+    Inverted index over TEXT_FIELDS, built incrementally: rows are added in storage
+    order per segment (worksheet partition) and 'row_counts' records how many of
+    each have been indexed; rows edited since are re-indexed with update_rows().
+    Documents are keyed by segment and row position; searches return the
+    (normalized) CAPA number of each hit.
+    """
+
+    def __init__(self, source: str = ""):
+        super().__init__(source)
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_len: Dict[str, int] = {}
+        self.doc_capa: Dict[str, str] = {}
+        self.total_len = 0
+
+    def add_rows(self, start: int, rows: List[Dict[str, str]], capa_keys: List[str], segment: str = ""):
+        """Index rows of 'segment' starting at position 'start' (must equal indexed(segment))."""
+        self._record({"segment": segment, "start": start, "keys": list(capa_keys),
+                      "rows": [_text_of(row) for row in rows]})
+
+    def update_rows(self, start: int, rows: List[Dict[str, str]], capa_keys: List[str], segment: str = "") -> int:
+        """Re-index the already indexed rows from 'start' whose text or CAPA number changed; returns how many."""
+        rows = [_text_of(row) for row in rows]
+        changed = self._changed(segment, start, [_fingerprint(r, k) for r, k in zip(rows, capa_keys)])
+        if changed:
+            self._record({"op": "replace", "segment": segment, "positions": changed,
+                          "rows": [rows[p - start] for p in changed], "keys": [capa_keys[p - start] for p in changed]})
+        return len(changed)
+
+    def _apply(self, entry: Dict):
+        segment, rows, keys = entry["segment"], entry["rows"], entry["keys"]
+        if entry.get("op") == "replace":
+            positions = entry["positions"]
+            if any(p >= self.indexed(segment) for p in positions):
+                raise ValueError(f"Index holds {self.indexed(segment)} rows of '{segment}', cannot replace {max(positions)}")
+            self._remove_docs({f"{segment}:{p}" for p in positions})
+        else:
+            start = entry["start"]
+            if start != self.indexed(segment):
+                raise ValueError(f"Index holds {self.indexed(segment)} rows of '{segment}', cannot add at {start}")
+            positions = range(start, start + len(rows))
+            self.row_counts[segment] = start + len(rows)
+        fingerprints = self.fingerprints.setdefault(segment, [])
+        for pos, row, capa_key in zip(positions, rows, keys):
+            doc = f"{segment}:{pos}"
+            terms = Counter()
+            for field in TEXT_FIELDS:
+                terms.update(tokenize(row.get(field, "")))
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[doc] = tf
+            length = sum(terms.values())
+            self.doc_len[doc] = length
+            self.doc_capa[doc] = capa_key
+            self.total_len += length
+            if pos < len(fingerprints):
+                fingerprints[pos] = _fingerprint(row, capa_key)
+            else:
+                fingerprints.append(_fingerprint(row, capa_key))
+
+    def _remove_docs(self, docs: Set[str]):
+        for term in list(self.postings):
+            posting = self.postings[term]
+            if len(docs) < len(posting):
+                hits = [d for d in docs if d in posting]
+            else:
+                hits = [d for d in posting if d in docs]
+            for doc in hits:
+                del posting[doc]
+            if not posting:
+                del self.postings[term]
+        for doc in docs:
+            self.total_len -= self.doc_len.pop(doc, 0)
+            self.doc_capa.pop(doc, None)
+
+    def search(self, query: str, limit: Optional[int] = None) -> Dict[str, float]:
+        """BM25 score per CAPA key for documents matching any query term, best first."""
+        with self.lock:
+            n_docs = len(self.doc_len)
+            if not n_docs:
+                return {}
+            avg_len = self.total_len / n_docs or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc, tf in docs.items():
+                    norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * self.doc_len[doc] / avg_len))
+                    scores[doc] = scores.get(doc, 0.0) + idf * norm
+            by_capa: Dict[str, float] = {}
+            for doc, score in scores.items():
+                capa_key = self.doc_capa.get(doc, "")
+                if capa_key and score > by_capa.get(capa_key, 0.0):
+                    by_capa[capa_key] = score
+            ranked = sorted(by_capa.items(), key=lambda kv: kv[1], reverse=True)
+            return dict(ranked[:limit] if limit else ranked)
+
+    def _state(self) -> Dict:
+        return {"postings": self.postings, "doc_len": self.doc_len, "doc_capa": self.doc_capa}
+
+    def _restore(self, data: Dict):
+        self.postings = data["postings"]
+        self.doc_len = data["doc_len"]
+        self.doc_capa = data["doc_capa"]
+        self.total_len = sum(self.doc_len.values())
@@ -0,0 +1,198 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import scheduler
+from drive_helper import append_rows, capa_exists, normalize_row, refresh_records
+from schema import normalize_capa_no
+
+# Local write-ahead journal for CAPA submissions. Rows are committed here first
+# (SQLite commits are fsync'd), acknowledged to the user, and then flushed to the
+# sheet in batches by a background thread; they are deleted only once Sheets
+# has accepted them, so nothing is lost across a restart.
+QUEUE_PATH = os.environ.get("CAPA_QUEUE_PATH", ".capa_queue.db")
+FLUSH_BATCH_SIZE = 50  # rows per append_rows call
+FLUSH_INTERVAL = 2.0  # seconds between polls of the journal
+MAX_ATTEMPTS = 8  # after this many failures an entry is parked as 'failed'
+BACKOFF_BASE = 2.0  # seconds; doubled on every failed attempt
+BACKOFF_MAX = 300.0
+# A batch being sent is leased for this long so other processes sharing the
+# journal skip it; if the sender dies the lease expires and the batch is retried
+SEND_LEASE = 120.0
+
+_init_lock = threading.Lock()
+_initialized = False
+_flusher: Optional[threading.Thread] = None
+_wake = threading.Event()
+
+
+def _connect() -> sqlite3.Connection:
+    global _initialized
+    conn = sqlite3.connect(QUEUE_PATH, timeout=30)
+    if not _initialized:
+        with _init_lock:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " capa_key TEXT NOT NULL,"
+                " row TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending',"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt REAL NOT NULL DEFAULT 0,"
+                " last_error TEXT,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_due ON entries (status, next_attempt)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_capa ON entries (capa_key)")
+            conn.commit()
+            _initialized = True
+    return conn
+
+
+def _backoff(attempts: int) -> float:
+    # Exponential backoff with "equal jitter": half fixed, half random
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempts))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def enqueue_row(data: Dict) -> int:
+    """
+    Journal a CAPA submission for writing to the sheet and return its queue id.
+    The row is durable once this returns; the background flusher sends it.
+    """
+    row = normalize_row(data)
+    capa_no = data.get("CAPA_NO") or data.get("capa_no") or ""
+    conn = _connect()
+    try:
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO entries (capa_key, row, created_at) VALUES (?, ?, ?)",
+                (normalize_capa_no(capa_no), json.dumps(row), time.time()),
+            )
+        entry_id = cur.lastrowid
+    finally:
+        conn.close()
+    start_flusher()
+    _wake.set()
+    return entry_id
+
+
+def is_queued(capa_no: str) -> bool:
+    """True if a submission with this CAPA number is still waiting to reach the sheet."""
+    conn = _connect()
+    try:
+        hit = conn.execute("SELECT 1 FROM entries WHERE capa_key = ? LIMIT 1", (normalize_capa_no(capa_no),)).fetchone()
+    finally:
+        conn.close()
+    return hit is not None
+
+
+def queue_counts() -> Dict[str, int]:
+    conn = _connect()
+    try:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM entries GROUP BY status").fetchall())
+    finally:
+        conn.close()
+    return {"pending": counts.get("pending", 0), "failed": counts.get("failed", 0)}
+
+
+def retry_failed() -> int:
+    """Move parked entries back to pending; returns how many were requeued."""
+    conn = _connect()
+    try:
+        with conn:
+            cur = conn.execute(
+                "UPDATE entries SET status = 'pending', attempts = 0, next_attempt = 0 WHERE status = 'failed'"
+            )
+        requeued = cur.rowcount
+    finally:
+        conn.close()
+    _wake.set()
+    return requeued
+
+
+def _claim_batch(conn: sqlite3.Connection) -> List[tuple]:
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        batch = conn.execute(
+            "SELECT id, row, attempts, capa_key FROM entries"
+            " WHERE status = 'pending' AND next_attempt <= ? ORDER BY id LIMIT ?",
+            (now, FLUSH_BATCH_SIZE),
+        ).fetchall()
+        if batch:
+            conn.executemany(
+                "UPDATE entries SET next_attempt = ? WHERE id = ?",
+                [(now + SEND_LEASE, entry_id) for entry_id, _, _, _ in batch],
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return batch
+
+
+def flush_once() -> int:
+    """Send one batch of due entries. Returns the number of rows written to the sheet."""
+    conn = sqlite3.connect(QUEUE_PATH, timeout=30, isolation_level=None)
+    try:
+        _connect().close()  # make sure the table exists
+        batch = _claim_batch(conn)
+        if not batch:
+            return 0
+
+        # A retried batch may have reached the sheet even though the call failed
+        # (e.g. a timeout after the write); skip rows that are already there.
+        if any(attempts for _, _, attempts, _ in batch):
+            refresh_records()
+        send, done = [], []
+        for entry_id, row_json, attempts, capa_key in batch:
+            if attempts and capa_key and capa_exists(capa_key):
+                done.append(entry_id)
+            else:
+                send.append((entry_id, json.loads(row_json), attempts))
+
+        try:
+            append_rows([row for _, row, _ in send])
+            done.extend(entry_id for entry_id, _, _ in send)
+            conn.executemany("DELETE FROM entries WHERE id = ?", [(i,) for i in done])
+            return len(send)
+        except Exception as e:
+            now = time.time()
+            conn.executemany("DELETE FROM entries WHERE id = ?", [(i,) for i in done])
+            for entry_id, _, attempts in send:
+                attempts += 1
+                status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+                conn.execute(
+                    "UPDATE entries SET attempts = ?, status = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                    (attempts, status, now + _backoff(attempts), str(e), entry_id),
+                )
+            print(f"⚠️ Failed to flush {len(send)} queued CAPA row(s) to Google Sheet: {e}")
+            return 0
+    finally:
+        conn.close()
+
+
+def _flush_loop():
+    scheduler.set_priority(scheduler.BULK)
+    while True:
+        try:
+            while flush_once():
+                pass
+        except Exception as e:
+            print(f"⚠️ CAPA write queue flush error: {e}")
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+
+
+def start_flusher():
+    """Start the background flusher once per process (safe to call on every rerun)."""
+    global _flusher
+    with _init_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="capa-write-queue", daemon=True)
+            _flusher.start()